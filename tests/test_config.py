@@ -0,0 +1,155 @@
+import numpy as np
+import pytest
+from skimage.measure import regionprops
+
+import tracks_interactions.db.config_functions
+from tracks_interactions.db.config_functions import (
+    MeasurementPlan,
+    create_calculate_signals_function,
+)
+
+CUSTOM_MODULE = """
+import numpy as np
+
+# number of times the module was executed
+LOADED = []
+LOADED.append(1)
+
+
+def max_signal(cell, t, ch_data_list, kwargs):
+    return [
+        np.asarray(ch[t, cell.slice[0], cell.slice[1]]).max()
+        for ch in ch_data_list
+    ]
+"""
+
+
+@pytest.fixture(scope='function')
+def config(tmp_path):
+
+    module_path = tmp_path / 'custom_measurements.py'
+    module_path.write_text(CUSTOM_MODULE)
+
+    return {
+        'signal_channels': [{'name': 'ch0'}, {'name': 'ch1'}],
+        'cell_measurements': [
+            {'function': 'area', 'source': 'regionprops'},
+            {
+                'function': 'intensity_mean',
+                'name': 'mean',
+                'source': 'regionprops',
+                'channels': ['ch0', 'ch1'],
+            },
+            {
+                'function': 'ring_intensity',
+                'name': 'ring',
+                'source': 'track_gardener',
+                'channels': ['ch1'],
+                'ring_width': 2,
+            },
+            {
+                'function': 'max_signal',
+                'name': 'max',
+                'source': str(module_path),
+                'channels': ['ch0'],
+            },
+        ],
+    }
+
+
+@pytest.fixture(scope='function')
+def cells_channels():
+
+    labels = np.zeros([50, 60], dtype=np.int32)
+    labels[10:20, 10:25] = 1
+    labels[30:40, 35:45] = 2
+
+    rng = np.random.default_rng(0)
+    ch_list = [rng.integers(0, 1000, [2, 50, 60]) for _ in range(2)]
+
+    return regionprops(labels), ch_list
+
+
+def test_plan_resolves_functions_once(config, cells_channels, mocker):
+    """
+    Test that functions of measurements are loaded when the plan is made.
+    """
+
+    cells, ch_list = cells_channels
+
+    plan = create_calculate_signals_function(config)
+    assert isinstance(plan, MeasurementPlan)
+    assert len(plan) == 4
+    assert plan.margin == 2
+
+    module_spy = mocker.spy(
+        tracks_interactions.db.config_functions, 'load_function_from_module'
+    )
+    path_spy = mocker.spy(
+        tracks_interactions.db.config_functions, 'load_function_from_path'
+    )
+
+    for t in range(2):
+        for cell in cells:
+            signals = plan(cell, t, ch_list)
+
+            assert signals['area'] == cell.area
+            assert signals['ch0_max'] == ch_list[0][t][cell.slice].max()
+            np.testing.assert_allclose(
+                signals['ch1_mean'],
+                ch_list[1][t][cell.slice][cell.image].mean(),
+            )
+            assert 'ch1_ring' in signals
+
+    assert not module_spy.called
+    assert not path_spy.called
+
+    # the custom module was executed once
+    custom_function = plan.functions[-1][1]
+    assert custom_function.__globals__['LOADED'] == [1]
+
+
+def test_plan_timings(config, cells_channels):
+    """
+    Test recording time spent in measurements.
+    """
+
+    cells, ch_list = cells_channels
+
+    plan = MeasurementPlan(config)
+    for cell in cells:
+        plan(cell, 0, ch_list)
+
+    report = plan.timing_report()
+
+    assert set(report) == {'area', 'signal_cube', 'mean', 'ring', 'max'}
+    for calls, total, per_call in report.values():
+        assert calls == len(cells)
+        assert total >= 0
+        assert per_call == pytest.approx(total / calls)
+
+    plan.reset_timings()
+    assert plan.timing_report() == {}
+
+
+def test_plan_missing_function(config):
+    """
+    Test that a missing custom function is reported when making the plan.
+    """
+
+    config['cell_measurements'][-1]['function'] = 'not_there'
+
+    with pytest.raises(ValueError, match='not_there'):
+        MeasurementPlan(config)
+
+
+def test_no_measurements():
+    """
+    Test that no function is made without measurements.
+    """
+
+    config = {'signal_channels': [{'name': 'ch0'}]}
+    assert create_calculate_signals_function(config) is None
+
+    config['cell_measurements'] = []
+    assert create_calculate_signals_function(config) is None
@@ -1,11 +1,24 @@
 from unittest.mock import MagicMock
 
+import dask.array as da
 import numpy as np
 import pytest
-from sqlalchemy import MetaData, create_engine, inspect
+from skimage.measure import regionprops
+from skimage.morphology import dilation, disk
+from sqlalchemy import (
+    MetaData,
+    create_engine,
+    event,
+    inspect,
+    select,
+    text,
+)
 from sqlalchemy.orm import make_transient, sessionmaker
 
 import tracks_interactions.db.db_functions as fdb
+from tracks_interactions.db.config_functions import (
+    create_calculate_signals_function,
+)
 from tracks_interactions.db.db_functions import (
     add_new_core_CellDB,
     cellsDB_after_trackDB,
@@ -17,7 +30,12 @@ from tracks_interactions.db.db_functions import (
     remove_CellDB,
     trackDB_after_cellDB,
 )
-from tracks_interactions.db.db_model import NO_PARENT, CellDB, TrackDB
+from tracks_interactions.db.db_model import (
+    NO_PARENT,
+    CellDB,
+    TrackClosure,
+    TrackDB,
+)
 
 
 @pytest.fixture(scope='function')
@@ -1101,6 +1119,25 @@ def test_remove_CellDB(db_session):
     assert len(c) == 0
 
 
+def test_get_cell_edits(db_session, monkeypatch):
+    """Test - follow extents of edited cells"""
+    monkeypatch.setattr(fdb, 'CELL_EDITS_KEPT', 2)
+
+    edits, position = fdb.get_cell_edits(db_session)
+    assert (edits, position) == ([], 0)
+
+    for t in [20, 21, 22]:
+        cell = db_session.query(CellDB).filter_by(track_id=20422, t=t).one()
+        extent = (t, cell.bbox_0, cell.bbox_1, cell.bbox_2, cell.bbox_3)
+        remove_CellDB(db_session, 20422, t)
+
+    assert fdb.get_cell_edits(db_session, 2) == ([extent], 3)
+    assert fdb.get_cell_edits(db_session, 3) == ([], 3)
+
+    # the first edit is no longer kept
+    assert fdb.get_cell_edits(db_session, 0) == (None, 3)
+
+
 def test_remove_CellDB_first(db_session):
     """Test - remove a cell"""
     cell_id = 20426
@@ -1223,3 +1260,655 @@ def test_add_tags(db_session):
     )
 
     assert cell_list.tags['apoptosis'], f'Expected True, got {cell_list.tags}'
+
+
+def test_get_cells_in_view_rtree(db_session):
+    """
+    Test that the R*Tree index returns the same cells as a plain query.
+    """
+
+    view = (110, 5000, 5300, 4400, 4700)
+
+    expected = fdb.get_cells_in_view(db_session, *view)
+    assert not fdb.has_cell_rtree(db_session)
+    assert len(expected) > 0
+
+    fdb.create_cell_rtree(db_session)
+    assert fdb.has_cell_rtree(db_session)
+
+    cells = fdb.get_cells_in_view(db_session, *view)
+
+    expected_ids = sorted(cell.track_id for cell in expected)
+    cells_ids = sorted(cell.track_id for cell in cells)
+    assert (
+        cells_ids == expected_ids
+    ), f'Expected {expected_ids}, got {cells_ids}'
+
+
+def test_cell_rtree_in_sync(db_session):
+    """
+    Test that the R*Tree index follows removal and addition of cells.
+    """
+
+    fdb.create_cell_rtree(db_session)
+
+    cell_id = 20422
+    current_frame = 20
+
+    cell = (
+        db_session.query(CellDB)
+        .filter_by(track_id=cell_id)
+        .filter_by(t=current_frame)
+        .one()
+    )
+    view = (
+        current_frame,
+        cell.bbox_0,
+        cell.bbox_2,
+        cell.bbox_1,
+        cell.bbox_3,
+    )
+
+    remove_CellDB(db_session, cell_id, current_frame)
+
+    cells = fdb.get_cells_in_view(db_session, *view)
+    assert cell_id not in [x.track_id for x in cells]
+
+    # add the cell back
+    region = MagicMock()
+    region.label = cell_id
+    region.centroid = (view[1] + 1, view[3] + 1)
+    region.bbox = (view[1], view[3], view[2], view[4])
+    region.image = np.ones((view[2] - view[1], view[4] - view[3]), dtype=bool)
+
+    add_new_core_CellDB(db_session, current_frame, region)
+
+    cells = fdb.get_cells_in_view(db_session, *view)
+    assert cell_id in [x.track_id for x in cells]
+
+
+def test_query_cells_deferred_columns(db_session):
+    """
+    Test that masks and signals are loaded only on request.
+    """
+
+    db_session.expunge_all()
+
+    cell = db_session.query(CellDB).filter_by(track_id=20422, t=20).one()
+    assert 'mask' not in cell.__dict__
+    assert 'signals' not in cell.__dict__
+
+    db_session.expunge_all()
+
+    cell = (
+        fdb.query_cells(db_session, mask=True, signals=True)
+        .filter_by(track_id=20422, t=20)
+        .one()
+    )
+    assert 'mask' in cell.__dict__
+    assert 'signals' in cell.__dict__
+    assert cell.mask.ndim == 2
+
+
+def test_get_track_signals_store(db_session):
+    """
+    Test that the signal store returns the same time series as signals of cells.
+    """
+
+    active_label = 20422
+    signal_list = ['area', 'ch0_nuc', 'not_a_signal']
+
+    t_exp, values_exp = fdb.get_track_signals(
+        db_session, active_label, signal_list
+    )
+
+    assert t_exp[0] == 0
+    assert t_exp[-1] == 42
+    assert values_exp.shape == (43, 3)
+    assert np.all(np.isnan(values_exp[:, 2]))
+
+    fdb.create_signal_store(db_session)
+    assert fdb.has_signal_store(db_session)
+
+    t, values = fdb.get_track_signals(db_session, active_label, signal_list)
+
+    np.testing.assert_array_equal(t, t_exp)
+    np.testing.assert_allclose(values, values_exp)
+
+
+def test_signal_store_in_sync(db_session):
+    """
+    Test that the signal store follows cutting and removal of cells.
+    """
+
+    fdb.create_signal_store(db_session)
+
+    active_label = 20422
+    current_frame = 20
+
+    remove_CellDB(db_session, active_label, current_frame)
+
+    t, values = fdb.get_track_signals(db_session, active_label, ['area'])
+    assert np.isnan(values[t == current_frame, 0]).all()
+
+    new_track = newTrack_number(db_session)
+    cellsDB_after_trackDB(
+        db_session, active_label, 30, new_track, direction='after'
+    )
+
+    t, _ = fdb.get_track_signals(db_session, active_label, ['area'])
+    assert t[-1] == 29
+
+    t, _ = fdb.get_track_signals(db_session, new_track, ['area'])
+    assert t[0] == 30
+
+
+def _expected_closure(session):
+    """
+    Compute closure pairs from parent pointers of the tracks table.
+    """
+
+    parents = dict(
+        session.query(TrackDB.track_id, TrackDB.parent_track_id).all()
+    )
+
+    expected = set()
+    for track_id in parents:
+        depth = 0
+        ancestor = track_id
+        while ancestor in parents:
+            expected.add((ancestor, track_id, depth))
+            ancestor = parents[ancestor]
+            depth += 1
+
+    return expected
+
+
+def test_get_descendants_closure(db_session):
+    """
+    Test that lineage lookups with the closure table match the recursive query.
+    """
+
+    cte_descendants = [x.track_id for x in get_descendants(db_session, 37401)]
+    cte_ancestors = [x.track_id for x in fdb.get_ancestors(db_session, 37403)]
+
+    fdb.create_track_closure(db_session)
+    assert fdb.has_track_closure(db_session)
+
+    descendants = [x.track_id for x in get_descendants(db_session, 37401)]
+    assert descendants[0] == 37401
+    assert sorted(descendants) == sorted(cte_descendants)
+
+    ancestors = [x.track_id for x in fdb.get_ancestors(db_session, 37403)]
+    assert ancestors == cte_ancestors
+    assert ancestors == [37403, 37401]
+
+
+def test_track_closure_in_sync(db_session):
+    """
+    Test that the closure table follows cutting, merging, connecting
+    and deleting of tracks.
+    """
+
+    fdb.create_track_closure(db_session)
+
+    closure = select(
+        TrackClosure.c.ancestor,
+        TrackClosure.c.descendant,
+        TrackClosure.c.depth,
+    )
+
+    def closure_rows():
+        return {tuple(x) for x in db_session.execute(closure).all()}
+
+    assert closure_rows() == _expected_closure(db_session)
+
+    _, new_track = cut_trackDB(db_session, 20422, 5)
+    assert closure_rows() == _expected_closure(db_session)
+
+    integrate_trackDB(db_session, 'merge', 20422, new_track, 5)
+    assert closure_rows() == _expected_closure(db_session)
+
+    integrate_trackDB(db_session, 'connect', 37401, 20422, 30)
+    assert closure_rows() == _expected_closure(db_session)
+
+    delete_trackDB(db_session, 37401)
+    assert closure_rows() == _expected_closure(db_session)
+
+
+def test_track_closure_other_writers(db_session):
+    """
+    Test that the closure table follows tracks written by other sessions
+    and by SQL outside of the database functions.
+    """
+
+    # the table is missing when the session starts
+    assert not fdb.has_track_closure(db_session)
+
+    other_session = sessionmaker(bind=db_session.get_bind())()
+    fdb.create_track_closure(other_session)
+    other_session.close()
+
+    closure = select(
+        TrackClosure.c.ancestor,
+        TrackClosure.c.descendant,
+        TrackClosure.c.depth,
+    )
+
+    def closure_rows():
+        return {tuple(x) for x in db_session.execute(closure).all()}
+
+    _, new_track = cut_trackDB(db_session, 20422, 5)
+    assert closure_rows() == _expected_closure(db_session)
+
+    # a child written before its parent
+    db_session.execute(
+        text(
+            """
+            INSERT INTO tracks (track_id, parent_track_id, root, t_begin, t_end)
+            VALUES (90002, 90001, 90001, 5, 6), (90003, 90002, 90001, 7, 8)
+            """
+        )
+    )
+    db_session.execute(
+        text(
+            """
+            INSERT INTO tracks (track_id, parent_track_id, root, t_begin, t_end)
+            VALUES (90001, 20422, 20422, 0, 4)
+            """
+        )
+    )
+    assert closure_rows() == _expected_closure(db_session)
+
+    db_session.execute(
+        text('UPDATE tracks SET parent_track_id = -1 WHERE track_id = 90002')
+    )
+    assert closure_rows() == _expected_closure(db_session)
+
+    db_session.execute(
+        text(
+            'UPDATE tracks SET parent_track_id = 37401 WHERE track_id = 90002'
+        )
+    )
+    assert closure_rows() == _expected_closure(db_session)
+
+    db_session.execute(text('DELETE FROM tracks WHERE track_id = 90003'))
+    assert closure_rows() == _expected_closure(db_session)
+
+
+def test_cut_trackDB_modified_tracks(db_session):
+    """
+    Test that a cut reports the offspring moved to the new track.
+    """
+
+    fdb.pop_modified_tracks(db_session)
+
+    _, new_track = cut_trackDB(db_session, 37401, 30)
+
+    assert fdb.pop_modified_tracks(db_session) == {37402, 37403}
+    assert fdb.pop_modified_tracks(db_session) == set()
+
+    children = (
+        db_session.query(TrackDB)
+        .filter(TrackDB.track_id.in_([37402, 37403]))
+        .all()
+    )
+    assert all(x.parent_track_id == new_track for x in children)
+    assert all(x.root == new_track for x in children)
+
+
+def test_transaction_single_commit(db_session):
+    """
+    Test that a composite edit inside a transaction is committed once.
+    """
+
+    commits = []
+    event.listen(db_session, 'after_commit', lambda session: commits.append(1))
+
+    active_label = 20422
+    current_frame = 5
+
+    with fdb.transaction(db_session):
+        with fdb.transaction(db_session):
+            _, new_track = cut_trackDB(db_session, active_label, current_frame)
+        cellsDB_after_trackDB(
+            db_session,
+            active_label,
+            current_frame,
+            new_track,
+            direction='after',
+        )
+
+        assert len(commits) == 0
+
+    assert len(commits) == 1
+    assert db_session.query(TrackDB).filter_by(track_id=new_track).count() == 1
+
+
+def test_transaction_rollback(db_session):
+    """
+    Test that a failing composite edit leaves the database untouched.
+    """
+
+    tracks_before = db_session.query(TrackDB).count()
+
+    with pytest.raises(ValueError):
+        with fdb.transaction(db_session):
+            cut_trackDB(db_session, 20422, 5)
+            raise ValueError('Failing step')
+
+    assert db_session.query(TrackDB).count() == tracks_before
+    assert db_session.info['transaction_depth'] == 0
+
+
+def test_newTrack_number_first_unused(db_session):
+    """
+    Test getting the lowest unused track number.
+    """
+
+    # tracks 1 - 5 are added by the fixture
+    assert newTrack_number(db_session, mode='first_unused') == 6
+
+    # a deleted track frees its number
+    delete_trackDB(db_session, 4)
+    assert newTrack_number(db_session, mode='first_unused') == 4
+
+    with pytest.raises(ValueError):
+        newTrack_number(db_session, mode='random')
+
+
+def test_reserve_track_number(db_session):
+    """
+    Test that reserved numbers are not given out twice
+    before their tracks are created.
+    """
+
+    next_track = newTrack_number(db_session)
+
+    with fdb.transaction(db_session):
+        first = fdb.reserve_track_number(db_session)
+        second = fdb.reserve_track_number(db_session)
+        assert newTrack_number(db_session) == next_track + 2
+
+    assert (first, second) == (next_track, next_track + 1)
+
+    # no tracks were created, numbers are released by the commit
+    assert newTrack_number(db_session) == next_track
+
+    first_unused = newTrack_number(db_session, mode='first_unused')
+    assert fdb.reserve_track_number(db_session, mode='first_unused') == (
+        first_unused
+    )
+    assert newTrack_number(db_session, mode='first_unused') != first_unused
+
+    # and by a rollback
+    db_session.rollback()
+    assert newTrack_number(db_session, mode='first_unused') == first_unused
+
+
+def test_get_cell_density_in_view(db_session):
+    """
+    Test aggregating cells of a field of view on a grid.
+    """
+
+    # 5 cells at t = 130
+    density = fdb.get_cell_density_in_view(
+        db_session, 130, 0, 10000, 0, 10000, bin_size=10000
+    )
+
+    assert density.shape == (1, 3)
+    assert density[0, 2] == 5
+
+    density = fdb.get_cell_density_in_view(
+        db_session, 130, 0, 10000, 0, 10000, bin_size=1
+    )
+
+    assert density.shape == (5, 3)
+    rows = db_session.query(CellDB.row).filter(CellDB.t == 130).all()
+    assert sorted(density[:, 0]) == sorted(x[0] for x in rows)
+
+    density = fdb.get_cell_density_in_view(
+        db_session, 1000, 0, 10000, 0, 10000, bin_size=100
+    )
+    assert density.shape == (0, 3)
+
+
+def _paint_cells(shape, cells):
+    """
+    Paint cells one by one with numpy, later cells overwrite earlier ones.
+    """
+    frame = np.zeros(shape, dtype=np.uint32)
+    for cell in cells:
+        region = frame[cell.bbox_0 : cell.bbox_2, cell.bbox_1 : cell.bbox_3]
+        region[cell.mask] = cell.track_id
+
+    return frame
+
+
+def test_rasterize_cells(db_session):
+    """
+    Test painting cells with the batch rasterizer.
+    """
+
+    cells = db_session.query(CellDB).filter(CellDB.t == 130).all()
+    r0 = min(x.bbox_0 for x in cells)
+    c0 = min(x.bbox_1 for x in cells)
+    r1 = max(x.bbox_2 for x in cells)
+    c1 = max(x.bbox_3 for x in cells)
+
+    frame = np.zeros((r1, c1), dtype=np.uint32)
+    fdb.rasterize_cells(frame, cells)
+    np.testing.assert_array_equal(frame, _paint_cells((r1, c1), cells))
+
+    # the last cell overwrites the first one
+    frame = np.zeros((r1, c1), dtype=np.uint32)
+    fdb.rasterize_cells(frame, cells[1:] + cells[:1])
+    assert (frame == cells[0].track_id).sum() == cells[0].mask.sum()
+
+    # window of the frame - cells are clipped
+    origin = ((r0 + r1) // 2, (c0 + c1) // 2)
+    window = np.zeros((r1 - origin[0], c1 - origin[1]), dtype=np.uint32)
+    fdb.rasterize_cells(window, cells, origin=origin)
+    np.testing.assert_array_equal(
+        window, _paint_cells((r1, c1), cells)[origin[0] :, origin[1] :]
+    )
+
+
+def test_render_frame(db_session):
+    """
+    Test painting a frame from stored masks.
+    """
+
+    cells = db_session.query(CellDB).filter(CellDB.t == 130).all()
+    shape = (
+        max(x.bbox_2 for x in cells) + 5,
+        max(x.bbox_3 for x in cells) + 5,
+    )
+
+    frame = fdb.render_frame(db_session, 130, shape)
+
+    assert frame.dtype == np.uint32
+    np.testing.assert_array_equal(frame, _paint_cells(shape, cells))
+
+
+def test_get_track_trajectory(db_session):
+    """
+    Test getting positions of a track.
+    """
+
+    trajectory = fdb.get_track_trajectory(db_session, 37402)
+    cells = (
+        db_session.query(CellDB).filter_by(track_id=37402).order_by(CellDB.t)
+    )
+
+    assert trajectory.shape == (cells.count(), 3)
+    np.testing.assert_array_equal(
+        trajectory, [[x.t, x.row, x.col] for x in cells]
+    )
+
+    assert fdb.get_track_trajectory(db_session, 123456).shape == (0, 3)
+
+
+def _signal_test_cells(ids=(1, 2, 3, 4)):
+    """
+    Cells and channels to test signal calculation.
+    """
+
+    labels = np.zeros([200, 300], dtype=np.int32)
+    labels[20:30, 40:55] = ids[0]
+    labels[100:120, 200:210] = ids[1]
+    labels[150:170, 10:25] = ids[2]
+    labels[0:10, 290:300] = ids[3]
+
+    rng = np.random.default_rng(0)
+    ch_list = [
+        da.from_array(
+            rng.integers(0, 1000, [3, 200, 300], dtype=np.uint16),
+            chunks=(1, 64, 64),
+        )
+        for _ in range(2)
+    ]
+
+    config = {
+        'signal_channels': [{'name': 'ch0'}, {'name': 'ch1'}],
+        'cell_measurements': [
+            {'function': 'area', 'source': 'regionprops'},
+            {
+                'function': 'intensity_mean',
+                'name': 'mean',
+                'source': 'regionprops',
+                'channels': ['ch0', 'ch1'],
+            },
+            {
+                'function': 'ring_intensity',
+                'name': 'ring',
+                'source': 'track_gardener',
+                'channels': ['ch0', 'ch1'],
+                'ring_width': 3,
+            },
+        ],
+    }
+    signal_function = create_calculate_signals_function(config)
+
+    return regionprops(labels), ch_list, signal_function
+
+
+def test_calculate_signals_batch():
+    """
+    Test that batch signals agree with signals calculated per cell.
+    """
+
+    cells, ch_list, signal_function = _signal_test_cells()
+    t = 1
+
+    assert signal_function.margin == 3
+
+    expected = [signal_function(cell, t, ch_list) for cell in cells]
+
+    for max_workers in [1, 4]:
+        result = fdb.calculate_signals_batch(
+            cells, t, ch_list, signal_function, max_workers=max_workers
+        )
+
+        assert len(result) == len(expected)
+        for res, exp in zip(result, expected):
+            assert res.keys() == exp.keys()
+            for key in exp:
+                np.testing.assert_allclose(res[key], exp[key])
+
+
+def test_channel_window():
+    """
+    Test that reading outside of a window falls back to the channel.
+    """
+
+    _, ch_list, _ = _signal_test_cells()
+    ch = ch_list[0]
+
+    window = fdb.ChannelWindow(ch, 1, (10, 20, 50, 60))
+
+    assert window.shape == ch.shape
+    assert isinstance(window.data, np.ndarray)
+
+    # served from memory
+    np.testing.assert_array_equal(
+        window[1, 15:40, 20:60], ch[1, 15:40, 20:60].compute()
+    )
+    assert isinstance(window[1, 15:40, 20:60], np.ndarray)
+
+    # other time point and outside of the window
+    np.testing.assert_array_equal(window[2, 15:40, 20:60], ch[2, 15:40, 20:60])
+    np.testing.assert_array_equal(window[1, 5:40, 20:60], ch[1, 5:40, 20:60])
+
+
+def test_add_new_CellDB_batch(db_session):
+    """
+    Test adding cells of a frame at once.
+    """
+
+    fdb.create_signal_store(db_session)
+
+    new_ids = [newTrack_number(db_session) + i for i in range(4)]
+    cells, ch_list, signal_function = _signal_test_cells(new_ids)
+    current_frame = 1
+
+    fdb.add_new_CellDB_batch(
+        db_session,
+        current_frame,
+        cells,
+        ch_list=ch_list,
+        signal_function=signal_function,
+    )
+
+    for cell in cells:
+        new_id = cell.label
+        cell_db = (
+            db_session.query(CellDB)
+            .filter_by(track_id=new_id, t=current_frame)
+            .one()
+        )
+        assert cell_db.tags == {'modified': True}
+        assert cell_db.signals['area'] == cell.area
+
+        track = db_session.query(TrackDB).filter_by(track_id=new_id).one()
+        assert (track.t_begin, track.t_end) == (current_frame, current_frame)
+
+        t, values = fdb.get_track_signals(
+            db_session, new_id, ['area', 'ch1_ring']
+        )
+        np.testing.assert_array_equal(t, [current_frame])
+        np.testing.assert_allclose(
+            values[0],
+            [cell_db.signals['area'], cell_db.signals['ch1_ring']],
+        )
+
+
+def test_ring_intensity():
+    """
+    Test ring intensity against dilation of cells with a disk.
+    """
+
+    cells, ch_list, _ = _signal_test_cells()
+    t = 2
+    kwargs = {'ring_width': 4}
+
+    # cells at the border of the image are included
+    assert any(cell.bbox[3] == ch_list[0].shape[2] for cell in cells)
+
+    expected = []
+    for cell in cells:
+        labels = np.zeros(ch_list[0].shape[1:], dtype=bool)
+        labels[cell.slice] = cell.image
+        ring = dilation(labels, disk(4)) & ~labels
+        expected.append([ch[t].compute()[ring].mean() for ch in ch_list])
+
+    result = [fdb.ring_intensity(cell, t, ch_list, kwargs) for cell in cells]
+    np.testing.assert_allclose(result, expected)
+
+    result = fdb.ring_intensity_batch(cells, t, ch_list, kwargs)
+    np.testing.assert_allclose(result, expected)
+
+    # channels in memory
+    ch_list = [ch.compute() for ch in ch_list]
+    result = fdb.ring_intensity_batch(cells, t, ch_list, kwargs)
+    np.testing.assert_allclose(result, expected)
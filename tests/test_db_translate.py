@@ -0,0 +1,201 @@
+import importlib
+import sys
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import Boolean, Column, Integer, PickleType, create_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+from tracks_interactions.db.db_model import CellDB, TrackDB
+
+UltrackBase = declarative_base()
+
+
+class NodeDB(UltrackBase):
+    """
+    Nodes table of an ultrack database, only columns read by the ingest.
+    """
+
+    __tablename__ = 'nodes'
+
+    id = Column(Integer, primary_key=True)
+    selected = Column(Boolean)
+    pickle = Column(PickleType)
+
+
+class Node:
+    """
+    Segment of an ultrack node.
+    """
+
+    def __init__(self, bbox, mask):
+        self.bbox = bbox
+        self.mask = mask
+
+
+# solution - 3 tracks, the track 1 divides into 2 and 3
+SOLUTION = pd.DataFrame(
+    {
+        't': [0, 1, 2, 2, 3, 3],
+        'y': [10, 11, 5, 20, 6, 21],
+        'x': [30, 31, 25, 40, 26, 41],
+        'track_id': [1, 1, 2, 3, 2, 3],
+        'parent_track_id': [-1, -1, 1, 1, 1, 1],
+        'root': [1, 1, 1, 1, 1, 1],
+    },
+    index=[101, 102, 201, 301, 202, 302],
+)
+
+
+@pytest.fixture(scope='function')
+def translate(monkeypatch):
+    """
+    The module with ultrack replaced by stubs.
+    """
+
+    modules = {
+        'ultrack': {},
+        'ultrack.core': {},
+        'ultrack.core.database': {'NodeDB': NodeDB},
+        'ultrack.core.export': {},
+        'ultrack.core.export.utils': {
+            'solution_dataframe_from_sql': lambda path: SOLUTION.copy()
+        },
+        'ultrack.tracks': {},
+        'ultrack.tracks.graph': {
+            '_create_tracks_forest': None,
+            '_fast_path_transverse': None,
+        },
+    }
+    for name, attributes in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        monkeypatch.setitem(sys.modules, name, module)
+
+    monkeypatch.delitem(
+        sys.modules, 'tracks_interactions.db.db_translate_functions', False
+    )
+    module = importlib.import_module(
+        'tracks_interactions.db.db_translate_functions'
+    )
+
+    # track ids of the solution are given
+    monkeypatch.setattr(module, 'add_track_ids_to_tracks_df', lambda df: df)
+
+    yield module
+
+    sys.modules.pop('tracks_interactions.db.db_translate_functions', None)
+
+
+@pytest.fixture(scope='function')
+def ultrack_db(tmp_path):
+    db_path = tmp_path / 'ultrack.db'
+    engine = create_engine(f'sqlite:///{db_path}')
+    UltrackBase.metadata.create_all(engine)
+
+    rng = np.random.default_rng(0)
+    session = sessionmaker(bind=engine)()
+    for node_id, (y, x) in zip(SOLUTION.index, SOLUTION[['y', 'x']].values):
+        mask = rng.random((4, 5)) > 0.5
+        session.add(
+            NodeDB(
+                id=int(node_id),
+                selected=True,
+                pickle=Node((y - 2, x - 2, y + 2, x + 3), mask),
+            )
+        )
+    # not a part of the solution
+    session.add(
+        NodeDB(
+            id=999,
+            selected=False,
+            pickle=Node((0, 0, 1, 1), np.ones((1, 1), dtype=bool)),
+        )
+    )
+    session.commit()
+    session.close()
+    engine.dispose()
+
+    return db_path
+
+
+def test_tracks_df_from_cells_df(translate):
+    """
+    Test summarizing cells into tracks.
+    """
+
+    tracks_df = translate.tracks_df_from_cells_df(SOLUTION)
+
+    assert tracks_df.to_dict('records') == [
+        {
+            'track_id': 1,
+            'parent_track_id': -1,
+            'root': 1,
+            't_begin': 0,
+            't_end': 1,
+        },
+        {
+            'track_id': 2,
+            'parent_track_id': 1,
+            'root': 1,
+            't_begin': 2,
+            't_end': 3,
+        },
+        {
+            'track_id': 3,
+            'parent_track_id': 1,
+            'root': 1,
+            't_begin': 2,
+            't_end': 3,
+        },
+    ]
+
+
+def test_ingest_ultrack_solution(translate, ultrack_db, tmp_path):
+    """
+    Test ingesting a solution in several chunks.
+    """
+
+    db_path = tmp_path / 'gardener.db'
+
+    cell_num, track_num = translate.ingest_ultrack_solution(
+        ultrack_db, db_path, chunk_size=4
+    )
+    assert (cell_num, track_num) == (6, 3)
+
+    engine = create_engine(f'sqlite:///{db_path}')
+    session = sessionmaker(bind=engine)()
+
+    tracks = session.query(TrackDB).order_by(TrackDB.track_id).all()
+    assert [(x.track_id, x.t_begin, x.t_end) for x in tracks] == [
+        (1, 0, 1),
+        (2, 2, 3),
+        (3, 2, 3),
+    ]
+
+    org_engine = create_engine(f'sqlite:///{ultrack_db}')
+    org_session = sessionmaker(bind=org_engine)()
+
+    cells = session.query(CellDB).order_by(CellDB.id).all()
+    assert [x.id for x in cells] == sorted(SOLUTION.index)
+    for cell in cells:
+        node = org_session.get(NodeDB, cell.id).pickle
+        expected = SOLUTION.loc[cell.id]
+
+        assert (cell.t, cell.row, cell.col, cell.track_id) == (
+            expected['t'],
+            expected['y'],
+            expected['x'],
+            expected['track_id'],
+        )
+        assert (cell.bbox_0, cell.bbox_1, cell.bbox_2, cell.bbox_3) == (
+            node.bbox
+        )
+        np.testing.assert_array_equal(cell.mask, node.mask)
+
+    org_session.close()
+    org_engine.dispose()
+    session.close()
+    engine.dispose()
@@ -0,0 +1,160 @@
+import shutil
+import threading
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import tracks_interactions.db.db_functions as fdb
+from tracks_interactions.widget.db_worker import close_worker, get_worker
+
+
+@pytest.fixture(scope='function')
+def file_session(tmp_path):
+    # worker threads need a database file - copy the test database
+    db_path = tmp_path / 'test.db'
+    shutil.copy('./tests/fixtures/db_2tables_test.db', db_path)
+
+    engine = create_engine(f'sqlite:///{db_path}')
+    session = sessionmaker(bind=engine)()
+
+    yield session
+
+    close_worker(session)
+    session.close()
+    engine.dispose()
+
+
+def test_worker_in_memory(qtbot):
+    """
+    Test that requests for in-memory databases are run immediately.
+    """
+
+    session = sessionmaker(bind=create_engine('sqlite:///:memory:'))()
+    worker = get_worker(session)
+
+    assert worker.thread is None
+
+    results = []
+    worker.submit(
+        lambda session, x: (x, threading.current_thread()),
+        5,
+        callback=results.append,
+    )
+
+    assert results == [(5, threading.current_thread())]
+
+    close_worker(session)
+    session.close()
+
+
+def test_worker_thread(qtbot, file_session):
+    """
+    Test that queries are run in the worker and results delivered back.
+    """
+
+    worker = get_worker(file_session)
+    assert get_worker(file_session) is worker
+
+    results = []
+    worker.submit(
+        lambda session, track_id: (
+            fdb.get_track_span(session, track_id),
+            threading.current_thread(),
+        ),
+        37402,
+        callback=lambda result: results.append(
+            (result, threading.current_thread())
+        ),
+    )
+
+    qtbot.waitUntil(lambda: len(results) == 1, timeout=5000)
+
+    (span, query_thread), callback_thread = results[0]
+    expected = fdb.get_track_span(file_session, 37402)
+
+    assert span == expected
+    assert query_thread is not threading.current_thread()
+    assert callback_thread is threading.current_thread()
+
+
+def test_worker_obsolete_requests(qtbot, file_session):
+    """
+    Test that results of replaced requests are dropped.
+    """
+
+    worker = get_worker(file_session)
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_request(session, x):
+        started.set()
+        release.wait(5)
+        return x
+
+    results = []
+    worker.submit(slow_request, 1, callback=results.append, key='track')
+    started.wait(5)
+
+    # replaces the running request
+    worker.submit(slow_request, 2, callback=results.append, key='track')
+    release.set()
+
+    qtbot.waitUntil(lambda: len(results) > 0, timeout=5000)
+    qtbot.wait(50)
+
+    assert results == [2]
+
+
+def test_worker_error(qtbot, file_session, caplog):
+    """
+    Test that failed requests are reported and do not stop the worker.
+    """
+
+    worker = get_worker(file_session)
+
+    def failing_request(session):
+        raise ValueError('test error')
+
+    results = []
+    errors = []
+    worker.submit(
+        failing_request, callback=results.append, error_callback=errors.append
+    )
+    worker.submit(lambda session: 'ok', callback=results.append)
+
+    qtbot.waitUntil(lambda: len(results) > 0, timeout=5000)
+
+    assert results == ['ok']
+    assert [str(x) for x in errors] == ['test error']
+    assert 'Database request failed' in caplog.text
+
+    close_worker(file_session)
+    assert worker.closed
+    assert get_worker(file_session) is not worker
+
+
+def test_worker_error_in_memory(qtbot, caplog):
+    """
+    Test that failed requests run immediately are reported the same way.
+    """
+
+    session = sessionmaker(bind=create_engine('sqlite:///:memory:'))()
+    worker = get_worker(session)
+
+    def failing_request(session):
+        raise ValueError('test error')
+
+    results = []
+    errors = []
+    worker.submit(
+        failing_request, callback=results.append, error_callback=errors.append
+    )
+
+    assert results == []
+    assert [str(x) for x in errors] == ['test error']
+    assert 'Database request failed' in caplog.text
+
+    close_worker(session)
+    session.close()
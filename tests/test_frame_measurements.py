@@ -0,0 +1,197 @@
+import shutil
+
+import numpy as np
+import pytest
+from skimage.measure import regionprops
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import tracks_interactions.db.db_functions as fdb
+import tracks_interactions.db.frame_measurements as fm
+from tracks_interactions.db.config_functions import MeasurementPlan
+from tracks_interactions.db.db_model import CellDB
+
+FRAME = 130
+
+
+@pytest.fixture(scope='function')
+def db_session(tmp_path):
+    db_path = tmp_path / 'test.db'
+    shutil.copy('./tests/fixtures/db_2tables_test.db', db_path)
+
+    engine = create_engine(f'sqlite:///{db_path}')
+    session = sessionmaker(bind=engine)()
+
+    yield session
+
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture(scope='function')
+def channels(db_session):
+    cells = db_session.query(CellDB).filter(CellDB.t == FRAME).all()
+    shape = (
+        max(x.bbox_2 for x in cells) + 20,
+        max(x.bbox_3 for x in cells) + 20,
+    )
+
+    # the same signal at every time point
+    rng = np.random.default_rng(0)
+    return [
+        np.broadcast_to(
+            rng.integers(0, 4096, shape, dtype=np.uint16),
+            (FRAME + 1,) + shape,
+        )
+        for _ in range(2)
+    ]
+
+
+@pytest.fixture(scope='function')
+def plan():
+    config = {
+        'signal_channels': [{'name': 'ch0'}, {'name': 'ch1'}],
+        'cell_measurements': [
+            {'function': 'area', 'source': 'regionprops'},
+            {'function': 'centroid', 'source': 'regionprops'},
+            {'function': 'eccentricity', 'source': 'regionprops'},
+            {
+                'function': 'intensity_mean',
+                'name': 'mean',
+                'source': 'regionprops',
+                'channels': ['ch0', 'ch1'],
+            },
+            {
+                'function': 'intensity_max',
+                'name': 'max',
+                'source': 'regionprops',
+                'channels': ['ch0'],
+            },
+            {
+                'function': 'intensity_min',
+                'name': 'min',
+                'source': 'regionprops',
+                'channels': ['ch1'],
+            },
+            {
+                'function': 'intensity_std',
+                'name': 'std',
+                'source': 'regionprops',
+                'channels': ['ch0'],
+            },
+            {
+                'function': 'intensity_median',
+                'name': 'median',
+                'source': 'regionprops',
+                'channels': ['ch1'],
+            },
+            {
+                'function': 'centroid_weighted',
+                'name': 'weighted',
+                'source': 'regionprops',
+                'channels': ['ch0'],
+            },
+            {
+                'function': 'ring_intensity',
+                'name': 'ring',
+                'source': 'track_gardener',
+                'channels': ['ch0', 'ch1'],
+                'ring_width': 3,
+            },
+        ],
+    }
+    return MeasurementPlan(config)
+
+
+def _cell_region(cell, shape):
+    """
+    Regionprops cell of a single cell from the database.
+    """
+    labels = fdb.rasterize_cells(np.zeros(shape, dtype=np.uint32), [cell])
+    return regionprops(labels)[0]
+
+
+def test_index_frame(db_session):
+    """
+    Test painting cells with their position in the list.
+    """
+
+    cells = fdb.get_frame_masks(db_session, FRAME)
+    shape = (
+        max(x.bbox_2 for x in cells) + 1,
+        max(x.bbox_3 for x in cells) + 1,
+    )
+
+    frame = fm.index_frame(cells, shape)
+    rendered = fdb.render_frame(db_session, FRAME, shape)
+
+    track_ids = np.array([0] + [x.track_id for x in cells])
+    np.testing.assert_array_equal(track_ids[frame], rendered)
+
+
+def test_measure_frame(db_session, channels, plan):
+    """
+    Test that signals of a frame agree with signals calculated per cell.
+    """
+
+    result = fm.measure_frame(db_session, FRAME, channels, plan)
+
+    cells = db_session.query(CellDB).filter(CellDB.t == FRAME).all()
+    assert set(result) == {x.track_id for x in cells}
+
+    shape = channels[0].shape[1:]
+    for cell in cells:
+        expected = plan(_cell_region(cell, shape), FRAME, channels)
+        signals = result[cell.track_id]
+
+        assert signals.keys() == expected.keys()
+        for key in expected:
+            np.testing.assert_allclose(
+                signals[key], expected[key], rtol=1e-6, err_msg=key
+            )
+
+        # values can be stored as JSON
+        assert all(isinstance(x, (int, float, list)) for x in signals.values())
+
+
+def test_recompute_frame_signals(db_session, channels, plan):
+    """
+    Test storing recalculated signals of a frame.
+    """
+
+    fdb.create_signal_store(db_session)
+
+    old_signals = {
+        cell.track_id: cell.signals
+        for cell in db_session.query(CellDB).filter(CellDB.t == FRAME)
+    }
+
+    count = fm.recompute_frame_signals(
+        db_session, FRAME, channels, plan, merge=True
+    )
+    assert count == len(old_signals)
+
+    expected = fm.measure_frame(db_session, FRAME, channels, plan)
+
+    for cell in db_session.query(CellDB).filter(CellDB.t == FRAME):
+        # old signals are kept
+        assert cell.signals == {
+            **old_signals[cell.track_id],
+            **expected[cell.track_id],
+        }
+
+    # signals are replaced
+    fm.recompute_frame_signals(db_session, FRAME, channels, plan)
+    db_session.expire_all()
+
+    for cell in db_session.query(CellDB).filter(CellDB.t == FRAME):
+        assert cell.signals == expected[cell.track_id]
+
+        t, values = fdb.get_track_signals(
+            db_session, cell.track_id, ['ch0_mean', 'ch1_nuc']
+        )
+        np.testing.assert_allclose(
+            values[t == FRAME, 0], expected[cell.track_id]['ch0_mean']
+        )
+        # signals of removed measurements are dropped from the store
+        assert np.isnan(values[t == FRAME, 1]).all()
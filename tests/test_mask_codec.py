@@ -0,0 +1,104 @@
+import pickle
+import shutil
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from tracks_interactions.db.db_migrations import migrate_mask_encoding
+from tracks_interactions.db.db_model import CellDB
+from tracks_interactions.db.mask_codec import (
+    MASK_HEADER,
+    MaskType,
+    decode_mask,
+    encode_mask,
+    is_encoded_mask,
+)
+
+
+def test_mask_round_trip():
+    """
+    Test that a mask survives encoding and decoding.
+    """
+
+    rng = np.random.default_rng(0)
+    mask = rng.random((17, 29)) > 0.5
+
+    data = encode_mask(mask)
+
+    assert is_encoded_mask(data)
+    assert len(data) == MASK_HEADER.size + int(np.ceil(17 * 29 / 8))
+
+    decoded = decode_mask(data)
+
+    assert decoded.dtype == bool
+    np.testing.assert_array_equal(decoded, mask)
+
+
+def test_decode_legacy_mask():
+    """
+    Test that pickled masks are still readable.
+    """
+
+    mask = np.eye(5, dtype=bool)
+
+    decoded = decode_mask(pickle.dumps(mask))
+
+    np.testing.assert_array_equal(decoded, mask)
+
+
+def test_encode_mask_wrong_dimensions():
+    """
+    Test that only 2D masks are accepted.
+    """
+
+    with pytest.raises(ValueError):
+        encode_mask(np.ones(5, dtype=bool))
+
+
+def test_migrate_mask_encoding(tmp_path):
+    """
+    Test rewriting pickled masks of a database.
+    """
+
+    db_path = tmp_path / 'test.db'
+    shutil.copy('./tests/fixtures/db_2tables_test.db', db_path)
+
+    engine = create_engine(f'sqlite:///{db_path}')
+    session = sessionmaker(bind=engine)()
+    masks_before = {
+        (cell.track_id, cell.t): cell.mask for cell in session.query(CellDB)
+    }
+    session.close()
+
+    migrated = migrate_mask_encoding(db_path, batch_size=100)
+    assert migrated == len(masks_before)
+
+    # running again does not change anything
+    assert migrate_mask_encoding(db_path) == 0
+
+    with engine.connect() as connection:
+        raw = connection.execute(text('SELECT mask FROM cells')).scalars()
+        assert all(is_encoded_mask(x) for x in raw)
+
+    session = sessionmaker(bind=engine)()
+    for cell in session.query(CellDB):
+        np.testing.assert_array_equal(
+            cell.mask, masks_before[(cell.track_id, cell.t)]
+        )
+    session.close()
+
+
+def test_mask_type_accepts_encoded_masks():
+    """
+    Test that masks encoded ahead of a bulk insert are stored as they are.
+    """
+
+    mask = np.eye(4, dtype=bool)
+    data = encode_mask(mask)
+
+    assert MaskType().process_bind_param(data, None) == data
+    np.testing.assert_array_equal(
+        MaskType().process_result_value(data, None), mask
+    )
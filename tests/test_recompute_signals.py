@@ -0,0 +1,370 @@
+import shutil
+
+import dask.array as da
+import numpy as np
+import pytest
+import yaml
+import zarr
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+import tracks_interactions.db.db_functions as fdb
+import tracks_interactions.db.frame_measurements as fm
+from tracks_interactions.db.config_functions import MeasurementPlan
+from tracks_interactions.db.db_model import CellDB, RecomputeLog
+from tracks_interactions.db.recompute_signals import (
+    frame_partitions,
+    load_channels,
+    main,
+    measurements_key,
+    missing_measurements,
+    recompute_missing_signals,
+    recompute_signals,
+)
+
+FRAMES = [126, 127, 128, 129, 130, 131]
+
+
+@pytest.fixture(scope='function')
+def config(tmp_path):
+    db_path = tmp_path / 'test.db'
+    shutil.copy('./tests/fixtures/db_2tables_test.db', db_path)
+
+    # signal only around the cells of the tested frames
+    rng = np.random.default_rng(0)
+    channels = []
+    for ch in ['ch0', 'ch1']:
+        path = str(tmp_path / f'{ch}.zarr')
+        data = zarr.open_array(
+            path,
+            mode='w',
+            shape=(140, 5300, 5500),
+            chunks=(4, 1024, 1024),
+            dtype='uint16',
+        )
+        data[120:132, 4900:5300, 4500:5500] = rng.integers(
+            0, 4096, (12, 400, 1000), dtype=np.uint16
+        )
+        channels.append({'name': ch, 'path': path})
+
+    return {
+        'signal_channels': channels,
+        'cell_measurements': [
+            {'function': 'area', 'source': 'regionprops'},
+            {
+                'function': 'intensity_mean',
+                'name': 'nuc',
+                'source': 'regionprops',
+                'channels': ['ch0', 'ch1'],
+            },
+            {
+                'function': 'ring_intensity',
+                'name': 'cyto',
+                'source': 'track_gardener',
+                'channels': ['ch0'],
+                'ring_width': 3,
+            },
+        ],
+        'database': {'path': str(db_path)},
+    }
+
+
+@pytest.fixture(scope='function')
+def session(config):
+    engine = create_engine(f"sqlite:///{config['database']['path']}")
+    session = sessionmaker(bind=engine)()
+
+    yield session
+
+    session.close()
+    engine.dispose()
+
+
+def _check_signals(session, config, frames):
+    """
+    Check that stored signals agree with signals of the frame engine.
+    """
+
+    channels = load_channels(config)
+    plan = MeasurementPlan(config)
+
+    for t in frames:
+        expected = fm.measure_frame(session, t, channels, plan)
+        cells = session.query(CellDB).filter(CellDB.t == t).all()
+
+        assert len(cells) == len(expected)
+        for cell in cells:
+            # signals are replaced
+            assert cell.signals.keys() == expected[cell.track_id].keys()
+            for key, value in expected[cell.track_id].items():
+                np.testing.assert_allclose(cell.signals[key], value)
+
+
+def test_frame_partitions():
+    """
+    Test grouping frames by time chunks.
+    """
+
+    channel = da.zeros((10, 5, 5), chunks=(4, 5, 5))
+
+    assert frame_partitions([9, 0, 3, 4, 8, 5], channel) == [
+        [0, 3],
+        [4, 5],
+        [8, 9],
+    ]
+
+
+def test_recompute_signals_resume(config, session):
+    """
+    Test recalculating signals and resuming an interrupted run.
+    """
+
+    messages = []
+    key = measurements_key(config)
+    assert key == 'area,ch0_cyto,ch0_nuc,ch1_nuc'
+
+    # interrupted run
+    done = recompute_signals(
+        config, frames=FRAMES[:3], workers=1, progress=messages.append
+    )
+    assert done == 3
+
+    messages.clear()
+    done = recompute_signals(
+        config, frames=FRAMES, workers=1, progress=messages.append
+    )
+    assert done == 3
+
+    # remaining frames are in a single time chunk
+    assert messages == [
+        '3 frames to calculate, 3 done before',
+        'frames 129-131 done',
+    ]
+
+    _check_signals(session, config, FRAMES)
+
+    logged = session.execute(
+        select(RecomputeLog.c.t).where(RecomputeLog.c.measurements == key)
+    ).all()
+    assert sorted(t for (t,) in logged) == FRAMES
+
+    # everything done
+    assert recompute_signals(config, frames=FRAMES, workers=1) == 0
+
+    # calculated again
+    assert (
+        recompute_signals(config, frames=FRAMES, workers=1, restart=True) == 6
+    )
+
+
+def test_recompute_signals_processes(config, session):
+    """
+    Test recalculating signals in a pool of processes.
+    """
+
+    done = recompute_signals(config, frames=FRAMES, workers=2)
+    assert done == len(FRAMES)
+
+    _check_signals(session, config, FRAMES)
+
+
+def test_recompute_signals_covered_cells(config, session):
+    """
+    Test reporting cells covered by other cells.
+    """
+
+    cell = session.query(CellDB).filter(CellDB.t == 130).first()
+    covered_signals = dict(cell.signals)
+
+    # the same cell with a higher track_id is painted over it
+    copy = CellDB(
+        track_id=session.query(func.max(CellDB.track_id)).scalar() + 1,
+        t=cell.t,
+        id=cell.id,
+        row=cell.row,
+        col=cell.col,
+        bbox_0=cell.bbox_0,
+        bbox_1=cell.bbox_1,
+        bbox_2=cell.bbox_2,
+        bbox_3=cell.bbox_3,
+        mask=cell.mask,
+    )
+    session.add(copy)
+    session.commit()
+
+    messages = []
+    recompute_signals(
+        config, frames=[130], workers=1, progress=messages.append
+    )
+
+    assert messages == [
+        '1 frames to calculate, 0 done before',
+        'frame 130: 1 cells covered by other cells not measured, '
+        'their signals are not updated',
+        'frames 130-130 done',
+    ]
+
+    session.expire_all()
+    assert cell.signals == covered_signals
+    assert 'ch0_cyto' in copy.signals
+
+
+@pytest.fixture(scope='function')
+def frames_session(session):
+    # keep only the tested frames
+    session.query(CellDB).filter(CellDB.t.notin_(FRAMES)).delete()
+    session.commit()
+
+    return session
+
+
+def test_missing_measurements(config, frames_session):
+    """
+    Test finding measurements of the config missing in the database.
+    """
+
+    # area, ch0_nuc, ch1_nuc and ch0_cyto are present in the database
+    config['cell_measurements'][2]['channels'] = ['ch0', 'ch1']
+    config['cell_measurements'].append(
+        {
+            'function': 'ring_intensity',
+            'name': 'ring8',
+            'source': 'track_gardener',
+            'channels': ['ch0', 'ch1'],
+            'ring_width': 8,
+        }
+    )
+
+    missing_config, missing = missing_measurements(frames_session, config)
+
+    assert missing == ['ch0_ring8', 'ch1_ring8']
+    assert missing_config['cell_measurements'] == [
+        config['cell_measurements'][-1]
+    ]
+
+    # signal missing in a single cell
+    cell = frames_session.query(CellDB).filter(CellDB.t == 130).first()
+    cell.signals = {k: v for k, v in cell.signals.items() if k != 'ch1_cyto'}
+    frames_session.commit()
+
+    missing_config, missing = missing_measurements(frames_session, config)
+
+    assert missing == ['ch1_cyto', 'ch0_ring8', 'ch1_ring8']
+    assert missing_config['cell_measurements'][0]['channels'] == ['ch1']
+    assert fdb.get_frames_missing_signals(frames_session, ['ch1_cyto']) == [
+        130
+    ]
+
+
+def test_recompute_missing_signals(config, frames_session):
+    """
+    Test calculating only signals missing in the database.
+    """
+
+    old_signals = {
+        (cell.track_id, cell.t): cell.signals
+        for cell in frames_session.query(CellDB)
+    }
+
+    config['cell_measurements'].append(
+        {
+            'function': 'intensity_max',
+            'name': 'max',
+            'source': 'regionprops',
+            'channels': ['ch1'],
+        }
+    )
+
+    messages = []
+    done = recompute_missing_signals(
+        config, workers=1, progress=messages.append
+    )
+
+    assert done == len(FRAMES)
+    assert messages[0] == 'Missing signals: ch1_max'
+
+    frames_session.expire_all()
+    channels = load_channels(config)
+    for cell in frames_session.query(CellDB):
+        # existing signals are not calculated again
+        old = old_signals[(cell.track_id, cell.t)]
+        assert cell.signals == {**old, 'ch1_max': cell.signals['ch1_max']}
+
+        region = cell.mask
+        values = np.asarray(
+            channels[1][
+                cell.t, cell.bbox_0 : cell.bbox_2, cell.bbox_1 : cell.bbox_3
+            ]
+        )
+        assert cell.signals['ch1_max'] == values[region].max()
+
+    # nothing left
+    assert recompute_missing_signals(config, workers=1) == 0
+
+
+def test_main_missing_frames(config, frames_session, tmp_path):
+    """
+    Test that --frames limits the calculation of missing signals.
+    """
+
+    config['cell_measurements'].append(
+        {
+            'function': 'intensity_max',
+            'name': 'max',
+            'source': 'regionprops',
+            'channels': ['ch1'],
+        }
+    )
+    config_path = tmp_path / 'config.yaml'
+    with open(config_path, 'w') as config_file:
+        yaml.safe_dump(config, config_file)
+
+    main(
+        [
+            str(config_path),
+            '--missing',
+            '--workers',
+            '1',
+            '--frames',
+            '127',
+            '128',
+        ]
+    )
+
+    frames_session.expire_all()
+    for cell in frames_session.query(CellDB):
+        assert ('ch1_max' in cell.signals) == (cell.t in [127, 128])
+
+    # frames done before are calculated again with --restart
+    cell = frames_session.query(CellDB).filter(CellDB.t == 127).first()
+    cell.signals = {k: v for k, v in cell.signals.items() if k != 'ch1_max'}
+    frames_session.commit()
+
+    main(
+        [
+            str(config_path),
+            '--missing',
+            '--workers',
+            '1',
+            '--frames',
+            '127',
+            '128',
+        ]
+    )
+    frames_session.expire_all()
+    assert 'ch1_max' not in cell.signals
+
+    main(
+        [
+            str(config_path),
+            '--missing',
+            '--workers',
+            '1',
+            '--restart',
+            '--frames',
+            '127',
+            '128',
+        ]
+    )
+    frames_session.expire_all()
+    assert 'ch1_max' in cell.signals
@@ -0,0 +1,266 @@
+import shutil
+
+import numpy as np
+import pytest
+from sqlalchemy import MetaData, create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+
+import tracks_interactions.db.db_functions as fdb
+from tracks_interactions.db.db_model import CellDB, TrackDB
+from tracks_interactions.widget.tile_renderer import TileRenderer
+
+
+@pytest.fixture(scope='function')
+def db_session():
+    # see "./tests/fixtures/test_database_content.PNG" for a visual representation of copied part of the test database
+    test_db_path = r'./tests/fixtures/db_2tables_test.db'
+    original_engine = create_engine(f'sqlite:///{test_db_path}')
+    original_metadata = MetaData()
+    original_metadata.reflect(bind=original_engine)
+
+    # Create an in-memory SQLite database
+    memory_engine = create_engine('sqlite:///:memory:')
+    original_metadata.create_all(memory_engine)
+
+    # Open sessions
+    OriginalSession = sessionmaker(bind=original_engine)
+    MemorySession = sessionmaker(bind=memory_engine)
+
+    original_session = OriginalSession()
+    memory_session = MemorySession()
+
+    # Copy tables
+    cells = original_session.query(CellDB).all()
+    tracks = original_session.query(TrackDB).all()
+
+    for cell in cells:
+        # Create a new instance of CellDB
+        new_cell = CellDB()
+
+        # Deep copy
+        for key, value in inspect(cell).attrs.items():
+            setattr(new_cell, key, value.value)
+
+        memory_session.add(new_cell)
+
+    for track in tracks:
+        # Create a new instance of TrackDB
+        new_track = TrackDB()
+
+        # Deep copy
+        for key, value in inspect(track).attrs.items():
+            setattr(new_track, key, value.value)
+
+        memory_session.add(new_track)
+
+    original_session.close()
+
+    yield memory_session
+
+    memory_session.close()
+
+
+def expected_labels(session, t, shape):
+    """
+    Paint all cells of a frame without tiles.
+    """
+
+    labels = np.zeros(shape, dtype=np.int32)
+    for cell in fdb.get_cells_in_view(session, t, 0, shape[0], 0, shape[1]):
+        region = labels[cell.bbox_0 : cell.bbox_2, cell.bbox_1 : cell.bbox_3]
+        region[cell.mask] = cell.track_id
+
+    return labels
+
+
+def test_render_tiles(db_session):
+    """
+    Test that cells are painted whole, also across borders of tiles.
+    """
+
+    data = np.zeros([6000, 6000], dtype=np.int32)
+    renderer = TileRenderer(db_session, tile_size=64)
+
+    # field of view cutting through the cells
+    cells, changed = renderer.render(data, 130, 5000, 5200, 4500, 5220)
+
+    assert changed
+    assert sorted(x.track_id for x in cells) == [20427, 20428, 37402]
+    np.testing.assert_array_equal(
+        data, expected_labels(db_session, 130, data.shape) * (data > 0)
+    )
+    for cell in cells:
+        region = data[cell.bbox_0 : cell.bbox_2, cell.bbox_1 : cell.bbox_3]
+        assert (region[cell.mask] == cell.track_id).all()
+
+    # nothing new to paint
+    _, changed = renderer.render(data, 130, 5000, 5200, 4500, 5220)
+    assert not changed
+
+    # full frame and a change of the frame
+    cells, _ = renderer.render(data, 130, 0, 6000, 0, 6000)
+    assert len(cells) == 5
+    np.testing.assert_array_equal(
+        data, expected_labels(db_session, 130, data.shape)
+    )
+
+    cells, _ = renderer.render(data, 10, 0, 6000, 0, 6000)
+    assert [x.track_id for x in cells] == [20422]
+    np.testing.assert_array_equal(
+        data, expected_labels(db_session, 10, data.shape)
+    )
+
+
+def test_render_after_edit(db_session):
+    """
+    Test that edited cells are repainted, also from the cache.
+    """
+
+    data = np.zeros([6000, 6000], dtype=np.int32)
+    renderer = TileRenderer(db_session, tile_size=64)
+
+    renderer.render(data, 130, 0, 6000, 0, 6000)
+    renderer.render(data, 10, 0, 6000, 0, 6000)
+
+    fdb.remove_CellDB(db_session, 20427, 130)
+
+    cells, changed = renderer.render(data, 130, 0, 6000, 0, 6000)
+
+    assert changed
+    assert 20427 not in [x.track_id for x in cells]
+    np.testing.assert_array_equal(
+        data, expected_labels(db_session, 130, data.shape)
+    )
+
+    # the cell is removed also when displayed
+    fdb.remove_CellDB(db_session, 20428, 130)
+
+    cells, changed = renderer.render(data, 130, 0, 6000, 0, 6000)
+
+    assert changed
+    assert 20428 not in [x.track_id for x in cells]
+    np.testing.assert_array_equal(
+        data, expected_labels(db_session, 130, data.shape)
+    )
+
+
+def test_render_after_many_edits(db_session, monkeypatch):
+    """
+    Test that everything is repainted after edits dropped from the log.
+    """
+
+    monkeypatch.setattr(fdb, 'CELL_EDITS_KEPT', 1)
+
+    data = np.zeros([6000, 6000], dtype=np.int32)
+    renderer = TileRenderer(db_session, tile_size=64)
+
+    renderer.render(data, 130, 0, 6000, 0, 6000)
+    renderer.render(data, 10, 0, 6000, 0, 6000)
+    renderer.render(data, 130, 0, 6000, 0, 6000)
+
+    fdb.remove_CellDB(db_session, 20427, 130)
+    fdb.remove_CellDB(db_session, 20422, 10)
+
+    cells, changed = renderer.render(data, 130, 0, 6000, 0, 6000)
+
+    assert changed
+    assert 20427 not in [x.track_id for x in cells]
+    np.testing.assert_array_equal(
+        data, expected_labels(db_session, 130, data.shape)
+    )
+
+    # not rendered from the cache
+    cells, _ = renderer.render(data, 10, 0, 6000, 0, 6000)
+    assert len(cells) == 0
+    assert not data.any()
+
+
+def test_no_prefetch_in_memory(db_session):
+    """
+    Test that in-memory databases are rendered without workers.
+    """
+
+    renderer = TileRenderer(db_session)
+
+    assert renderer.executor is None
+
+    # does nothing
+    renderer.prefetch([11, 9], 0, 6000, 0, 6000)
+    renderer.close()
+
+
+def test_prefetch_neighbouring_frames(tmp_path):
+    """
+    Test that tiles of neighbouring frames are prefetched into the cache.
+    """
+
+    db_path = tmp_path / 'test.db'
+    shutil.copy('./tests/fixtures/db_2tables_test.db', db_path)
+
+    engine = create_engine(f'sqlite:///{db_path}')
+    session = sessionmaker(bind=engine)()
+
+    data = np.zeros([6000, 6000], dtype=np.int32)
+    renderer = TileRenderer(session, tile_size=1024)
+
+    renderer.render(data, 130, 4500, 5500, 4500, 5500)
+    renderer.prefetch([131, 129], 4500, 5500, 4500, 5500)
+
+    # wait for the workers
+    renderer.close()
+
+    tiles = renderer.tiles_in_extent(4500, 5500, 4500, 5500)
+    for t in [129, 130, 131]:
+        assert all((t, tile) in renderer.cache for tile in tiles)
+
+    # rendered from the cache
+    cells, _ = renderer.render(data, 131, 4500, 5500, 4500, 5500)
+    assert len(cells) == 5
+    np.testing.assert_array_equal(
+        data, expected_labels(session, 131, data.shape)
+    )
+
+    session.close()
+    engine.dispose()
+
+
+def test_render_scaled(db_session):
+    """
+    Test rendering cells downsampled to a lower resolution level.
+    """
+
+    data = np.zeros([1500, 1500], dtype=np.int32)
+    renderer = TileRenderer(db_session, tile_size=64, scale=4)
+
+    cells, _ = renderer.render(data, 130, 0, 6000, 0, 6000)
+
+    full = expected_labels(db_session, 130, (6000, 6000))
+    np.testing.assert_array_equal(data, full[::4, ::4])
+    assert len(cells) == 5
+
+
+def test_render_translated(db_session):
+    """
+    Test rendering into an array covering only a part of the frame.
+    """
+
+    renderer = TileRenderer(db_session, tile_size=64)
+
+    origin = (4992, 4480)
+    data = np.zeros([320, 768], dtype=np.uint32)
+    renderer.reset(data, origin=origin, bounds=(6000, 6000))
+
+    cells, changed = renderer.render(data, 130, 5000, 5200, 4500, 5220)
+
+    assert changed
+    assert len(cells) > 0
+    expected = expected_labels(db_session, 130, (6000, 6000))[
+        origin[0] : origin[0] + 320, origin[1] : origin[1] + 768
+    ]
+    np.testing.assert_array_equal(data, expected * (data > 0))
+    assert set(np.unique(data)) == {0} | {x.track_id for x in cells}
+
+    # edits outside of the array are still invalidated in the cache
+    fdb.remove_CellDB(db_session, 20427, 130)
+    renderer.render(data, 130, 5000, 5200, 4500, 5220)
+    assert 20427 not in data
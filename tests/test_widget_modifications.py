@@ -8,7 +8,13 @@ from qtpy.QtWidgets import QDialog, QPushButton
 from sqlalchemy import MetaData, create_engine, inspect
 from sqlalchemy.orm import sessionmaker
 
+import tracks_interactions.db.db_functions as fdb
+from tracks_interactions.db.config_functions import (
+    create_calculate_signals_function,
+)
+from tracks_interactions.db.db_functions import newTrack_number
 from tracks_interactions.db.db_model import CellDB, TrackDB
+from tracks_interactions.widget import widget_modifications
 from tracks_interactions.widget.widget_modifications import ModificationWidget
 
 
@@ -515,6 +521,43 @@ def test_save_note(viewer, db_session):
     ), f'Expected current.note to be {my_note}, instead it is {modification_widget.current_note}'
 
 
+def test_note_of_selected_track(viewer, db_session, mocker):
+    """
+    Test that the note dialog shows and saves the note of its own track.
+    """
+
+    track_a, track_b = 20422, 37402
+    fdb.save_track_note(db_session, track_a, 'note of a')
+
+    modification_widget = ModificationWidget(viewer, db_session)
+    viewer.dims.set_point(0, 0)
+
+    modification_widget.labels.selected_label = track_a
+    assert modification_widget.current_note == 'note of a'
+
+    # the background lookup of the new selection has not arrived yet
+    modification_widget.db_worker.submit = MagicMock()
+    modification_widget.labels.selected_label = track_b
+    assert modification_widget.current_note == 'note of a'
+
+    # a late lookup of the previous track is ignored
+    modification_widget.show_note_icon('note of a', track_a)
+
+    def dialog_exec():
+        assert modification_widget.text_edit.toPlainText() == ''
+
+        # selection changed while the dialog is open
+        modification_widget.labels.selected_label = track_a
+        modification_widget.text_edit.setText('note of b')
+        modification_widget.save_note()
+
+    mocker.patch.object(QDialog, 'exec_', side_effect=dialog_exec)
+    modification_widget.add_note_function()
+
+    assert fdb.get_track_note(db_session, track_b) == 'note of b'
+    assert fdb.get_track_note(db_session, track_a) == 'note of a'
+
+
 def test_mod_cell_function_deletion(viewer, db_session, mocker):
     """
     Test saving modifications of a cell object to a database.
@@ -528,6 +571,8 @@ def test_mod_cell_function_deletion(viewer, db_session, mocker):
 
     mock_cell = MagicMock()
     mock_cell.track_id = cell_id
+    mock_cell.bbox_0, mock_cell.bbox_1 = 0, 0
+    mock_cell.bbox_2, mock_cell.bbox_3 = 2, 2
     modification_widget.labels.metadata['query'] = [mock_cell]
 
     mock_remove_db = mocker.patch(
@@ -556,12 +601,12 @@ def test_mod_cell_function_addition(viewer, db_session, mocker):
     modification_widget.labels.metadata['query'] = []
 
     mock_func_db = mocker.patch(
-        'tracks_interactions.widget.widget_modifications.fdb.add_new_CellDB'
+        'tracks_interactions.widget.widget_modifications.fdb.add_new_CellDB_batch'
     )
 
     modification_widget.mod_cell_function()
 
-    assert mock_func_db.called, 'add_new_CellDB should have been called'
+    assert mock_func_db.called, 'add_new_CellDB_batch should have been called'
 
 
 def test_mod_cell_function_modification(viewer, db_session, mocker):
@@ -586,10 +631,12 @@ def test_mod_cell_function_modification(viewer, db_session, mocker):
     mock_cell.track_id = cell_id
     mock_cell.row = pos
     mock_cell.col = pos
+    mock_cell.bbox_0, mock_cell.bbox_1 = 0, 0
+    mock_cell.bbox_2, mock_cell.bbox_3 = 2, 2
     modification_widget.labels.metadata['query'] = [mock_cell]
 
     mock_func_db = mocker.patch(
-        'tracks_interactions.widget.widget_modifications.fdb.add_new_CellDB'
+        'tracks_interactions.widget.widget_modifications.fdb.add_new_CellDB_batch'
     )
     mock_remove_db = mocker.patch(
         'tracks_interactions.widget.widget_modifications.fdb.remove_CellDB'
@@ -598,7 +645,7 @@ def test_mod_cell_function_modification(viewer, db_session, mocker):
     modification_widget.mod_cell_function()
 
     assert mock_remove_db.called, 'remove_CellDB should have been called'
-    assert mock_func_db.called, 'add_new_CellDB should have been called'
+    assert mock_func_db.called, 'add_new_CellDB_batch should have been called'
 
     exp_status = '2 has been modified'
     assert (
@@ -653,3 +700,235 @@ def test_tags_call_annotation(viewer, db_session, mocker):
     assert (
         mock_func_db.called
     ), f"Expected an annotating function to be called for {btn.text()}, but it wasn't."
+
+
+def test_mod_cell_function_lower_level(viewer, db_session, mocker):
+    """
+    Test that cells are not saved from labels of a lower resolution level.
+    """
+
+    modification_widget = ModificationWidget(viewer, db_session)
+
+    viewer.dims.set_point(0, 0)
+
+    modification_widget.labels.data[0:2, 0:2] = 5
+    modification_widget.labels.metadata['query'] = []
+    modification_widget.labels.metadata['level'] = 1
+
+    mock_func_db = mocker.patch(
+        'tracks_interactions.widget.widget_modifications.fdb.add_new_CellDB_batch'
+    )
+
+    modification_widget.mod_cell_function()
+
+    assert not mock_func_db.called, 'add_new_CellDB_batch should not be called'
+    assert viewer.status == 'Zoom in to save cells.'
+
+
+def test_mod_cell_function_translated_labels(viewer, db_session, mocker):
+    """
+    Test saving cells from labels covering only a part of the frame.
+    """
+
+    modification_widget = ModificationWidget(viewer, db_session)
+
+    viewer.dims.set_point(0, 0)
+
+    labels = modification_widget.labels
+    labels.data = np.zeros([100, 100], dtype=np.uint32)
+    labels.translate = (1000, 2000)
+    labels.data[0:2, 0:2] = 5
+
+    # cell cut by the border of the labels array
+    mock_cell = MagicMock()
+    mock_cell.track_id = 7
+    mock_cell.row, mock_cell.col = 1099.5, 2099.5
+    mock_cell.bbox_0, mock_cell.bbox_1 = 1090, 2090
+    mock_cell.bbox_2, mock_cell.bbox_3 = 1110, 2110
+    mock_cell.mask = np.ones([20, 20], dtype=bool)
+    labels.metadata['query'] = [mock_cell]
+    labels.data[90:100, 90:100] = 7
+
+    mock_func_db = mocker.patch(
+        'tracks_interactions.widget.widget_modifications.fdb.add_new_CellDB_batch'
+    )
+    mock_remove_db = mocker.patch(
+        'tracks_interactions.widget.widget_modifications.fdb.remove_CellDB'
+    )
+
+    modification_widget.mod_cell_function()
+
+    assert mock_func_db.call_count == 1
+    (cell_label,) = mock_func_db.call_args[0][2]
+    assert cell_label.bbox == (1000, 2000, 1002, 2002)
+    assert not mock_remove_db.called, 'cut cells should not be removed'
+
+
+def test_mod_cell_function_clipped_cell(viewer, db_session):
+    """
+    Test saving an edit of a cell cut by the border of the labels array.
+    """
+
+    modification_widget = ModificationWidget(viewer, db_session)
+
+    current_frame = 0
+    viewer.dims.set_point(0, current_frame)
+
+    cell = (
+        db_session.query(CellDB)
+        .filter_by(track_id=20422, t=current_frame)
+        .one()
+    )
+    bbox = (cell.bbox_0, cell.bbox_1, cell.bbox_2, cell.bbox_3)
+    stored = np.zeros([6000, 6000], dtype=bool)
+    stored[bbox[0] : bbox[2], bbox[1] : bbox[3]] = cell.mask
+
+    # the array ends in the middle of the cell
+    r0, c0 = bbox[0] - 20, bbox[1] - 20
+    r_mid = (bbox[0] + bbox[2]) // 2
+    labels = modification_widget.labels
+    labels.data = np.zeros([r_mid - r0, 200], dtype=np.uint32)
+    labels.translate = (r0, c0)
+    labels.data[stored[r0:r_mid, c0 : c0 + 200]] = 20422
+    labels.metadata['query'] = [cell]
+
+    # erase the first row of the cell and paint a pixel above it
+    labels.data[bbox[0] - r0] = 0
+    labels.data[5, 25] = 20422
+
+    modification_widget.mod_cell_function()
+
+    db_session.expire_all()
+    saved = (
+        db_session.query(CellDB)
+        .filter_by(track_id=20422, t=current_frame)
+        .one()
+    )
+
+    expected = stored.copy()
+    expected[bbox[0]] = False
+    expected[r0 + 5, c0 + 25] = True
+
+    result = np.zeros([6000, 6000], dtype=bool)
+    result[saved.bbox_0 : saved.bbox_2, saved.bbox_1 : saved.bbox_3] = (
+        saved.mask
+    )
+    np.testing.assert_array_equal(result, expected)
+    assert viewer.status == '20422 has been modified'
+
+
+def test_mod_cell_function_signals(viewer, db_session):
+    """
+    Test saving a cell with signals calculated by a measurement plan.
+    """
+
+    config = {
+        'signal_channels': [{'name': 'ch0'}],
+        'cell_measurements': [
+            {'function': 'area', 'source': 'regionprops'},
+            {'function': 'centroid', 'source': 'regionprops'},
+            {
+                'function': 'intensity_mean',
+                'name': 'nuc',
+                'source': 'regionprops',
+                'channels': ['ch0'],
+            },
+            {
+                'function': 'ring_intensity',
+                'name': 'cyto',
+                'source': 'track_gardener',
+                'channels': ['ch0'],
+                'ring_width': 2,
+            },
+        ],
+    }
+
+    # signal equal to the column in the frame
+    ch_list = [
+        np.broadcast_to(np.arange(10000, dtype=np.uint16), (1, 10000, 10000))
+    ]
+
+    modification_widget = ModificationWidget(
+        viewer,
+        db_session,
+        ch_list=ch_list,
+        signal_function=create_calculate_signals_function(config),
+    )
+
+    viewer.dims.set_point(0, 0)
+
+    cell_id = newTrack_number(db_session)
+
+    labels = modification_widget.labels
+    labels.data = np.zeros([100, 100], dtype=np.uint32)
+    labels.translate = (1000, 2000)
+    labels.data[10:14, 20:26] = cell_id
+    labels.metadata['query'] = []
+
+    modification_widget.mod_cell_function()
+
+    cell = db_session.query(CellDB).filter_by(track_id=cell_id, t=0).one()
+
+    assert cell.signals['area'] == 24
+    np.testing.assert_allclose(cell.signals['centroid'], [1011.5, 2022.5])
+    np.testing.assert_allclose(cell.signals['ch0_nuc'], 2022.5)
+    np.testing.assert_allclose(cell.signals['ch0_cyto'], 2022.5)
+
+
+def test_mod_cell_function_dirty_regions(viewer, db_session, mocker):
+    """
+    Test that after a save only painted regions are analysed.
+    """
+
+    modification_widget = ModificationWidget(viewer, db_session)
+    labels = modification_widget.labels
+
+    viewer.dims.set_point(0, 0)
+
+    # cell that is not painted over
+    labels.data[100:110, 100:110] = 3
+    mock_cell = MagicMock()
+    mock_cell.track_id = 3
+    mock_cell.row, mock_cell.col = 104, 104
+    mock_cell.bbox_0, mock_cell.bbox_1 = 100, 100
+    mock_cell.bbox_2, mock_cell.bbox_3 = 110, 110
+    mock_cell.mask = np.ones([10, 10], dtype=bool)
+    labels.metadata['query'] = [mock_cell]
+
+    mock_add = mocker.patch(
+        'tracks_interactions.widget.widget_modifications.fdb.add_new_CellDB_batch'
+    )
+    mock_remove = mocker.patch(
+        'tracks_interactions.widget.widget_modifications.fdb.remove_CellDB'
+    )
+
+    # first save analyses everything
+    modification_widget.mod_cell_function()
+    assert modification_widget.dirty_boxes == []
+    assert not mock_add.called
+
+    # paint a new cell
+    labels.brush_size = 5
+    labels.paint((2000, 3000), 5)
+
+    spy = mocker.spy(widget_modifications, 'regionprops')
+    modification_widget.mod_cell_function()
+
+    assert mock_add.call_count == 1
+    assert [x.label for x in mock_add.call_args[0][2]] == [5]
+    assert spy.call_args[0][0].size < 100
+    assert not mock_remove.called
+
+    # undo painting - the cell is removed
+    mock_cell_5 = MagicMock()
+    mock_cell_5.track_id = 5
+    mock_cell_5.bbox_0, mock_cell_5.bbox_1 = 1998, 2998
+    mock_cell_5.bbox_2, mock_cell_5.bbox_3 = 2003, 3003
+    labels.metadata['query'] = [mock_cell, mock_cell_5]
+
+    labels.undo()
+    modification_widget.mod_cell_function()
+
+    assert mock_remove.call_count == 1
+    assert mock_remove.call_args[0][1] == 5
+    assert mock_add.call_count == 1
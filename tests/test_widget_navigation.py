@@ -5,6 +5,7 @@ import pytest
 from sqlalchemy import MetaData, create_engine, inspect
 from sqlalchemy.orm import sessionmaker
 
+import tracks_interactions.db.db_functions as fdb
 from tracks_interactions.db.db_model import CellDB, TrackDB
 from tracks_interactions.widget.widget_navigation import TrackNavigationWidget
 
@@ -70,6 +71,13 @@ def viewer(make_napari_viewer):
     viewer.close()
 
 
+def wait_for_labels(qtbot, widget):
+    """
+    Wait for the refresh of labels scheduled by camera events.
+    """
+    qtbot.waitUntil(lambda: not widget.refresh_timer.isActive(), timeout=2000)
+
+
 def test_select_label(qtbot, viewer, db_session):
     """
     Test selection of a cell with a right click.
@@ -253,3 +261,153 @@ def test_build_labels_too_many(qtbot, viewer, db_session):
     assert (
         np.max(viewer.layers['Labels'].data) == 0
     ), f'Expected no labels, instead get max label {np.max(viewer.layers["Labels"].data)}'
+
+
+def test_build_labels_too_many_overview(qtbot, viewer, db_session):
+    """
+    Test that cells are shown as points when there are too many for labels.
+    """
+
+    track_navigation_widget = TrackNavigationWidget(viewer, db_session)
+
+    qtbot.addWidget(track_navigation_widget)
+
+    track_navigation_widget.query_lim = 2
+
+    # trigger update
+    viewer.dims.set_point(0, 130)
+
+    overview = viewer.layers[track_navigation_widget.overview_name]
+    assert overview.visible
+    assert len(overview.data) > 0
+    assert viewer.layers.selection.active is viewer.layers['Labels']
+
+    # back to labels
+    track_navigation_widget.query_lim = 500
+    track_navigation_widget.build_labels()
+
+    assert not overview.visible
+    assert np.max(viewer.layers['Labels'].data) > 0
+
+
+def test_build_labels_levels(qtbot, viewer, db_session):
+    """
+    Test rendering labels at a lower resolution level when zoomed out.
+    """
+
+    viewer.layers['Labels'].metadata['levels'] = [1, 4]
+
+    track_navigation_widget = TrackNavigationWidget(viewer, db_session)
+
+    qtbot.addWidget(track_navigation_widget)
+
+    # whole frame in the field of view
+    viewer.camera.zoom = 0.05
+    viewer.dims.set_point(0, 130)
+    wait_for_labels(qtbot, track_navigation_widget)
+
+    level_layer = viewer.layers['Labels level 1']
+    assert viewer.layers['Labels'].metadata['level'] == 1
+    assert level_layer.visible
+    assert level_layer.scale[-1] == 4
+    assert np.max(level_layer.data) > 0
+    assert np.max(viewer.layers['Labels'].data) == 0
+    assert viewer.layers['Labels'].metadata['query'] == []
+
+    # full resolution when zoomed in
+    viewer.camera.zoom = 1
+    wait_for_labels(qtbot, track_navigation_widget)
+
+    assert viewer.layers['Labels'].metadata['level'] == 0
+    assert not level_layer.visible
+    assert np.max(viewer.layers['Labels'].data) > 0
+
+
+def test_labels_viewport_buffer(qtbot, viewer, db_session):
+    """
+    Test that the labels layer holds only the field of view.
+    """
+
+    track_navigation_widget = TrackNavigationWidget(viewer, db_session)
+
+    qtbot.addWidget(track_navigation_widget)
+
+    viewer.dims.set_point(0, 10)
+    viewer.camera.zoom = 1
+    viewer.camera.center = (0, 5051, 4569)
+    wait_for_labels(qtbot, track_navigation_widget)
+
+    labels = viewer.layers['Labels']
+    assert labels.data.dtype == np.uint32
+    assert labels.data.size < 10000 * 10000
+    assert labels.translate[-2] > 0
+    assert labels.translate[-1] > 0
+
+    # selection in the frame coordinates
+    pos = (10, 5051.0, 4569.0)
+    viewer.cursor.position = pos
+    event = Mock()
+    event.button = 2
+    event.position = pos
+
+    track_navigation_widget.select_label(viewer, event)
+
+    assert labels.selected_label == 20422
+
+
+def test_camera_events_coalesced(qtbot, viewer, db_session, mocker):
+    """
+    Test that a burst of camera events results in a single refresh.
+    """
+
+    track_navigation_widget = TrackNavigationWidget(viewer, db_session)
+
+    qtbot.addWidget(track_navigation_widget)
+
+    spy = mocker.spy(track_navigation_widget.renderer, 'render')
+
+    # e.g. a mouse-wheel zoom
+    for zoom in np.linspace(0.5, 1, 10):
+        viewer.camera.zoom = zoom
+    viewer.camera.center = (0, 5051, 4569)
+
+    assert spy.call_count == 0
+    assert track_navigation_widget.refresh_timer.isActive()
+
+    wait_for_labels(qtbot, track_navigation_widget)
+
+    assert spy.call_count == 1
+
+
+def test_follow_track_trajectory_cache(qtbot, viewer, db_session, mocker):
+    """
+    Test that following a track does not query the database every frame.
+    """
+
+    track_navigation_widget = TrackNavigationWidget(viewer, db_session)
+
+    qtbot.addWidget(track_navigation_widget)
+
+    spy = mocker.spy(fdb, 'get_track_trajectory')
+
+    viewer.dims.set_point(0, 40)
+    track_navigation_widget.labels.selected_label = 37402
+
+    for t in range(41, 46):
+        viewer.dims.set_point(0, t)
+
+        cell = db_session.query(CellDB).filter_by(track_id=37402, t=t).one()
+        np.testing.assert_allclose(
+            viewer.camera.center, (0.0, cell.row, cell.col)
+        )
+
+    assert spy.call_count == 1
+
+    # edits reload the trajectory
+    fdb.remove_CellDB(db_session, 37402, 46)
+    center_before = viewer.camera.center
+    viewer.dims.set_point(0, 46)
+
+    assert spy.call_count == 2
+    assert track_navigation_widget.track_position(37402, 46) is None
+    assert viewer.camera.center == center_before
@@ -1,44 +1,991 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from copy import deepcopy
 
 import dask.array as da
 import numpy as np
+from numba import njit
+from scipy.ndimage import distance_transform_edt
 from skimage.transform import resize
-from sqlalchemy import and_
-from sqlalchemy.orm import aliased
+from sqlalchemy import (
+    LargeBinary,
+    and_,
+    delete,
+    event,
+    func,
+    insert,
+    inspect,
+    literal_column,
+    or_,
+    select,
+    text,
+    type_coerce,
+    update,
+)
+from sqlalchemy.orm import aliased, undefer
 from sqlalchemy.orm.attributes import flag_modified
-from skimage.morphology import binary_dilation, disk
 
-from tracks_interactions.db.db_model import CellDB, TrackDB
+from tracks_interactions.db.db_model import (
+    CellDB,
+    CellRTree,
+    CellSignal,
+    TrackClosure,
+    TrackDB,
+    optional_metadata,
+)
+from tracks_interactions.db.mask_codec import (
+    MASK_HEADER,
+    decode_mask,
+    is_encoded_mask,
+)
+
+# number of the latest cell edits kept in the session (see get_cell_edits)
+CELL_EDITS_KEPT = 1000
+
+
+@contextmanager
+def transaction(session):
+    """
+    Context grouping database operations into a single commit.
+    Functions called inside only flush their changes,
+    everything is committed when the outermost context exits
+    or rolled back if an exception is raised.
+    Contexts can be nested.
+    input:
+        session
+    """
+
+    depth = session.info.get('transaction_depth', 0)
+    session.info['transaction_depth'] = depth + 1
+
+    try:
+        yield session
+    except BaseException:
+        if depth == 0:
+            session.rollback()
+        raise
+    else:
+        if depth == 0:
+            session.commit()
+    finally:
+        session.info['transaction_depth'] = depth
+
+
+def _commit(session):
+    """
+    Commit unless inside of a transaction context.
+    """
+
+    if session.info.get('transaction_depth', 0) > 0:
+        session.flush()
+    else:
+        session.commit()
+
+
+def newTrack_number(session, mode='next'):
+    """
+    input:
+        - session
+        - mode - 'next' for the number following the highest track
+                 'first_unused' for the lowest number not taken by any track
+    output:
+        - number of the new track
+        - numbers reserved in this session (see reserve_track_number)
+          are not proposed again
+    """
+
+    reserved = session.info.get('reserved_tracks', set())
+
+    if mode == 'next':
+        # resolved on the primary key index without sorting the table
+        query = session.query(func.max(TrackDB.track_id)).scalar()
+
+        highest = max([query or 0] + list(reserved))
+
+        return highest + 1
+
+    if mode == 'first_unused':
+        # gaps between consecutive tracks, -1 stands for no upper limit
+        gaps = session.execute(
+            text(
+                """
+                SELECT gap_start, gap_stop FROM (
+                    SELECT 1 AS gap_start, COALESCE(
+                        (SELECT MIN(track_id) FROM tracks WHERE track_id >= 1),
+                        -1
+                    ) AS gap_stop
+                    UNION ALL
+                    SELECT tracks.track_id + 1, COALESCE(
+                        (
+                            SELECT MIN(upper.track_id) FROM tracks AS upper
+                            WHERE upper.track_id > tracks.track_id
+                        ),
+                        -1
+                    )
+                    FROM tracks
+                    WHERE tracks.track_id >= 0 AND NOT EXISTS (
+                        SELECT 1 FROM tracks AS upper
+                        WHERE upper.track_id = tracks.track_id + 1
+                    )
+                )
+                WHERE gap_stop = -1 OR gap_stop > gap_start
+                ORDER BY gap_start
+                """
+            )
+        )
+
+        # the gap above the highest track has no limit,
+        # so a number is always found
+        for gap_start, gap_stop in gaps:
+            new_track = gap_start
+            while new_track in reserved and new_track != gap_stop:
+                new_track += 1
+
+            if new_track != gap_stop:
+                return new_track
+
+        return None
+
+    raise ValueError("Mode should be 'next' or 'first_unused'.")
+
+
+def _release_track_numbers(session, *args):
+    """
+    Forget numbers reserved in the session when its transaction ends -
+    after a commit their tracks are in the database,
+    after a rollback they are not going to be created.
+    """
+    session.info.pop('reserved_tracks', None)
+
+
+def reserve_track_number(session, mode='next'):
+    """
+    Function to get a number for a track that is about to be created.
+    Reserved numbers are not given out again in this session,
+    also before their tracks are flushed to the database,
+    so several tracks can be started within one transaction.
+    Reservations are released when the transaction is committed
+    or rolled back.
+    input:
+        - session
+        - mode - as in newTrack_number
+    output:
+        - number of the new track
+    """
+
+    for name in ('after_commit', 'after_rollback'):
+        if not event.contains(session, name, _release_track_numbers):
+            event.listen(session, name, _release_track_numbers)
+
+    new_track = newTrack_number(session, mode=mode)
+    session.info.setdefault('reserved_tracks', set()).add(new_track)
+
+    return new_track
+
+
+def query_cells(session, mask=False, signals=False):
+    """
+    Function to start a query of CellDB objects.
+    Masks and signals are deferred in the model,
+    this is the place to request them when they are needed.
+    input:
+        session
+        mask - load masks with the cells
+        signals - load signals with the cells
+    output:
+        query of CellDB
+    """
+
+    query = session.query(CellDB)
+
+    if mask:
+        query = query.options(undefer(CellDB.mask))
+
+    if signals:
+        query = query.options(undefer(CellDB.signals))
+
+    return query
+
+
+def get_signals(session):
+    """
+    Function to get signal names from the database.
+    """
+    example_signals = session.query(CellDB.signals).first()[0]
+    signal_list = list(example_signals.keys())
+
+    return signal_list
+
+
+def get_signal_counts(session):
+    """
+    Function to count cells having every signal.
+    output:
+        dictionary signal name: number of cells
+    """
+
+    query = session.execute(
+        text(
+            """
+            SELECT je.key, count(*)
+            FROM cells, json_each(cells.signals) AS je
+            WHERE je.type != 'null'
+            GROUP BY je.key
+            """
+        )
+    )
+
+    return dict(query.all())
+
+
+def get_frames_missing_signals(session, signal_list):
+    """
+    Function to find frames with cells missing any of the signals.
+    input:
+        session
+        signal_list - names of signals
+    output:
+        sorted list of frames
+    """
+
+    if len(signal_list) == 0:
+        return []
+
+    missing = [
+        func.json_type(CellDB.signals, f'$."{signal}"').is_(None)
+        for signal in signal_list
+    ]
+
+    query = session.query(CellDB.t).filter(or_(*missing)).distinct()
+
+    return sorted(t for (t,) in query)
+
+
+def _has_table(session, table_name):
+    """
+    Check whether a table exists in the database.
+    The answer is cached with the session.
+    """
+    tables = session.info.setdefault('tables', {})
+
+    if table_name not in tables:
+        tables[table_name] = inspect(session.connection()).has_table(
+            table_name
+        )
+
+    return tables[table_name]
+
+
+def has_cell_rtree(session):
+    """
+    Check whether the database has the R*Tree index of cells.
+    """
+    return _has_table(session, CellRTree.name)
+
+
+def create_cell_rtree(session):
+    """
+    Function to create the R*Tree index of cells (t, bbox) and populate it.
+    Triggers on the cells table keep the index in sync
+    with every insert, removal and modification of cells.
+    input:
+        session
+    """
+
+    statements = [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS cells_rtree USING rtree_i32(
+            id, t_min, t_max, row_min, row_max, col_min, col_max
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS cells_rtree_insert
+        AFTER INSERT ON cells
+        BEGIN
+            INSERT OR REPLACE INTO cells_rtree VALUES (
+                new.rowid, new.t, new.t,
+                new.bbox_0, new.bbox_2, new.bbox_1, new.bbox_3
+            );
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS cells_rtree_delete
+        AFTER DELETE ON cells
+        BEGIN
+            DELETE FROM cells_rtree WHERE id = old.rowid;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS cells_rtree_update
+        AFTER UPDATE OF t, bbox_0, bbox_1, bbox_2, bbox_3 ON cells
+        BEGIN
+            UPDATE cells_rtree SET t_min = new.t, t_max = new.t,
+                row_min = new.bbox_0, row_max = new.bbox_2,
+                col_min = new.bbox_1, col_max = new.bbox_3
+            WHERE id = old.rowid;
+        END
+        """,
+        """
+        INSERT OR REPLACE INTO cells_rtree
+        SELECT rowid, t, t, bbox_0, bbox_2, bbox_1, bbox_3 FROM cells
+        """,
+    ]
+
+    for statement in statements:
+        session.execute(text(statement))
+
+    session.commit()
+
+    session.info.setdefault('tables', {})[CellRTree.name] = True
+
+
+def _in_view_conditions(
+    session, current_frame, r_start, r_stop, c_start, c_stop
+):
+    """
+    Conditions selecting cells of a frame that overlap with a field of view.
+    Uses the R*Tree index if the database has one.
+    """
+
+    if has_cell_rtree(session):
+        cells_in_view = select(CellRTree.c.id).where(
+            CellRTree.c.t_min <= current_frame,
+            CellRTree.c.t_max >= current_frame,
+            CellRTree.c.row_min < int(r_stop),
+            CellRTree.c.row_max > int(r_start),
+            CellRTree.c.col_min < int(c_stop),
+            CellRTree.c.col_max > int(c_start),
+        )
+        return [literal_column('cells.rowid').in_(cells_in_view)]
+
+    return [
+        CellDB.t == current_frame,
+        CellDB.bbox_0 < int(r_stop),
+        CellDB.bbox_1 < int(c_stop),
+        CellDB.bbox_2 > int(r_start),
+        CellDB.bbox_3 > int(c_start),
+    ]
+
+
+def get_cells_in_view(
+    session, current_frame, r_start, r_stop, c_start, c_stop, limit=None
+):
+    """
+    Function to get cells of a frame that overlap with a field of view.
+    Uses the R*Tree index if the database has one.
+    input:
+        session
+        current_frame - time point
+        r_start, r_stop, c_start, c_stop - extent of the field of view
+        limit - maximum number of cells to return
+    output:
+        list of CellDB objects with masks loaded
+    """
+
+    query = query_cells(session, mask=True).filter(
+        *_in_view_conditions(
+            session, current_frame, r_start, r_stop, c_start, c_stop
+        )
+    )
+
+    if limit is not None:
+        query = query.limit(limit)
+
+    return query.all()
+
+
+def get_cell_rows_in_view(
+    session, current_frame, r_start, r_stop, c_start, c_stop
+):
+    """
+    Function to get cells of a frame that overlap with a field of view
+    as plain rows, e.g. to be cached by views without tying CellDB objects
+    to the session.
+    input:
+        session
+        current_frame - time point
+        r_start, r_stop, c_start, c_stop - extent of the field of view
+    output:
+        list of rows with track_id, t, row, col, bbox_0 - bbox_3 and mask
+    """
+
+    query = session.query(
+        CellDB.track_id,
+        CellDB.t,
+        CellDB.row,
+        CellDB.col,
+        CellDB.bbox_0,
+        CellDB.bbox_1,
+        CellDB.bbox_2,
+        CellDB.bbox_3,
+        CellDB.mask,
+    ).filter(
+        *_in_view_conditions(
+            session, current_frame, r_start, r_stop, c_start, c_stop
+        )
+    )
+
+    return query.all()
+
+
+def count_cells_in_view(
+    session, current_frame, r_start, r_stop, c_start, c_stop, limit=None
+):
+    """
+    Function to count cells of a frame that overlap with a field of view.
+    input:
+        session
+        current_frame - time point
+        r_start, r_stop, c_start, c_stop - extent of the field of view
+        limit - stop counting at this number
+    output:
+        number of cells
+    """
+
+    cells = (
+        select(literal_column('1'))
+        .select_from(CellDB)
+        .where(
+            *_in_view_conditions(
+                session, current_frame, r_start, r_stop, c_start, c_stop
+            )
+        )
+    )
+
+    if limit is not None:
+        cells = cells.limit(limit)
+
+    return session.execute(
+        select(func.count()).select_from(cells.subquery())
+    ).scalar()
+
+
+def get_cell_density_in_view(
+    session, current_frame, r_start, r_stop, c_start, c_stop, bin_size
+):
+    """
+    Function to summarize cells of a frame in a field of view
+    without loading their masks.
+    Cells are aggregated on a grid of bins, so that the number of points
+    stays bounded at any magnification.
+    input:
+        session
+        current_frame - time point
+        r_start, r_stop, c_start, c_stop - extent of the field of view
+        bin_size - size of grid bins in pixels
+    output:
+        array (n, 3) - mean row, mean column and number of cells of each bin
+    """
+
+    bin_size = max(int(bin_size), 1)
+
+    query = (
+        session.query(func.avg(CellDB.row), func.avg(CellDB.col), func.count())
+        .filter(
+            *_in_view_conditions(
+                session, current_frame, r_start, r_stop, c_start, c_stop
+            )
+        )
+        .group_by(CellDB.row // bin_size, CellDB.col // bin_size)
+    )
+
+    return np.array(query.all(), dtype=float).reshape(-1, 3)
+
+
+@njit(cache=True)
+def _paint_packed_masks(
+    frame, packed, offsets, bboxes, track_ids, origin_r, origin_c
+):
+    """
+    Paint bit-packed masks into a frame, later cells overwrite earlier ones.
+    Pixels outside of the frame are skipped.
+    """
+
+    for i in range(len(track_ids)):
+        r0, c0, r1, c1 = bboxes[i]
+        width = c1 - c0
+        start = offsets[i]
+
+        for r in range(max(r0, origin_r), min(r1, origin_r + frame.shape[0])):
+            for c in range(
+                max(c0, origin_c), min(c1, origin_c + frame.shape[1])
+            ):
+                bit = (r - r0) * width + (c - c0)
+                if (packed[start + (bit >> 3)] >> (7 - (bit & 7))) & 1:
+                    frame[r - origin_r, c - origin_c] = track_ids[i]
+
+
+def pack_cells(cells):
+    """
+    Function to gather cells into arrays of the batch rasterizer.
+    input:
+        cells - objects with bbox_0 - bbox_3, track_id and mask,
+                masks can be boolean arrays or bytes as stored in the database
+    output:
+        packed - bit-packed masks of all cells one after another
+        offsets - start of every mask in packed
+        bboxes - array (n, 4) of bounding boxes
+        track_ids - array of track ids
+    """
+
+    chunks = []
+    offsets = np.zeros(len(cells), dtype=np.int64)
+    position = 0
+
+    for ind, cell in enumerate(cells):
+        mask = cell.mask
+
+        # stored encoding is already bit-packed
+        if isinstance(mask, bytes) and is_encoded_mask(mask):
+            chunk = np.frombuffer(
+                mask, dtype=np.uint8, offset=MASK_HEADER.size
+            )
+        else:
+            if isinstance(mask, bytes):
+                mask = decode_mask(mask)
+            chunk = np.packbits(mask, axis=None)
+
+        offsets[ind] = position
+        position += len(chunk)
+        chunks.append(chunk)
+
+    packed = (
+        np.concatenate(chunks) if len(chunks) > 0 else np.zeros(0, np.uint8)
+    )
+    bboxes = np.array(
+        [[x.bbox_0, x.bbox_1, x.bbox_2, x.bbox_3] for x in cells],
+        dtype=np.int64,
+    ).reshape(-1, 4)
+    track_ids = np.array([x.track_id for x in cells], dtype=np.int64)
+
+    return packed, offsets, bboxes, track_ids
+
+
+def rasterize_cells(frame, cells, origin=(0, 0), values=None):
+    """
+    Function to paint many cells into a preallocated frame in one pass.
+    Cells overwrite what is in the frame (and cells earlier in the list).
+    input:
+        frame - 2D integer array, e.g. uint32
+        cells - objects with bbox_0 - bbox_3, track_id and mask
+        origin - position of the frame's first pixel in the full image,
+                 parts of cells outside of the frame are skipped
+        values - values to paint the cells with, track ids if None
+    output:
+        frame
+    """
+
+    if len(cells) == 0:
+        return frame
+
+    packed, offsets, bboxes, track_ids = pack_cells(cells)
+
+    if values is not None:
+        track_ids = np.asarray(values, dtype=np.int64)
+
+    _paint_packed_masks(
+        frame,
+        packed,
+        offsets,
+        bboxes,
+        track_ids,
+        int(origin[0]),
+        int(origin[1]),
+    )
+
+    return frame
+
+
+def render_frame(session, current_frame, shape, dtype=np.uint32):
+    """
+    Function to paint all cells of a frame, e.g. to export labels.
+    Masks are rasterized from their stored encoding without decoding.
+    input:
+        session
+        current_frame - time point
+        shape - shape of the frame
+        dtype - type of the labels
+    output:
+        frame
+    """
+
+    cells = get_frame_masks(session, current_frame)
+
+    return rasterize_cells(np.zeros(shape, dtype=dtype), cells)
+
+
+def get_frame_masks(session, current_frame):
+    """
+    Function to get masks of all cells of a frame for rasterizing.
+    Masks are left in their stored encoding.
+    input:
+        session
+        current_frame - time point
+    output:
+        list of rows with track_id, bbox_0 - bbox_3 and mask
+    """
+
+    return (
+        session.query(
+            CellDB.track_id,
+            CellDB.bbox_0,
+            CellDB.bbox_1,
+            CellDB.bbox_2,
+            CellDB.bbox_3,
+            type_coerce(CellDB.mask, LargeBinary).label('mask'),
+        )
+        .filter(CellDB.t == current_frame)
+        .order_by(CellDB.track_id)
+        .all()
+    )
+
+
+def _log_cell_edit(session, cell):
+    """
+    Remember the extent of an added, removed or modified cell.
+    Only the latest CELL_EDITS_KEPT edits are kept,
+    the counter of all edits is the position in the log.
+    """
+    session.info.setdefault(
+        'cell_edits', deque(maxlen=CELL_EDITS_KEPT)
+    ).append((cell.t, cell.bbox_0, cell.bbox_1, cell.bbox_2, cell.bbox_3))
+    session.info['cell_edits_count'] = (
+        session.info.get('cell_edits_count', 0) + 1
+    )
+
+
+def get_cell_edits(session, since=0):
+    """
+    Function to get extents of cells edited in this session,
+    e.g. to invalidate views caching rendered cells.
+    input:
+        session
+        since - position in the log returned by the previous call
+    output:
+        edits - list of (t, bbox_0, bbox_1, bbox_2, bbox_3),
+                None if edits after since are no longer kept
+                (everything has to be invalidated)
+        position - position to pass as since in the next call
+    """
+
+    count = session.info.get('cell_edits_count', 0)
+    edits = list(session.info.get('cell_edits', ()))
+
+    # edits dropped from the log
+    if count - since > len(edits):
+        return None, count
+
+    return edits[len(edits) - (count - since) :], count
+
+
+def get_track_span(session, track_id):
+    """
+    Function to get the first and the last frame of a track.
+    input:
+        session
+        track_id
+    output:
+        (t_begin, t_end) or None if there is no such track
+    """
+
+    span = (
+        session.query(TrackDB.t_begin, TrackDB.t_end)
+        .filter(TrackDB.track_id == track_id)
+        .first()
+    )
+
+    if span is None:
+        return None
+
+    return span.t_begin, span.t_end
+
+
+def get_track_trajectory(session, track_id):
+    """
+    Function to get positions of a track in all frames.
+    input:
+        session
+        track_id
+    output:
+        array (n, 3) of t, row, col sorted by t
+    """
+
+    positions = (
+        session.query(CellDB.t, CellDB.row, CellDB.col)
+        .filter(CellDB.track_id == track_id)
+        .order_by(CellDB.t)
+        .all()
+    )
+
+    return np.array(positions, dtype=np.int64).reshape(-1, 3)
+
+
+def has_signal_store(session):
+    """
+    Check whether the database has the columnar signal store.
+    """
+    return _has_table(session, CellSignal.name)
+
+
+def create_signal_store(session):
+    """
+    Function to create the columnar signal store
+    and fill it with the signals of all cells.
+    Once created, the store is updated by the functions adding,
+    removing and reassigning cells.
+    input:
+        session
+    """
+
+    optional_metadata.create_all(
+        session.connection(), tables=[CellSignal], checkfirst=True
+    )
+
+    session.execute(
+        text(
+            'INSERT OR REPLACE INTO cell_signals (track_id, t, signal, value) '
+            'SELECT cells.track_id, cells.t, je.key, je.value '
+            'FROM cells, json_each(cells.signals) AS je '
+            "WHERE je.type IN ('integer', 'real')"
+        )
+    )
 
-def newTrack_number(session):
+    session.commit()
+
+    session.info.setdefault('tables', {})[CellSignal.name] = True
+
+
+def write_cell_signals(session, track_id, current_frame, signals):
     """
+    Function to write signals of a cell to the columnar signal store.
     input:
-        - session
+        session
+        track_id
+        current_frame
+        signals - dictionary of signals
+    """
+
+    write_cells_signals(session, current_frame, {track_id: signals})
+
+
+def write_cells_signals(session, current_frame, signals_by_track):
+    """
+    Function to write signals of many cells of a frame
+    to the columnar signal store in a single statement.
+    input:
+        session
+        current_frame
+        signals_by_track - dictionary track_id: dictionary of signals
+    """
+
+    if len(signals_by_track) == 0:
+        return
+
+    session.execute(
+        delete(CellSignal).where(
+            CellSignal.c.track_id.in_(list(signals_by_track)),
+            CellSignal.c.t == current_frame,
+        )
+    )
+
+    rows = [
+        {
+            'track_id': track_id,
+            't': current_frame,
+            'signal': key,
+            'value': float(value),
+        }
+        for track_id, signals in signals_by_track.items()
+        for key, value in signals.items()
+        if isinstance(value, (int, float, np.number))
+    ]
+
+    if len(rows) > 0:
+        session.execute(insert(CellSignal), rows)
+
+
+def get_track_signals(session, active_label, signal_list):
+    """
+    Function to get time series of signals for a track.
+    Uses the columnar signal store if the database has one.
+    input:
+        session
+        active_label - track_id
+        signal_list - names of signals
     output:
-        - number of the new track
-        - in the future consider getting first unused if fast enough
+        t - array of time points from the beginning to the end of the track
+        values - array (t x signal), NaN where a cell or a signal is missing
     """
 
-    query = (
-        session.query(TrackDB.track_id)
-        .order_by(TrackDB.track_id.desc())
-        .first()
+    if has_signal_store(session):
+        query = session.execute(
+            select(CellSignal.c.t, CellSignal.c.signal, CellSignal.c.value)
+            .where(CellSignal.c.track_id == active_label)
+            .where(CellSignal.c.signal.in_(signal_list))
+        ).all()
+
+    else:
+        query = [
+            (t, sig, signals[sig])
+            for t, signals in session.query(CellDB.t, CellDB.signals)
+            .filter(CellDB.track_id == active_label)
+            .all()
+            for sig in signal_list
+            if sig in signals
+        ]
+
+    if len(query) == 0:
+        return np.zeros(0, dtype=int), np.zeros((0, len(signal_list)))
+
+    t_list = np.array([x[0] for x in query])
+    signal_ind = {sig: ind for ind, sig in enumerate(signal_list)}
+    col_list = np.array([signal_ind[x[1]] for x in query])
+
+    t_min = t_list.min()
+    t = np.arange(t_min, t_list.max() + 1)
+
+    values = np.full((len(t), len(signal_list)), np.nan)
+    values[t_list - t_min, col_list] = [x[2] for x in query]
+
+    return t, values
+
+
+def has_track_closure(session):
+    """
+    Check if the database has the closure table of track lineages.
+    The answer is cached with the session - a table created later
+    by another connection is used only by new sessions
+    (it is kept in sync by triggers also before that).
+    """
+    return _has_table(session, TrackClosure.name)
+
+
+def create_track_closure(session):
+    """
+    Function to create the closure table of track lineages and populate it.
+    It keeps a row for every ancestor/descendant pair (including each track
+    with itself at depth 0), so lineage lookups are single indexed selects.
+    Triggers on the tracks table keep it in sync with every insert,
+    removal and change of the parent of tracks, also when tracks
+    are written outside of these functions.
+    input:
+        session
+    """
+
+    optional_metadata.create_all(
+        session.connection(), tables=[TrackClosure], checkfirst=True
     )
 
-    if query is None:
-        return 1
+    statements = [
+        # a new track below the ancestors of its parent,
+        # with children already pointing to it (in any order of writes)
+        """
+        CREATE TRIGGER IF NOT EXISTS track_closure_insert
+        AFTER INSERT ON tracks
+        BEGIN
+            INSERT INTO track_closure (ancestor, descendant, depth)
+            VALUES (new.track_id, new.track_id, 0);
+
+            INSERT INTO track_closure (ancestor, descendant, depth)
+            SELECT new.track_id, below.descendant, below.depth + 1
+            FROM tracks
+            JOIN track_closure AS below ON below.ancestor = tracks.track_id
+            WHERE tracks.parent_track_id = new.track_id;
+
+            INSERT INTO track_closure (ancestor, descendant, depth)
+            SELECT above.ancestor, below.descendant,
+                above.depth + below.depth + 1
+            FROM track_closure AS above, track_closure AS below
+            WHERE above.descendant = new.parent_track_id
+                AND below.ancestor = new.track_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS track_closure_delete
+        AFTER DELETE ON tracks
+        BEGIN
+            DELETE FROM track_closure
+            WHERE ancestor = old.track_id OR descendant = old.track_id;
+        END
+        """,
+        # the subtree of the track is detached from its ancestors
+        # and attached below the ancestors of the new parent
+        """
+        CREATE TRIGGER IF NOT EXISTS track_closure_update
+        AFTER UPDATE OF parent_track_id ON tracks
+        WHEN old.parent_track_id IS NOT new.parent_track_id
+        BEGIN
+            DELETE FROM track_closure
+            WHERE descendant IN (
+                SELECT descendant FROM track_closure
+                WHERE ancestor = new.track_id
+            )
+            AND ancestor IN (
+                SELECT ancestor FROM track_closure
+                WHERE descendant = new.track_id AND ancestor != new.track_id
+            );
+
+            INSERT INTO track_closure (ancestor, descendant, depth)
+            SELECT above.ancestor, below.descendant,
+                above.depth + below.depth + 1
+            FROM track_closure AS above, track_closure AS below
+            WHERE above.descendant = new.parent_track_id
+                AND below.ancestor = new.track_id;
+        END
+        """,
+        """
+        INSERT OR REPLACE INTO track_closure (ancestor, descendant, depth)
+        WITH RECURSIVE closure(ancestor, descendant, depth) AS (
+            SELECT track_id, track_id, 0 FROM tracks
+            UNION ALL
+            SELECT closure.ancestor, tracks.track_id, closure.depth + 1
+            FROM closure
+            JOIN tracks ON tracks.parent_track_id = closure.descendant
+        )
+        SELECT ancestor, descendant, depth FROM closure
+        """,
+    ]
 
-    return query[0] + 1
+    for statement in statements:
+        session.execute(text(statement))
 
+    session.commit()
 
-def get_signals(session):
+    session.info.setdefault('tables', {})[TrackClosure.name] = True
+
+
+def get_ancestors(session, active_label):
     """
-    Function to get signal names from the database.
+    Function to get all ancestors of a given label.
+    input:
+        session
+        active_label - label for which we want to get ancestors
+    output:
+        ancestors - list of ancestors starting with the label itself
+                    and ending with the root
     """
-    example_cell = session.query(CellDB).first()
-    signal_list = list(example_cell.signals.keys())
 
-    return signal_list
+    if has_track_closure(session):
+        return (
+            session.query(TrackDB)
+            .join(TrackClosure, TrackDB.track_id == TrackClosure.c.ancestor)
+            .filter(TrackClosure.c.descendant == active_label)
+            .order_by(TrackClosure.c.depth)
+            .all()
+        )
+
+    ancestors = []
+    track = session.query(TrackDB).filter_by(track_id=active_label).first()
+    while track is not None:
+        ancestors.append(track)
+        track = (
+            session.query(TrackDB)
+            .filter_by(track_id=track.parent_track_id)
+            .first()
+        )
+
+    return ancestors
 
 
 def get_descendants(session, active_label):
@@ -51,6 +998,16 @@ def get_descendants(session, active_label):
         descendants - list of descendants as row objects (not modifyable)
     """
 
+    # single indexed select if lineages are kept in the closure table
+    if has_track_closure(session):
+        return (
+            session.query(TrackDB)
+            .join(TrackClosure, TrackDB.track_id == TrackClosure.c.descendant)
+            .filter(TrackClosure.c.ancestor == active_label)
+            .order_by(TrackClosure.c.depth)
+            .all()
+        )
+
     cte = (
         session.query(TrackDB)
         .filter(TrackDB.track_id == active_label)
@@ -75,6 +1032,112 @@ def get_descendants(session, active_label):
     return descendants
 
 
+def _descendants_select(session, active_label):
+    """
+    Select statement of ids of a track and all its descendants.
+    """
+
+    if has_track_closure(session):
+        return select(TrackClosure.c.descendant).where(
+            TrackClosure.c.ancestor == active_label
+        )
+
+    cte = (
+        select(TrackDB.track_id)
+        .where(TrackDB.track_id == active_label)
+        .cte(recursive=True)
+    )
+    cte = cte.union_all(
+        select(TrackDB.track_id).where(
+            TrackDB.parent_track_id == cte.c.track_id
+        )
+    )
+
+    return select(cte.c.track_id)
+
+
+def _log_modified_tracks(session, track_ids):
+    """
+    Remember tracks modified by set-based updates.
+    """
+    session.info.setdefault('modified_tracks', set()).update(track_ids)
+
+
+def pop_modified_tracks(session):
+    """
+    Function to get (and forget) tracks modified by edit operations
+    since the last call, e.g. to refresh views of these tracks.
+    input:
+        session
+    output:
+        set of track ids
+    """
+    return session.info.pop('modified_tracks', set())
+
+
+def _reassign_root(session, active_label, root, include_self=True):
+    """
+    Set-based change of the root of a track and all its descendants.
+    input:
+        session
+        active_label - track which family is modified
+        root - new root
+        include_self - whether the active_label track is modified as well
+    output:
+        list of modified track ids
+    """
+
+    descendants = _descendants_select(session, active_label)
+
+    condition = TrackDB.track_id.in_(descendants)
+    if not include_self:
+        condition = and_(condition, TrackDB.track_id != active_label)
+
+    modified = (
+        session.execute(
+            update(TrackDB)
+            .where(condition)
+            .values(root=root)
+            .returning(TrackDB.track_id),
+            execution_options={'synchronize_session': 'fetch'},
+        )
+        .scalars()
+        .all()
+    )
+
+    _log_modified_tracks(session, modified)
+
+    return modified
+
+
+def _reassign_children(session, parent_track_id, new_parent_track_id):
+    """
+    Set-based change of the parent of all children of a track.
+    input:
+        session
+        parent_track_id - current parent
+        new_parent_track_id - new parent
+    output:
+        list of modified track ids
+    """
+
+    modified = (
+        session.execute(
+            update(TrackDB)
+            .where(TrackDB.parent_track_id == parent_track_id)
+            .values(parent_track_id=new_parent_track_id)
+            .returning(TrackDB.track_id),
+            execution_options={'synchronize_session': 'fetch'},
+        )
+        .scalars()
+        .all()
+    )
+
+    _log_modified_tracks(session, modified)
+
+    return modified
+
+
 def delete_trackDB(session, active_label):
     """
     Function to delete a track from trackDB.
@@ -88,16 +1151,19 @@ def delete_trackDB(session, active_label):
 
     # if the track is found
     if record is not None:
-        # process descendants
-        descendants = get_descendants(session, active_label)
-        for track in [x for x in descendants if x.track_id != active_label]:
-            if track.parent_track_id == active_label:
-                cut_trackDB(session, track.track_id, track.t_begin)
+        # cut off the children
+        children = (
+            session.query(TrackDB.track_id, TrackDB.t_begin)
+            .filter(TrackDB.parent_track_id == active_label)
+            .all()
+        )
+        for track_id, t_begin in children:
+            cut_trackDB(session, track_id, t_begin)
 
         # delete the track
         session.delete(record)
 
-        session.commit()
+        _commit(session)
 
         status = f'Track {active_label} has been deleted.'
 
@@ -139,17 +1205,14 @@ def cut_trackDB(session, active_label, current_frame):
     elif (record.parent_track_id > -1) and (record.t_begin == current_frame):
         record.parent_track_id = -1
 
-        # process descendants
-        descendants = get_descendants(session, active_label)
-
-        for track in descendants:
-            track.root = active_label
+        # the track becomes a root of its family
+        _reassign_root(session, active_label, active_label)
 
         # indicate no new track
         new_track = None
         mitosis = True
 
-        session.commit()
+        _commit(session)
 
     # there is a true cut
     elif record.t_begin < current_frame:
@@ -168,7 +1231,7 @@ def cut_trackDB(session, active_label, current_frame):
         record.t_end = t_stop
 
         # add completely new track
-        new_track = newTrack_number(session)
+        new_track = reserve_track_number(session)
 
         track = TrackDB(
             track_id=new_track,
@@ -180,19 +1243,12 @@ def cut_trackDB(session, active_label, current_frame):
 
         session.add(track)
 
-        # process descendants
-        descendants = get_descendants(session, active_label)
-
-        for track in [x for x in descendants if x.track_id != active_label]:
-            # change the value of the root track
-            track.root = new_track
-
-            # change for children
-            if track.parent_track_id == active_label:
-                track.parent_track_id = new_track
+        # the offspring follows the new track
+        _reassign_root(session, active_label, new_track, include_self=False)
+        _reassign_children(session, active_label, new_track)
 
         mitosis = False
-        session.commit()
+        _commit(session)
 
     else:
         raise ValueError('Track situation unaccounted for')
@@ -210,8 +1266,9 @@ def _merge_t2(session, t2, t1, current_frame):
         current_frame - current time point
     """
 
-    # process descendants
-    descendants = get_descendants(session, t2.track_id)
+    # the offspring of t2 follows t1
+    _reassign_root(session, t2.track_id, t1.root, include_self=False)
+    _reassign_children(session, t2.track_id, t1.track_id)
 
     # if there is remaining part at the beginning
     if t2.t_begin < current_frame:
@@ -221,16 +1278,7 @@ def _merge_t2(session, t2, t1, current_frame):
     else:
         session.delete(t2)
 
-    # for everyone except the t2 track
-    for track in [x for x in descendants if x.track_id != t2.track_id]:
-        # change the value of the root track
-        track.root = t1.root
-
-        # change for children
-        if track.parent_track_id == t2.track_id:
-            track.parent_track_id = t1.track_id
-
-    session.commit()
+    _commit(session)
 
 
 def _connect_t2(session, t2, t1, current_frame):
@@ -247,7 +1295,7 @@ def _connect_t2(session, t2, t1, current_frame):
     # if there is a remaining part at the beginning
     if t2.t_begin < current_frame:
         # create a new track
-        new_track = newTrack_number(session)
+        new_track = reserve_track_number(session)
 
         # check if the t2_before needs to become its own root
         new_root = new_track if t2.root == t2.track_id else deepcopy(t2.root)
@@ -271,14 +1319,10 @@ def _connect_t2(session, t2, t1, current_frame):
     # modify family relations
     t2.parent_track_id = t1.track_id
 
-    # process descendants
-    descendants = get_descendants(session, t2.track_id)
+    # t2 and its offspring join the family of t1
+    _reassign_root(session, t2.track_id, t1.root)
 
-    for tr in descendants:
-        # change the value of the root track
-        tr.root = t1.root
-
-    session.commit()
+    _commit(session)
 
     # return the new track number (1st part of t2)
     return new_track
@@ -316,15 +1360,16 @@ def integrate_trackDB(session, operation, t1_ind, t2_ind, current_frame):
         t1_after = None
 
         # if there is t1 offsprint detach them as separate trees
-        descendants = get_descendants(session, t1.track_id)
+        children = (
+            session.query(TrackDB.track_id, TrackDB.t_begin)
+            .filter(TrackDB.parent_track_id == t1.track_id)
+            .all()
+        )
 
-        for track in [x for x in descendants if x.track_id != t1.track_id]:
+        for track_id, t_begin in children:
             # cut off the children if they start at a different time
-            if (track.parent_track_id == t1.track_id) and (
-                track.t_begin != current_frame
-            ):
-                # this route will call descendants twice but I expect it to be rare
-                _, _ = cut_trackDB(session, track.track_id, track.t_begin)
+            if t_begin != current_frame:
+                _, _ = cut_trackDB(session, track_id, t_begin)
 
     if operation == 'merge':
         # change t1_before
@@ -394,12 +1439,29 @@ def cellsDB_after_trackDB(
     if new_track is not None:
         for cell in query:
             cell.track_id = new_track
+            _log_cell_edit(session, cell)
     # or delete the cells
     else:
         for cell in query:
             session.delete(cell)
+            _log_cell_edit(session, cell)
+
+    # follow with the signal store
+    if has_signal_store(session):
+        condition = CellSignal.c.track_id == active_label
+        if direction == 'after':
+            condition = and_(condition, CellSignal.c.t >= current_frame)
+        elif direction == 'before':
+            condition = and_(condition, CellSignal.c.t < current_frame)
+
+        if new_track is not None:
+            session.execute(
+                update(CellSignal).where(condition).values(track_id=new_track)
+            )
+        else:
+            session.execute(delete(CellSignal).where(condition))
 
-    session.commit()
+    _commit(session)
 
 
 def trackDB_after_cellDB(session, cell_id, current_frame):
@@ -422,7 +1484,7 @@ def trackDB_after_cellDB(session, cell_id, current_frame):
             root=cell_id,
         )
         session.add(track)
-        session.commit()
+        _commit(session)
 
     # query for cells
     cells_t = session.query(CellDB.t).filter(CellDB.track_id == cell_id).all()
@@ -461,7 +1523,7 @@ def trackDB_after_cellDB(session, cell_id, current_frame):
     else:
         session.delete(track)
 
-    session.commit()
+    _commit(session)
 
 
 def remove_CellDB(session, cell_id, current_frame):
@@ -479,7 +1541,17 @@ def remove_CellDB(session, cell_id, current_frame):
     if cell is not None:
 
         session.delete(cell)
-        session.commit()
+        _log_cell_edit(session, cell)
+
+        if has_signal_store(session):
+            session.execute(
+                delete(CellSignal).where(
+                    CellSignal.c.track_id == cell_id,
+                    CellSignal.c.t == current_frame,
+                )
+            )
+
+        _commit(session)
 
         # deal with the tracks
         trackDB_after_cellDB(session, cell_id, current_frame)
@@ -509,7 +1581,8 @@ def add_new_core_CellDB(session, current_frame, cell):
     cell_db.mask = cell.image
 
     session.add(cell_db)
-    session.commit()
+    _log_cell_edit(session, cell_db)
+    _commit(session)
 
     return cell_db
 
@@ -526,25 +1599,211 @@ def add_new_CellDB(
     Function to add a complete cell
     """
 
-    cell_db = add_new_core_CellDB(session, current_frame, cell)
+    with transaction(session):
+        cell_db = add_new_core_CellDB(session, current_frame, cell)
+
+        # add signals to the cell
+        if signal_function is not None:
+            new_signals = signal_function(cell, current_frame, ch_list)
+        else:
+            new_signals = {}
+        cell_db.signals = new_signals
+
+        if has_signal_store(session):
+            write_cell_signals(
+                session, cell_db.track_id, current_frame, new_signals
+            )
+
+        # add modified tag to the cell
+        tags = {}
+        if modified:
+            tags['modified'] = True
+            cell_db.tags = tags
+
+        # deal with the tracks
+        trackDB_after_cellDB(session, cell_db.track_id, current_frame)
+
+
+def add_new_CellDB_batch(
+    session,
+    current_frame,
+    cells,
+    modified=True,
+    ch_list=None,
+    signal_function=None,
+    max_workers=None,
+):
+    """
+    Function to add many complete cells of a frame at once.
+    Signals are calculated in parallel from a single read of the channels
+    and written to the signal store in a single statement.
+    input:
+        session
+        current_frame
+        cells - list of regionprops format cells
+        modified - whether to tag the cells as modified
+        ch_list - list of channel data
+        signal_function - function calculating signals of a cell
+        max_workers - number of threads calculating signals
+    """
+
+    if len(cells) == 0:
+        return
 
-    # add signals to the cell
     if signal_function is not None:
-        new_signals = signal_function(cell,current_frame,ch_list)
+        signals_list = calculate_signals_batch(
+            cells,
+            current_frame,
+            ch_list,
+            signal_function,
+            max_workers=max_workers,
+        )
     else:
-        new_signals = {}
-    cell_db.signals = new_signals
+        signals_list = [{} for _ in cells]
 
-    # add modified tag to the cell
-    tags = {}
-    if modified:
-        tags['modified'] = True
-        cell_db.tags = tags
+    with transaction(session):
+        signals_by_track = {}
+        for cell, new_signals in zip(cells, signals_list):
+
+            cell_db = add_new_core_CellDB(session, current_frame, cell)
+            cell_db.signals = new_signals
+            signals_by_track[cell_db.track_id] = new_signals
+
+            # add modified tag to the cell
+            if modified:
+                cell_db.tags = {'modified': True}
+
+        if has_signal_store(session):
+            write_cells_signals(session, current_frame, signals_by_track)
+
+        # deal with the tracks
+        for track_id in signals_by_track:
+            trackDB_after_cellDB(session, track_id, current_frame)
+
+
+class ChannelWindow:
+    """
+    Part of a channel at a single time point read into memory.
+    Indexing with this time point and slices within the window
+    is served from memory, any other indexing is passed to the channel,
+    so signal functions can use it in place of the channel.
+    """
+
+    def __init__(self, channel, t, bbox):
+        self.channel = channel
+        self.t = t
+        self.bbox = bbox
+
+        self.shape = channel.shape
+        self.ndim = channel.ndim
+        self.dtype = channel.dtype
+
+        r0, c0, r1, c1 = bbox
+        if channel.ndim == 3:
+            data = channel[t, r0:r1, c0:c1]
+        else:
+            data = channel[r0:r1, c0:c1]
+
+        if isinstance(data, da.Array):
+            data = data.compute()
+        self.data = np.asarray(data)
+
+    def _local_key(self, key):
+        """
+        Translate an index into the window, None if it is outside.
+        """
+
+        if not isinstance(key, tuple):
+            return None
+
+        if self.ndim == 3:
+            if len(key) != 3 or not isinstance(key[0], (int, np.integer)):
+                return None
+            if key[0] != self.t:
+                return None
+            key = key[1:]
+
+        if len(key) != 2:
+            return None
+
+        local = []
+        for k, start, stop, size in zip(
+            key, self.bbox[:2], self.bbox[2:], self.shape[-2:]
+        ):
+            if not isinstance(k, slice) or k.step not in (None, 1):
+                return None
+
+            k_start, k_stop, _ = k.indices(size)
+            if (k_start < start) or (k_stop > stop) or (k_stop < k_start):
+                return None
+
+            local.append(slice(k_start - start, k_stop - start))
+
+        return tuple(local)
+
+    def __getitem__(self, key):
+        local = self._local_key(key)
+
+        if local is None:
+            return self.channel[key]
+
+        return self.data[local]
 
-    session.commit()
 
-    # deal with the tracks
-    trackDB_after_cellDB(session, cell_db.track_id, current_frame)
+def read_channel_windows(ch_list, t, cells, margin=0):
+    """
+    Function to read the channels once for a group of cells.
+    input:
+        ch_list - list of channel data
+        t - time point
+        cells - list of regionprops format cells
+        margin - pixels added around the cells (e.g. for rings)
+    output:
+        list of ChannelWindow covering the union of bounding boxes
+    """
+
+    bboxes = np.array([cell.bbox for cell in cells])
+    n_rows, n_cols = ch_list[0].shape[-2:]
+
+    bbox = (
+        max(int(bboxes[:, 0].min()) - margin, 0),
+        max(int(bboxes[:, 1].min()) - margin, 0),
+        min(int(bboxes[:, 2].max()) + margin, n_rows),
+        min(int(bboxes[:, 3].max()) + margin, n_cols),
+    )
+
+    return [ChannelWindow(ch, t, bbox) for ch in ch_list]
+
+
+def calculate_signals_batch(
+    cells, t, ch_list, signal_function, max_workers=None
+):
+    """
+    Function to calculate signals for a group of cells of a frame.
+    input:
+        cells - list of regionprops format cells
+        t - time point
+        ch_list - list of channel data
+        signal_function - function calculating signals of a cell
+        max_workers - number of threads, all available if None
+    output:
+        list of dictionaries of signals in the order of cells
+    """
+
+    if len(cells) == 0:
+        return []
+
+    if ch_list:
+        margin = getattr(signal_function, 'margin', 0)
+        ch_list = read_channel_windows(ch_list, t, cells, margin=margin)
+
+    if len(cells) == 1 or max_workers == 1:
+        return [signal_function(cell, t, ch_list) for cell in cells]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(
+            executor.map(lambda cell: signal_function(cell, t, ch_list), cells)
+        )
 
 
 def get_track_note(session, active_label):
@@ -573,7 +1832,7 @@ def save_track_note(session, active_label, note):
     else:
         track.notes = note
         flag_modified(track, 'notes')
-        session.commit()
+        _commit(session)
 
         sts = f'Note for track {active_label} saved in the database.'
 
@@ -606,7 +1865,7 @@ def tag_cell(session, active_cell, frame, annotation):
 
         cell.tags = tags
         flag_modified(cell, 'tags')
-        session.commit()
+        _commit(session)
 
         # set status and update graph
         sts = f'Tag {annotation} was set to {not current_state}.'
@@ -614,19 +1873,19 @@ def tag_cell(session, active_cell, frame, annotation):
     return sts
 
 
-def ring_intensity(cell,t,ch_data_list,kwargs):
+def _ring_mask(cell, image_shape, ring_width):
     """
-    Function to calculate ring intensity.
-    input: 
-        ch_data_list: list of signals (t,row,col)
-
+    Function to find the ring around a cell.
+    Pixels within ring_width of the cell are found with a distance transform,
+    which is the same as dilation with disk(ring_width).
+    input:
+        cell - regionprops format cell
+        image_shape - shape of the signal (t,row,col)
+        ring_width
     output:
-        list of ring intensities for each channel
+        (rows, cols) - slices of the bounding box padded with the ring
+        ring_mask - mask of the ring in the padded bounding box
     """
-    # get the ring width
-    ring_width = kwargs.get('ring_width', 5)
-
-    image_shape = ch_data_list[0].shape
 
     min_row, min_col, max_row, max_col = cell.bbox
 
@@ -635,41 +1894,93 @@ def ring_intensity(cell,t,ch_data_list,kwargs):
     max_row_padded = min(max_row + ring_width, image_shape[1])
     max_col_padded = min(max_col + ring_width, image_shape[2])
 
-    # Dimensions of the padded region
-    padded_rows = max_row_padded - min_row_padded
-    padded_cols = max_col_padded - min_col_padded
-
     # create a mask
-    cell_mask_padded = np.zeros((padded_rows, padded_cols), dtype=bool)
-    # Calculate the position of the original cell mask within the padded mask
-    mask_row_start = min_row - min_row_padded
-    mask_row_end = mask_row_start + (max_row - min_row)
-    mask_col_start = min_col - min_col_padded
-    mask_col_end = mask_col_start + (max_col - min_col)
-
+    cell_mask_padded = np.zeros(
+        (max_row_padded - min_row_padded, max_col_padded - min_col_padded),
+        dtype=bool,
+    )
     # Place the original cell mask into the padded cell mask
-    cell_mask_padded[mask_row_start:mask_row_end, mask_col_start:mask_col_end] = cell.image
+    cell_mask_padded[
+        min_row - min_row_padded : max_row - min_row_padded,
+        min_col - min_col_padded : max_col - min_col_padded,
+    ] = cell.image
+
+    # distance of every pixel to the cell
+    distance = distance_transform_edt(~cell_mask_padded)
+
+    # Create the ring mask by removing the original mask from the pixels close to the cell
+    ring_mask = (distance <= ring_width) & (~cell_mask_padded)
+
+    rows = slice(min_row_padded, max_row_padded)
+    cols = slice(min_col_padded, max_col_padded)
+
+    return (rows, cols), ring_mask
+
+
+def ring_intensity(cell, t, ch_data_list, kwargs):
+    """
+    Function to calculate ring intensity.
+    input:
+        ch_data_list: list of signals (t,row,col)
 
-    # Dilate the cell mask to create the outer boundary (ring)
-    dilated_mask = binary_dilation(cell_mask_padded, footprint=disk(ring_width))
+    output:
+        list of ring intensities for each channel
+    """
+    # get the ring width
+    ring_width = kwargs.get('ring_width', 5)
 
-    # Create the ring mask by subtracting the original mask from the dilated mask
-    ring_mask = dilated_mask & (~cell_mask_padded)
+    (rows, cols), ring_mask = _ring_mask(
+        cell, ch_data_list[0].shape, ring_width
+    )
 
-    signal_list = []
     # Extract the signal region corresponding to the padded bounding box
-    for signal_cube in ch_data_list:
-        signal_roi = signal_cube[t,min_row_padded:max_row_padded, min_col_padded:max_col_padded]
+    # of all channels with a single compute
+    signal_rois = da.compute(
+        *[signal_cube[t, rows, cols] for signal_cube in ch_data_list]
+    )
+
+    # Compute the mean signal within the ring
+    return [
+        np.asarray(signal_roi)[ring_mask].mean() for signal_roi in signal_rois
+    ]
+
+
+def ring_intensity_batch(cells, t, ch_data_list, kwargs):
+    """
+    Function to calculate ring intensity of many cells of a frame.
+    Regions of all cells and channels are read with a single compute
+    (or directly if the channels are in memory).
+    input:
+        cells: list of regionprops format cells
+        ch_data_list: list of signals (t,row,col)
+
+    output:
+        list of ring intensities for each channel for every cell
+    """
+    ring_width = kwargs.get('ring_width', 5)
+    image_shape = ch_data_list[0].shape
 
-        # Extract the signal values within the ring
-        signal_in_ring = signal_roi[ring_mask]
+    rings = [_ring_mask(cell, image_shape, ring_width) for cell in cells]
 
-        # Compute the desired statistic (e.g., mean or sum)
-        ring_signal_mean = signal_in_ring.mean()
+    signal_rois = da.compute(
+        *[
+            signal_cube[t, rows, cols]
+            for (rows, cols), _ in rings
+            for signal_cube in ch_data_list
+        ]
+    )
 
-        if type(ring_signal_mean) == da.core.Array:
-            ring_signal_mean = ring_signal_mean.compute()
+    ch_number = len(ch_data_list)
+    return [
+        [
+            np.asarray(signal_roi)[ring_mask].mean()
+            for signal_roi in signal_rois[
+                ind * ch_number : (ind + 1) * ch_number
+            ]
+        ]
+        for ind, (_, ring_mask) in enumerate(rings)
+    ]
 
-        signal_list.append(ring_signal_mean)
 
-    return signal_list
+# used by the frame measurements for all cells at once
+ring_intensity.batch = ring_intensity_batch
@@ -0,0 +1,134 @@
+import argparse
+import pickle
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+import tracks_interactions.db.db_functions as fdb
+from tracks_interactions.db.mask_codec import encode_mask, is_encoded_mask
+
+
+def migrate_mask_encoding(database_path, batch_size=10000, vacuum=False):
+    """
+    Rewrite pickled cell masks of a database with the binary mask encoding.
+    Masks that are already encoded are left untouched,
+    so an interrupted migration can be run again.
+    input:
+        database_path - path to the sqlite database
+        batch_size - number of cells rewritten per transaction
+        vacuum - reclaim the space freed by the migration
+    output:
+        number of rewritten masks
+    """
+
+    engine = create_engine(f'sqlite:///{database_path}')
+
+    migrated = 0
+    last_rowid = 0
+
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                text(
+                    'SELECT rowid, mask FROM cells WHERE rowid > :last '
+                    'ORDER BY rowid LIMIT :batch'
+                ),
+                {'last': last_rowid, 'batch': batch_size},
+            ).all()
+
+            if len(rows) == 0:
+                break
+
+            last_rowid = rows[-1][0]
+
+            updates = []
+            for rowid, data in rows:
+                if data is None or is_encoded_mask(data):
+                    continue
+
+                mask = pickle.loads(data)
+
+                # placeholders without a shape are left as they are
+                if not hasattr(mask, 'shape') or mask.ndim != 2:
+                    continue
+
+                updates.append({'rowid': rowid, 'mask': encode_mask(mask)})
+
+            if len(updates) > 0:
+                connection.execute(
+                    text('UPDATE cells SET mask = :mask WHERE rowid = :rowid'),
+                    updates,
+                )
+                migrated += len(updates)
+
+    if vacuum:
+        with engine.connect() as connection:
+            connection.execute(text('VACUUM'))
+
+    engine.dispose()
+
+    return migrated
+
+
+def main(argv=None):
+    """
+    Command line entry point for database migrations.
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Migrate a Track Gardener database.'
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    masks_parser = subparsers.add_parser(
+        'masks', help='Rewrite pickled masks with the binary mask encoding.'
+    )
+    masks_parser.add_argument('database', help='Path to the database.')
+    masks_parser.add_argument('--batch-size', type=int, default=10000)
+    masks_parser.add_argument(
+        '--vacuum',
+        action='store_true',
+        help='Reclaim the freed space after the migration.',
+    )
+
+    signals_parser = subparsers.add_parser(
+        'signal-store',
+        help='Create the columnar signal store from signals of cells.',
+    )
+    signals_parser.add_argument('database', help='Path to the database.')
+
+    rtree_parser = subparsers.add_parser(
+        'rtree', help='Create the R*Tree index of cells.'
+    )
+    rtree_parser.add_argument('database', help='Path to the database.')
+
+    closure_parser = subparsers.add_parser(
+        'closure', help='Create the closure table of track lineages.'
+    )
+    closure_parser.add_argument('database', help='Path to the database.')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'masks':
+        migrated = migrate_mask_encoding(
+            args.database, batch_size=args.batch_size, vacuum=args.vacuum
+        )
+        print(f'{migrated} masks have been migrated.')
+
+    elif args.command in ['signal-store', 'rtree', 'closure']:
+        engine = create_engine(f'sqlite:///{args.database}')
+        session = sessionmaker(bind=engine)()
+
+        if args.command == 'signal-store':
+            fdb.create_signal_store(session)
+        elif args.command == 'rtree':
+            fdb.create_cell_rtree(session)
+        else:
+            fdb.create_track_closure(session)
+
+        session.close()
+        print(f'{args.command} has been created.')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,12 +3,17 @@ from sqlalchemy import (
     BigInteger,
     Boolean,
     Column,
+    Float,
     ForeignKey,
+    Index,
     Integer,
-    PickleType,
+    MetaData,
     String,
+    Table,
 )
-from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm import declarative_base, deferred
+
+from tracks_interactions.db.mask_codec import MaskType
 
 # constant value to indicate it has no parent
 NO_PARENT = -1
@@ -34,10 +39,13 @@ class CellDB(Base):
     bbox_2 = Column(Integer, default=NO_SHAPE, primary_key=True)
     bbox_3 = Column(Integer, default=NO_SHAPE, primary_key=True)
 
-    mask = Column(PickleType, default=NO_SHAPE)
+    # bit-packed binary mask (see mask_codec)
+    # deferred - loaded only when accessed or requested with undefer
+    mask = deferred(Column(MaskType, default=NO_SHAPE))
 
     # JSON column to keep signals
-    signals = Column(JSON, default=NO_SIGNAL)
+    # deferred - loaded only when accessed or requested with undefer
+    signals = deferred(Column(JSON, default=NO_SIGNAL))
 
     # JSON column for tags
     tags = Column(JSON, default=NO_SIGNAL)
@@ -69,3 +77,58 @@ class TrackDB(Base):
 
     def __repr__(self):
         return f'Track {self.track_id} from {self.t_begin} to {self.t_end}'
+
+
+# optional tables - indexes and stores derived from the cells table
+# they are kept outside of Base.metadata and created on demand by db_functions
+optional_metadata = MetaData()
+
+# R*Tree index of cells in time and space, keyed on the rowid of the cells table
+# created with db_functions.create_cell_rtree
+CellRTree = Table(
+    'cells_rtree',
+    optional_metadata,
+    Column('id', Integer, primary_key=True),
+    Column('t_min', Integer),
+    Column('t_max', Integer),
+    Column('row_min', Integer),
+    Column('row_max', Integer),
+    Column('col_min', Integer),
+    Column('col_max', Integer),
+)
+
+# columnar copy of CellDB.signals for fast retrieval of time series
+# created with db_functions.create_signal_store
+CellSignal = Table(
+    'cell_signals',
+    optional_metadata,
+    Column('track_id', Integer, primary_key=True),
+    Column('t', Integer, primary_key=True),
+    Column('signal', String, primary_key=True),
+    Column('value', Float),
+    sqlite_with_rowid=False,
+)
+
+# ancestor/descendant pairs of tracks (including each track with itself)
+# created with db_functions.create_track_closure
+TrackClosure = Table(
+    'track_closure',
+    optional_metadata,
+    Column('ancestor', Integer, primary_key=True),
+    Column('descendant', Integer, primary_key=True),
+    Column('depth', Integer),
+    Index('ix_track_closure_descendant', 'descendant'),
+    sqlite_with_rowid=False,
+)
+
+# frames with signals recomputed for a set of measurements
+# (names of the measurements joined with commas), used to resume
+# created with recompute_signals.recompute_signals
+RecomputeLog = Table(
+    'recompute_log',
+    optional_metadata,
+    Column('measurements', String, primary_key=True),
+    Column('t', Integer, primary_key=True),
+    Column('cells', Integer),
+    sqlite_with_rowid=False,
+)
@@ -1,9 +1,13 @@
 import numpy as np
 import pandas as pd
 from numba import njit
+from sqlalchemy import create_engine, insert, select
+from ultrack.core.database import NodeDB
+from ultrack.core.export.utils import solution_dataframe_from_sql
 from ultrack.tracks.graph import _create_tracks_forest, _fast_path_transverse
 
-from tracks_interactions.db.db_model import NO_PARENT
+from tracks_interactions.db.db_model import NO_PARENT, Base, CellDB, TrackDB
+from tracks_interactions.db.mask_codec import encode_mask
 
 
 @njit
@@ -94,3 +98,134 @@ def add_track_ids_to_tracks_df(df: pd.DataFrame) -> pd.DataFrame:
     ), f'Something went wrong. Found unlabeled tracks\n{df[unlabeled_tracks]}'
 
     return df
+
+
+def tracks_df_from_cells_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Summarizes cells with track ids into rows of the tracks table.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Cells with `t`, `track_id`, `parent_track_id` and `root` columns.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per track with columns of `TrackDB`.
+    """
+    tracks_df = df.groupby('track_id').agg(
+        parent_track_id=('parent_track_id', 'first'),
+        root=('root', 'first'),
+        t_begin=('t', 'min'),
+        t_end=('t', 'max'),
+    )
+    tracks_df.reset_index(inplace=True)
+
+    return tracks_df.astype(int)
+
+
+def _cells_from_nodes(chunk, cells_df: pd.DataFrame) -> list[dict]:
+    """Rows of the cells table from selected ultrack nodes.
+
+    Parameters
+    ----------
+    chunk : Sequence[Tuple[int, Node]]
+        Ids and unpickled nodes of the ultrack database.
+    cells_df : pd.DataFrame
+        `t`, `y`, `x` and `track_id` of cells indexed by node ids.
+
+    Returns
+    -------
+    List[dict]
+        Values of `CellDB` columns with encoded masks.
+    """
+    chunk_df = cells_df.loc[[node_id for node_id, _ in chunk]]
+
+    cells = []
+    for (node_id, node), (t, row, col, track_id) in zip(
+        chunk, chunk_df.itertuples(index=False)
+    ):
+        cells.append(
+            {
+                'id': node_id,
+                't': t,
+                'track_id': track_id,
+                'row': row,
+                'col': col,
+                'bbox_0': int(node.bbox[0]),
+                'bbox_1': int(node.bbox[1]),
+                'bbox_2': int(node.bbox[2]),
+                'bbox_3': int(node.bbox[3]),
+                'mask': encode_mask(node.mask),
+            }
+        )
+
+    return cells
+
+
+def ingest_ultrack_solution(
+    ultrack_db_path: str,
+    gardener_db_path: str,
+    chunk_size: int = 50000,
+) -> tuple[int, int]:
+    """Builds a Track Gardener database from an ultrack solution.
+
+    The solution is streamed from the ultrack database in chunks,
+    masks are encoded and cells are written with executemany inserts,
+    one transaction per chunk.
+
+    Parameters
+    ----------
+    ultrack_db_path : str
+        Path to the ultrack sqlite database.
+    gardener_db_path : str
+        Path to the Track Gardener database, created if it doesn't exist.
+    chunk_size : int
+        Number of cells inserted per transaction.
+
+    Returns
+    -------
+    Tuple[int, int]
+        Number of inserted cells and tracks.
+    """
+    df = solution_dataframe_from_sql(f'sqlite:///{ultrack_db_path}')
+    df = add_track_ids_to_tracks_df(df)
+
+    engine = create_engine(f'sqlite:///{gardener_db_path}')
+    Base.metadata.create_all(engine)
+
+    # tracks
+    tracks_df = tracks_df_from_cells_df(df)
+    with engine.begin() as connection:
+        connection.execute(
+            insert(TrackDB.__table__), tracks_df.to_dict('records')
+        )
+
+    # cells
+    cells_df = df[['t', 'y', 'x', 'track_id']].astype(int)
+    cell_num = 0
+
+    org_engine = create_engine(f'sqlite:///{ultrack_db_path}')
+    with org_engine.connect() as org_connection:
+        nodes = org_connection.execution_options(yield_per=chunk_size).execute(
+            select(NodeDB.id, NodeDB.pickle).where(NodeDB.selected)
+        )
+
+        with engine.connect() as connection:
+            # durability is not needed for a database built from scratch
+            # (the pragma begins a transaction, closed before the chunks)
+            connection.exec_driver_sql('PRAGMA synchronous = OFF')
+            connection.commit()
+
+            for chunk in nodes.partitions():
+                cells = _cells_from_nodes(chunk, cells_df)
+
+                with connection.begin():
+                    connection.execute(insert(CellDB.__table__), cells)
+
+                cell_num += len(cells)
+
+    org_engine.dispose()
+    engine.dispose()
+
+    return cell_num, len(tracks_df)
@@ -0,0 +1,373 @@
+import numpy as np
+from skimage.measure import regionprops
+from sqlalchemy import bindparam, select, update
+
+import tracks_interactions.db.db_functions as fdb
+from tracks_interactions.db.db_model import CellDB
+
+# regionprops measurements computed for all cells of a frame at once
+LABEL_REDUCTIONS = ('area', 'num_pixels', 'centroid')
+INTENSITY_REDUCTIONS = (
+    'intensity_mean',
+    'intensity_min',
+    'intensity_max',
+    'intensity_std',
+    'intensity_median',
+)
+
+
+def index_frame(cells, shape):
+    """
+    Function to paint cells of a frame with their position in the list.
+    input:
+        cells - objects with bbox_0 - bbox_3 and mask
+        shape - shape of the frame
+    output:
+        frame - labels 1 to len(cells), 0 for background
+    """
+
+    frame = np.zeros(shape, dtype=np.uint32)
+
+    return fdb.rasterize_cells(
+        frame, cells, values=np.arange(1, len(cells) + 1)
+    )
+
+
+class LabelGroups:
+    """
+    Pixels of all cells of a frame grouped by their label.
+    Made once per frame and shared by reductions of all channels,
+    background pixels are dropped at the start.
+    """
+
+    def __init__(self, frame, n):
+        self.n = n
+        self.shape = frame.shape
+
+        flat = frame.ravel()
+        pixels = np.flatnonzero(flat)
+        labels = flat[pixels]
+
+        order = np.argsort(labels, kind='stable')
+        self.pixels = pixels[order]
+        self.labels = labels[order]
+
+        self.counts = np.bincount(self.labels, minlength=n + 1)[1:]
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+        self.present = self.counts > 0
+
+    def values(self, image):
+        """
+        Pixels of the cells in an image, grouped as the labels.
+        """
+        return image.ravel()[self.pixels]
+
+    def reduce(self, ufunc, values):
+        """
+        Reduce values of every cell, NaN for cells without pixels.
+        """
+        result = np.full(self.n, np.nan)
+        result[self.present] = ufunc.reduceat(
+            values, self.starts[self.present]
+        )
+        return result
+
+
+def label_reductions(groups, names):
+    """
+    Function to calculate measurements of labels for all cells at once.
+    input:
+        groups - LabelGroups of the frame
+        names - requested measurements from LABEL_REDUCTIONS
+    output:
+        dictionary measurement: values for all cells
+    """
+
+    result = {}
+    counts = groups.counts.astype(np.float64)
+
+    for name in names:
+        if name in ('area', 'num_pixels'):
+            result[name] = counts
+
+        elif name == 'centroid':
+            rows, cols = np.divmod(groups.pixels, groups.shape[1])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result[name] = np.stack(
+                    [
+                        groups.reduce(np.add, rows) / counts,
+                        groups.reduce(np.add, cols) / counts,
+                    ],
+                    axis=1,
+                )
+
+    return result
+
+
+def intensity_reductions(groups, image, names):
+    """
+    Function to calculate measurements of intensity for all cells at once.
+    input:
+        groups - LabelGroups of the frame
+        image - 2D signal of the frame
+        names - requested measurements from INTENSITY_REDUCTIONS
+    output:
+        dictionary measurement: values for all cells
+    """
+
+    values = groups.values(image).astype(np.float64)
+    present = groups.present
+    counts = groups.counts[present]
+    result = {}
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = groups.reduce(np.add, values) / groups.counts
+
+    for name in names:
+        if name == 'intensity_mean':
+            result[name] = mean
+
+        elif name == 'intensity_min':
+            result[name] = groups.reduce(np.minimum, values)
+
+        elif name == 'intensity_max':
+            result[name] = groups.reduce(np.maximum, values)
+
+        elif name == 'intensity_std':
+            deviation = values - np.repeat(mean[present], counts)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                variance = groups.reduce(np.add, deviation**2) / groups.counts
+            result[name] = np.sqrt(variance)
+
+        elif name == 'intensity_median':
+            # values sorted within every cell
+            ordered = values[np.lexsort((values, groups.labels))]
+            starts = groups.starts[present]
+            low = ordered[starts + (counts - 1) // 2]
+            high = ordered[starts + counts // 2]
+            result[name] = np.full(groups.n, np.nan)
+            result[name][present] = (low + high) / 2
+
+    return result
+
+
+def _plain(value):
+    """
+    Convert a measurement to a value that can be stored as JSON.
+    """
+    if isinstance(value, (tuple, list, np.ndarray)):
+        return [_plain(x) for x in value]
+    if isinstance(value, (np.integer, np.floating, np.bool_)):
+        return value.item()
+    return value
+
+
+def measure_frame(session, current_frame, ch_data_list, plan):
+    """
+    Function to calculate signals of all cells of a frame.
+    Cells are rasterized from the database and every channel frame
+    is read once. Measurements in LABEL_REDUCTIONS and
+    INTENSITY_REDUCTIONS are calculated for all cells at once,
+    other measurements of the plan per cell from the frame in memory
+    (labels of the regionprops cells passed to them are not track ids),
+    or for all cells at once if their function has a batch variant.
+    Cells are painted in the order of track ids and overlapping pixels
+    belong to the cell painted last, so a partially covered cell
+    is measured only on its visible part (unlike a single cell measured
+    with its own mask, e.g. when it is saved in the viewer).
+    input:
+        session
+        current_frame - time point
+        ch_data_list - list of channel data (t,row,col) or (row,col)
+        plan - MeasurementPlan
+    output:
+        dictionary track_id: dictionary of signals,
+        cells fully covered by other cells are skipped
+    """
+
+    cells = fdb.get_frame_masks(session, current_frame)
+
+    if len(cells) == 0 or plan is None:
+        return {}
+
+    n = len(cells)
+    shape = ch_data_list[0].shape[-2:]
+    frame = index_frame(cells, shape)
+
+    # every channel frame read once
+    windows = [
+        fdb.ChannelWindow(ch, current_frame, (0, 0) + tuple(shape))
+        for ch in ch_data_list
+    ]
+
+    # signal name -> values for cells 1 to n
+    columns = {}
+
+    # regionprops cells only if needed
+    regions = []
+
+    def get_regions():
+        if len(regions) == 0:
+            regions.extend([None] * n)
+            for region in regionprops(frame):
+                regions[region.label - 1] = region
+        return regions
+
+    def per_cell(function):
+        return [
+            None if region is None else function(region)
+            for region in get_regions()
+        ]
+
+    def all_cells(function):
+        present = [x for x in get_regions() if x is not None]
+        values = iter(function(present))
+        return [
+            None if region is None else next(values)
+            for region in get_regions()
+        ]
+
+    def intensity_region(region):
+        # as in the plan - in the coordinates of the bounding box
+        signal_cube = np.stack(
+            [x.data[region.slice] for x in windows], axis=-1
+        )
+        return regionprops(
+            region.image.astype(int), intensity_image=signal_cube
+        )[0]
+
+    groups = LabelGroups(frame, n)
+
+    # measurements of labels
+    vectorized = [x for x in plan.reg_no_signal if x in LABEL_REDUCTIONS]
+    columns.update(label_reductions(groups, vectorized))
+
+    for m in plan.reg_no_signal:
+        if m not in LABEL_REDUCTIONS:
+            columns[m] = per_cell(lambda region, m=m: region[m])
+
+    # measurements of intensity
+    requested = {m['function'] for m in plan.reg_signal}
+    vectorized = [x for x in requested if x in INTENSITY_REDUCTIONS]
+    for ind, ch in enumerate(plan.ch_list):
+        result = intensity_reductions(groups, windows[ind].data, vectorized)
+        for m in plan.reg_signal:
+            if ch in m['channels'] and m['function'] in result:
+                columns[ch + '_' + m['name']] = result[m['function']]
+
+    for m in plan.reg_signal:
+        if m['function'] not in INTENSITY_REDUCTIONS:
+            values = per_cell(
+                lambda region, m=m: intensity_region(region)[m['function']]
+            )
+            for ch in m['channels']:
+                columns[ch + '_' + m['name']] = [
+                    None if x is None else x[plan.ch_list.index(ch)]
+                    for x in values
+                ]
+
+    # measurements of the track gardener and the custom functions
+    for m, f in plan.functions:
+        batch = getattr(f, 'batch', None)
+        if batch is None:
+            values = per_cell(
+                lambda region, f=f, m=m: f(
+                    region, current_frame, windows, kwargs=m
+                )
+            )
+        else:
+            values = all_cells(
+                lambda cells, batch=batch, m=m: batch(
+                    cells, current_frame, windows, kwargs=m
+                )
+            )
+        for ch in m['channels']:
+            columns[ch + '_' + m['name']] = [
+                None if x is None else x[plan.ch_list.index(ch)]
+                for x in values
+            ]
+
+    return {
+        cell.track_id: {
+            name: _plain(values[ind]) for name, values in columns.items()
+        }
+        for ind, cell in enumerate(cells)
+        if groups.present[ind]
+    }
+
+
+def write_frame_signals(session, current_frame, signals_by_track, merge=False):
+    """
+    Function to write signals of many cells of a frame at once.
+    input:
+        session
+        current_frame
+        signals_by_track - dictionary track_id: dictionary of signals
+        merge - if True, new signals are merged with the signals
+                the cells already have, otherwise they replace them
+    """
+
+    if len(signals_by_track) == 0:
+        return
+
+    old_signals = session.execute(
+        select(CellDB.track_id, CellDB.signals)
+        .where(CellDB.t == current_frame)
+        .where(CellDB.track_id.in_(list(signals_by_track)))
+    ).all()
+
+    if merge:
+        merged = {
+            track_id: {**(signals or {}), **signals_by_track[track_id]}
+            for track_id, signals in old_signals
+        }
+    else:
+        merged = {
+            track_id: signals_by_track[track_id] for track_id, _ in old_signals
+        }
+
+    if len(merged) == 0:
+        return
+
+    table = CellDB.__table__
+    session.execute(
+        update(table)
+        .where(table.c.track_id == bindparam('b_track_id'))
+        .where(table.c.t == current_frame)
+        .values(signals=bindparam('b_signals')),
+        [
+            {'b_track_id': track_id, 'b_signals': signals}
+            for track_id, signals in merged.items()
+        ],
+    )
+
+    if fdb.has_signal_store(session):
+        fdb.write_cells_signals(session, current_frame, merged)
+
+
+def recompute_frame_signals(
+    session, current_frame, ch_data_list, plan, merge=False
+):
+    """
+    Function to recalculate signals of all cells of a frame
+    and store them in the database.
+    input:
+        session
+        current_frame - time point
+        ch_data_list - list of channel data
+        plan - MeasurementPlan
+        merge - keep signals of the cells not calculated by the plan
+    output:
+        number of updated cells
+    """
+
+    signals_by_track = measure_frame(
+        session, current_frame, ch_data_list, plan
+    )
+
+    with fdb.transaction(session):
+        write_frame_signals(
+            session, current_frame, signals_by_track, merge=merge
+        )
+
+    return len(signals_by_track)
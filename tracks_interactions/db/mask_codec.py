@@ -0,0 +1,89 @@
+import pickle
+import struct
+
+import numpy as np
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+# encoded masks start with a header: magic, version, number of rows and columns
+MASK_MAGIC = b'TGMK'
+MASK_VERSION = 1
+MASK_HEADER = struct.Struct('<4sBII')
+
+
+def is_encoded_mask(data):
+    """
+    Check whether a stored value uses the binary mask encoding.
+    """
+    return bytes(data[: len(MASK_MAGIC)]) == MASK_MAGIC
+
+
+def encode_mask(mask):
+    """
+    Encode a 2D boolean mask as bytes.
+    input:
+        mask - 2D array, non-zero values are treated as True
+    output:
+        bytes - header followed by the bit-packed mask
+    """
+    mask = np.asarray(mask, dtype=bool)
+
+    if mask.ndim != 2:
+        raise ValueError(f'Expected a 2D mask, got {mask.ndim} dimensions.')
+
+    header = MASK_HEADER.pack(
+        MASK_MAGIC, MASK_VERSION, mask.shape[0], mask.shape[1]
+    )
+
+    return header + np.packbits(mask, axis=None).tobytes()
+
+
+def decode_mask(data):
+    """
+    Decode a stored mask.
+    Values written before the binary encoding was introduced are unpickled.
+    input:
+        data - bytes from the database
+    output:
+        mask - 2D boolean array
+    """
+    if not is_encoded_mask(data):
+        return pickle.loads(data)
+
+    _, version, rows, cols = MASK_HEADER.unpack_from(data)
+
+    if version != MASK_VERSION:
+        raise ValueError(f'Unsupported mask encoding version {version}.')
+
+    packed = np.frombuffer(data, dtype=np.uint8, offset=MASK_HEADER.size)
+    mask = np.unpackbits(packed, count=rows * cols).view(bool)
+
+    return mask.reshape(rows, cols)
+
+
+class MaskType(TypeDecorator):
+    """
+    Column type storing numpy masks with the binary mask encoding.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+
+        if isinstance(value, np.ndarray):
+            return encode_mask(value)
+
+        # already encoded, e.g. prepared for bulk inserts
+        if isinstance(value, bytes) and is_encoded_mask(value):
+            return value
+
+        # placeholders without a shape (NO_SHAPE) are kept as before
+        return pickle.dumps(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+
+        return decode_mask(value)
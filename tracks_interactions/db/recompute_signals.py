@@ -0,0 +1,411 @@
+"""
+Recalculate signals of all cells of an experiment,
+e.g. after cell_measurements in the config file were changed.
+
+    python -m tracks_interactions.db.recompute_signals config.yaml
+
+Frames are grouped by time chunks of the signal channels and measured
+in a pool of processes, results are written by the main process.
+Frames already recalculated for the same measurements are skipped,
+so an interrupted run continues where it stopped.
+Recalculated signals replace the signals of the cells.
+With --missing only signals not yet present in the database
+are calculated and added to the signals of the cells.
+Cells fully covered by other cells cannot be measured
+and keep their signals, their number is reported for every frame.
+"""
+
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import dask.array as da
+import numpy as np
+import yaml
+import zarr
+from sqlalchemy import create_engine, delete, insert, select
+from sqlalchemy.orm import sessionmaker
+
+import tracks_interactions.db.db_functions as fdb
+import tracks_interactions.db.frame_measurements as fm
+from tracks_interactions.db.config_functions import (
+    MeasurementPlan,
+    check_unique_names,
+    measurement_names,
+)
+from tracks_interactions.db.db_model import (
+    CellDB,
+    RecomputeLog,
+    optional_metadata,
+)
+
+# state of a worker process, set by _init_worker
+_worker = {}
+
+
+def load_channel(channel_path):
+    """
+    Function to load the full resolution of a channel from zarr.
+    """
+
+    try:
+        return da.from_zarr(channel_path)
+
+    except zarr.errors.ContainsGroupError:
+        root_group = zarr.open_group(channel_path, mode='r')
+        levels_list = sorted(int(x) for x in root_group if x.isdigit())
+        return da.from_zarr(channel_path, str(levels_list[0]))
+
+
+def load_channels(config):
+    """
+    Function to load all signal channels listed in the config.
+    """
+    return [load_channel(ch['path']) for ch in config['signal_channels']]
+
+
+def measurements_key(config):
+    """
+    Function to name the set of measurements of a config in the log.
+    input:
+        config - dictionary with cell_measurements
+    output:
+        names of the measurements (as in check_unique_names) joined by commas
+    """
+
+    status, names = check_unique_names(config)
+    if status is False:
+        raise ValueError(names)
+
+    return ','.join(sorted(names))
+
+
+def frame_partitions(frames, channel):
+    """
+    Function to group frames by time chunks of a channel,
+    so that every chunk is read by a single process.
+    input:
+        frames - time points to calculate
+        channel - dask array (t,row,col)
+    output:
+        list of lists of frames
+    """
+
+    # first frame after every chunk
+    chunk_ends = np.cumsum(channel.chunks[0])
+
+    partitions = {}
+    for t in sorted(frames):
+        chunk = int(np.searchsorted(chunk_ends, t, side='right'))
+        partitions.setdefault(chunk, []).append(t)
+
+    return list(partitions.values())
+
+
+def get_done_frames(session, key):
+    """
+    Function to get frames already recalculated for the measurements.
+    """
+
+    query = session.execute(
+        select(RecomputeLog.c.t).where(RecomputeLog.c.measurements == key)
+    )
+
+    return {t for (t,) in query}
+
+
+def write_partition(session, key, results, merge=False):
+    """
+    Function to write signals of a partition of frames with a single commit.
+    Frames are logged in the same transaction, so that
+    the log agrees with the database after an interruption.
+    input:
+        session
+        key - name of the measurements in the log
+        results - dictionary t: dictionary track_id: dictionary of signals
+        merge - merge new signals with the existing ones instead
+                of replacing them
+    """
+
+    with fdb.transaction(session):
+        for t, signals_by_track in results.items():
+            fm.write_frame_signals(session, t, signals_by_track, merge=merge)
+
+        session.execute(
+            insert(RecomputeLog).prefix_with('OR REPLACE'),
+            [
+                {'measurements': key, 't': t, 'cells': len(signals)}
+                for t, signals in results.items()
+            ],
+        )
+
+
+def _init_worker(config):
+    """
+    Open the database and the channels in a worker process.
+    """
+
+    engine = create_engine(f"sqlite:///{config['database']['path']}")
+    _worker['session'] = sessionmaker(bind=engine)()
+    _worker['channels'] = load_channels(config)
+    _worker['plan'] = MeasurementPlan(config)
+
+
+def _measure_frames(frames):
+    """
+    Calculate signals of a partition of frames in a worker process.
+    Returns the signals and the number of cells not measured in every frame.
+    """
+
+    session = _worker['session']
+
+    results = {}
+    skipped = {}
+    for t in frames:
+        results[t] = fm.measure_frame(
+            session, t, _worker['channels'], _worker['plan']
+        )
+        cells_number = session.query(CellDB).filter(CellDB.t == t).count()
+        skipped[t] = cells_number - len(results[t])
+
+    # nothing is written by workers
+    session.rollback()
+
+    return results, skipped
+
+
+def report_skipped(skipped, progress):
+    """
+    Function to report cells that were not measured.
+    input:
+        skipped - dictionary t: number of cells not measured
+        progress - function called with progress messages
+    """
+
+    for t, number in sorted(skipped.items()):
+        if number > 0:
+            progress(
+                f'frame {t}: {number} cells covered by other cells '
+                'not measured, their signals are not updated'
+            )
+
+
+def recompute_signals(
+    config,
+    frames=None,
+    workers=None,
+    restart=False,
+    merge=False,
+    progress=print,
+):
+    """
+    Function to recalculate signals of cells for the whole experiment.
+    input:
+        config - dictionary read from the config file
+        frames - time points to calculate, all frames with cells if None
+        workers - number of processes, all CPUs if None,
+                  1 to calculate in the calling process
+        restart - calculate frames logged as done again
+        merge - merge new signals with the existing ones,
+                by default signals of the cells are replaced
+        progress - function called with progress messages
+    output:
+        number of calculated frames
+    """
+
+    key = measurements_key(config)
+
+    engine = create_engine(f"sqlite:///{config['database']['path']}")
+    session = sessionmaker(bind=engine)()
+
+    try:
+        optional_metadata.create_all(
+            session.connection(), tables=[RecomputeLog], checkfirst=True
+        )
+        if restart:
+            session.execute(
+                delete(RecomputeLog).where(RecomputeLog.c.measurements == key)
+            )
+        session.commit()
+
+        if frames is None:
+            frames = [t for (t,) in session.query(CellDB.t).distinct()]
+
+        done = get_done_frames(session, key)
+        todo = [t for t in frames if t not in done]
+        progress(f'{len(todo)} frames to calculate, {len(done)} done before')
+
+        if len(todo) == 0:
+            return 0
+
+        channels = load_channels(config)
+        partitions = frame_partitions(todo, channels[0])
+
+        if workers == 1:
+            _init_worker(config)
+            for partition in partitions:
+                results, skipped = _measure_frames(partition)
+                write_partition(session, key, results, merge=merge)
+                report_skipped(skipped, progress)
+                progress(f'frames {partition[0]}-{partition[-1]} done')
+            _worker.pop('session').close()
+            _worker.clear()
+
+        else:
+            # spawned processes do not inherit state of the caller
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(config,),
+            ) as executor:
+                futures = [
+                    executor.submit(_measure_frames, partition)
+                    for partition in partitions
+                ]
+                for future in as_completed(futures):
+                    results, skipped = future.result()
+                    write_partition(session, key, results, merge=merge)
+                    report_skipped(skipped, progress)
+                    progress(f'frames {min(results)}-{max(results)} done')
+
+        return len(todo)
+
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def missing_measurements(session, config):
+    """
+    Function to compare measurements of the config with signals of cells.
+    Signals are compared by name only - a measurement changed
+    without changing its name is not recognized.
+    input:
+        session
+        config - dictionary with cell_measurements
+    output:
+        config - copy of the config with only measurements (and channels)
+                 of signals missing in any cell
+        missing - names of the missing signals
+    """
+
+    cells_number = session.query(CellDB).count()
+    counts = fdb.get_signal_counts(session)
+
+    missing = []
+    measurements = []
+    for m in config['cell_measurements']:
+        names = [
+            x for x in measurement_names(m) if counts.get(x, 0) < cells_number
+        ]
+        if len(names) == 0:
+            continue
+
+        missing.extend(names)
+
+        m = dict(m)
+        if 'channels' in m:
+            m['channels'] = [
+                ch
+                for ch, name in zip(m['channels'], measurement_names(m))
+                if name in names
+            ]
+        measurements.append(m)
+
+    return dict(config, cell_measurements=measurements), missing
+
+
+def recompute_missing_signals(
+    config, frames=None, workers=None, restart=False, progress=print
+):
+    """
+    Function to calculate only signals that cells do not have yet,
+    e.g. after a measurement was added to the config file.
+    Only frames with cells missing the signals are calculated,
+    the new signals are merged with the existing ones.
+    input:
+        config - dictionary read from the config file
+        frames - time points to consider, all frames if None
+        workers - number of processes, as in recompute_signals
+        restart - as in recompute_signals
+        progress - function called with progress messages
+    output:
+        number of calculated frames
+    """
+
+    engine = create_engine(f"sqlite:///{config['database']['path']}")
+    session = sessionmaker(bind=engine)()
+
+    try:
+        missing_config, missing = missing_measurements(session, config)
+        missing_frames = fdb.get_frames_missing_signals(session, missing)
+    finally:
+        session.close()
+        engine.dispose()
+
+    if len(missing) == 0:
+        progress('All signals are present in the database')
+        return 0
+
+    progress(f"Missing signals: {', '.join(missing)}")
+
+    if frames is not None:
+        missing_frames = sorted(set(missing_frames) & set(frames))
+
+    return recompute_signals(
+        missing_config,
+        frames=missing_frames,
+        workers=workers,
+        restart=restart,
+        merge=True,
+        progress=progress,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Recalculate signals of cells for the whole experiment.'
+    )
+    parser.add_argument('config', help='path to the config file')
+    parser.add_argument(
+        '--workers', type=int, default=None, help='number of processes'
+    )
+    parser.add_argument(
+        '--frames',
+        type=int,
+        nargs=2,
+        metavar=('START', 'END'),
+        help='calculate only frames START to END (inclusive)',
+    )
+    parser.add_argument(
+        '--restart',
+        action='store_true',
+        help='calculate again frames done by previous runs',
+    )
+    parser.add_argument(
+        '--missing',
+        action='store_true',
+        help='calculate only signals missing in the database',
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.config) as config_file:
+        config = yaml.safe_load(config_file)
+
+    frames = None
+    if args.frames is not None:
+        frames = list(range(args.frames[0], args.frames[1] + 1))
+
+    if args.missing:
+        recompute_missing_signals(
+            config, frames=frames, workers=args.workers, restart=args.restart
+        )
+    else:
+        recompute_signals(
+            config, frames=frames, workers=args.workers, restart=args.restart
+        )
+
+
+if __name__ == '__main__':
+    main()
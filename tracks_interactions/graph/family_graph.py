@@ -10,6 +10,10 @@ from pyqtgraph import (
 from qtpy.QtCore import Qt
 
 from tracks_interactions.db.db_model import TrackDB
+from tracks_interactions.widget.db_worker import (
+    get_worker,
+    report_to_status,
+)
 
 
 class FamilyGraphWidget(GraphicsLayoutWidget):
@@ -22,6 +26,10 @@ class FamilyGraphWidget(GraphicsLayoutWidget):
         self.viewer = viewer
         self.labels = self.viewer.layers['Labels']
 
+        # queries are run in the background
+        self.db_worker = get_worker(session)
+        self.tree = None
+
         # initialize graph
         self.plot_view = self.addPlot(
             title='Lineage tree', labels={'bottom': 'Time'}
@@ -73,7 +81,7 @@ class FamilyGraphWidget(GraphicsLayoutWidget):
                     # Extract node attributes (e.g., start, stop, and y values)
                     start = node_data.get('start')
                     stop = node_data.get('stop')
-                    y_val_node = node_data.get('y') 
+                    y_val_node = node_data.get('y')
 
                     # Check if the x_val falls within the start-stop range of the node
                     if (start <= x_val) and (stop >= x_val):
@@ -134,37 +142,40 @@ class FamilyGraphWidget(GraphicsLayoutWidget):
         Update of the lineage display when a new label is selected.
         """
 
-        # Clear all elements except the time line
-        items_to_remove = self.plot_view.items[
-            1:
-        ]  # Get all items except the time line
-        for item in items_to_remove:
-            self.plot_view.removeItem(item)
-
         # get an active label
         if self.viewer.layers['Labels'].selected_label > 0:
             self.active_label = int(self.labels.selected_label)
         else:
             self.active_label = int(self.labels.metadata['persistent_label'])
 
-        # check if the label is in the database
-        query = (
-            self.session.query(TrackDB)
-            .filter(TrackDB.track_id == self.active_label)
-            .first()
+        # build the tree in the background
+        self.db_worker.submit(
+            build_family_tree,
+            self.active_label,
+            callback=self.show_lineage,
+            error_callback=report_to_status(self.viewer),
+            key=(id(self), 'lineage'),
         )
 
+    def show_lineage(self, family):
+        """
+        Display the tree of a family built by build_family_tree.
+        """
+
+        # Clear all elements except the time line
+        items_to_remove = self.plot_view.items[
+            1:
+        ]  # Get all items except the time line
+        for item in items_to_remove:
+            self.plot_view.removeItem(item)
+
         # actions based on finding the label in the database
-        if query is not None:
-            # get the root value
-            root = query.root
+        if family is not None:
+            root, self.tree = family
 
             # update viewer status
             self.viewer.status = f'Family of track number {root}.'
 
-            # buid the tree
-            self.tree = build_Newick_tree(self.session, root)
-
             # update the widget with the tree
             self.render_tree_view(self.tree)
 
@@ -173,9 +184,9 @@ class FamilyGraphWidget(GraphicsLayoutWidget):
 
     def render_tree_view(self, G):
         """
-        Render the hierarchical tree using NetworkX and PyQtGraph, 
+        Render the hierarchical tree using NetworkX and PyQtGraph,
         assuming node positions are stored in the 'pos' attribute of each node.
-        
+
         G: NetworkX graph with node positions stored in 'pos' attributes.
         """
         y_max = -0.1
@@ -217,7 +228,9 @@ class FamilyGraphWidget(GraphicsLayoutWidget):
 
             # Add text label for the node
             if node_data['accepted']:
-                text_item = TextItem(str(node_name), anchor=(1, 1), color='green')
+                text_item = TextItem(
+                    str(node_name), anchor=(1, 1), color='green'
+                )
             else:
                 text_item = TextItem(str(node_name), anchor=(1, 1))
 
@@ -235,19 +248,22 @@ class FamilyGraphWidget(GraphicsLayoutWidget):
 
         # Set plot axis limits
         self.plot_view.setXRange(0, self.t_max)
-        self.plot_view.setYRange(y_min -0.1*abs(y_min), y_max + 0.1*abs(y_max))
+        self.plot_view.setYRange(
+            y_min - 0.1 * abs(y_min), y_max + 0.1 * abs(y_max)
+        )
+
 
 def reingold_tilford(tree, node=None, depth=0, x_offset=0, x_spacing=1):
     """
     Recursive function to apply Reingold-Tilford algorithm for binary trees.
-    
+
     Args:
         tree: NetworkX DiGraph representing the tree.
         node: Current node being processed (if None, starts at the root).
         depth: Current depth level in the tree.
         x_offset: Horizontal position offset for the current node.
         x_spacing: Spacing between nodes.
-    
+
     Returns:
         pos: Dictionary of node positions with x, y coordinates.
     """
@@ -257,31 +273,46 @@ def reingold_tilford(tree, node=None, depth=0, x_offset=0, x_spacing=1):
 
     if tree.out_degree(node) == 0:  # If leaf node
         return {node: (x_offset, -depth)}
-    
+
     children = list(tree.successors(node))
-    
+
     # Get positions of left and right subtrees
-    pos_left = reingold_tilford(tree, children[0], depth+1, x_offset, x_spacing) if len(children) > 0 else {}
-    pos_right = reingold_tilford(tree, children[1], depth+1, x_offset + len(pos_left) * x_spacing, x_spacing) if len(children) > 1 else {}
-    
+    pos_left = (
+        reingold_tilford(tree, children[0], depth + 1, x_offset, x_spacing)
+        if len(children) > 0
+        else {}
+    )
+    pos_right = (
+        reingold_tilford(
+            tree,
+            children[1],
+            depth + 1,
+            x_offset + len(pos_left) * x_spacing,
+            x_spacing,
+        )
+        if len(children) > 1
+        else {}
+    )
+
     # Calculate the center x position of the current node
     num_left = len(pos_left)
     num_right = len(pos_right)
-    
+
     # Center node between left and right children
     x_center = x_offset + (num_left + num_right - 1) / 2.0 * x_spacing
     pos = {node: (x_center, -depth)}
-    
+
     # Merge positions of subtrees
     pos.update(pos_left)
     pos.update(pos_right)
-    
+
     return pos
 
+
 def _add_children(G, parent, df, n=2):
     """
     Recursively adds children to the NetworkX graph from a dataframe.
-    
+
     G - NetworkX graph
     parent - parent node ID
     df - dataframe with information about children
@@ -291,7 +322,14 @@ def _add_children(G, parent, df, n=2):
 
     for _, row in children.iterrows():
         child_id = row['track_id']
-        G.add_node(child_id, name=row['track_id'], start=row['t_begin'], stop=row['t_end'], accepted=row['accepted_tag'], num=n)
+        G.add_node(
+            child_id,
+            name=row['track_id'],
+            start=row['t_begin'],
+            stop=row['t_end'],
+            accepted=row['accepted_tag'],
+            num=n,
+        )
         G.add_edge(parent, child_id)
 
         n += 1
@@ -299,10 +337,31 @@ def _add_children(G, parent, df, n=2):
 
     return n
 
+
+def build_family_tree(session, track_id):
+    """
+    Build the tree of the family of a track.
+
+    session - database session
+    track_id - any track of the family
+    returns (root, tree) or None if the track is not in the database
+    """
+    root = (
+        session.query(TrackDB.root)
+        .filter(TrackDB.track_id == track_id)
+        .scalar()
+    )
+
+    if root is None:
+        return None
+
+    return root, build_Newick_tree(session, root)
+
+
 def build_Newick_tree(session, root_id):
     """
     Build a NetworkX graph to represent the hierarchical tree structure.
-    
+
     session - database session
     root_id - ID of the root node
     """
@@ -318,7 +377,14 @@ def build_Newick_tree(session, root_id):
 
     # Add the root (trunk) node
     trunk_row = df[df['track_id'] == root_id]
-    G.add_node(root_id, name=root_id, start=trunk_row['t_begin'].values[0], stop=trunk_row['t_end'].values[0], accepted=bool(trunk_row['accepted_tag'].values[0]), num=1)
+    G.add_node(
+        root_id,
+        name=root_id,
+        start=trunk_row['t_begin'].values[0],
+        stop=trunk_row['t_end'].values[0],
+        accepted=bool(trunk_row['accepted_tag'].values[0]),
+        num=1,
+    )
 
     # Recursively add children
     _add_children(G, root_id, df)
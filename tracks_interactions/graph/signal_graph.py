@@ -1,8 +1,12 @@
-import numpy as np
 from pyqtgraph import GraphicsLayoutWidget, LegendItem, TextItem, mkPen
 from qtpy.QtCore import Qt
 
+import tracks_interactions.db.db_functions as fdb
 from tracks_interactions.db.db_model import CellDB
+from tracks_interactions.widget.db_worker import (
+    get_worker,
+    report_to_status,
+)
 
 
 class SignalGraph(GraphicsLayoutWidget):
@@ -22,6 +26,8 @@ class SignalGraph(GraphicsLayoutWidget):
         self.session = session
         self.viewer = viewer
         self.labels = self.viewer.layers['Labels']
+        # queries are run in the background
+        self.db_worker = get_worker(session)
         self.legend_on = legend_on
         self.signal_list = selected_signals
         self.color_list = color_list
@@ -85,9 +91,12 @@ class SignalGraph(GraphicsLayoutWidget):
         line_position = self.viewer.dims.current_step[0]
         self.time_line.setValue(line_position)
 
-    def get_db_info(self):
+    def get_db_info(self, *redraw):
         """
-        Get information about the cell from the database.
+        Get information about the cell from the database in the background
+        and redraw the graph when it is available.
+        input:
+            redraw - functions to call with the new information
         """
         # get a label or a persistent label
         if self.viewer.layers['Labels'].selected_label > 0:
@@ -95,14 +104,24 @@ class SignalGraph(GraphicsLayoutWidget):
         else:
             self.active_label = int(self.labels.metadata['persistent_label'])
 
-        # get the info
-        self.query = (
-            self.session.query(CellDB.t, CellDB.signals, CellDB.tags)
-            .filter(CellDB.track_id == self.active_label)
-            .order_by(CellDB.t)
-            .all()
+        self.db_worker.submit(
+            get_track_info,
+            self.active_label,
+            [sig for sig in self.signal_list or [] if sig],
+            callback=lambda info: self.set_db_info(info, redraw),
+            error_callback=report_to_status(self.viewer),
+            key=(id(self), 'info'),
         )
 
+    def set_db_info(self, info, redraw=()):
+        """
+        Store information from get_track_info and redraw the graph.
+        """
+        self.query, self.signal_t, self.signal_values = info
+
+        for function in redraw:
+            function()
+
     def redraw_tags(self):
         """
         Function that updates taggs on the graph.
@@ -133,8 +152,8 @@ class SignalGraph(GraphicsLayoutWidget):
                         item[0]
                         for item in self.query
                         if (
-                            item[2].get(tag) == 'True'
-                            or item[2].get(tag) is True
+                            item[1].get(tag) == 'True'
+                            or item[1].get(tag) is True
                         )
                     ]
                     if x_list:
@@ -160,19 +179,15 @@ class SignalGraph(GraphicsLayoutWidget):
             self.plot_view.removeItem(item)
 
         if len(self.query) > 0:
-            x_signal = [x[0] for x in self.query]
-            full_x_range = list(range(min(x_signal), max(x_signal) + 1))
+            full_x_range = self.signal_t
 
             y_signals = {
-                sig: [np.nan] * len(full_x_range) for sig in self.signal_list
+                sig: self.signal_values[:, ind]
+                for ind, sig in enumerate(
+                    [sig for sig in self.signal_list or [] if sig]
+                )
             }
 
-            for t, signals, _ in self.query:
-                index = full_x_range.index(t)
-                for sig in self.signal_list:
-                    if sig in signals:
-                        y_signals[sig][index] = signals[sig]
-
             # reset view
             self.plot_view.enableAutoRange(
                 self.plot_view.getViewBox().XYAxes, True
@@ -185,7 +200,7 @@ class SignalGraph(GraphicsLayoutWidget):
                 legend.setParentItem(self.plot_view.graphicsItem())
 
             for sig, col in zip(self.signal_list, self.color_list):
-                if sig is not None:
+                if sig:
                     y_signal_with_gaps = y_signals[sig]
                     pl = self.plot_view.plot(
                         full_x_range,
@@ -202,21 +217,43 @@ class SignalGraph(GraphicsLayoutWidget):
         """
         Update of the tags on the graph.
         """
-        self.get_db_info()
-        self.redraw_tags()
+        self.get_db_info(self.redraw_tags)
 
     def update_signals(self):
         """
         Update of the signals on the graph.
         """
-        self.get_db_info()
-        self.redraw_signals()
+        self.get_db_info(self.redraw_signals)
 
     def update_graph_all(self):
         """
         Update of the signal display when a new label is selected.
         """
         if self.labels.selected_label != 0:
-            self.get_db_info()
-            self.redraw_signals()
-            self.redraw_tags()
+            self.get_db_info(self.redraw_signals, self.redraw_tags)
+
+
+def get_track_info(session, track_id, signals):
+    """
+    Get tags and signals of a track.
+    input:
+        session
+        track_id
+        signals - names of signals
+    output:
+        tags - list of (t, tags) sorted by t
+        signal_t - time points of the signals
+        signal_values - array (t x signal)
+    """
+
+    tags = (
+        session.query(CellDB.t, CellDB.tags)
+        .filter(CellDB.track_id == track_id)
+        .order_by(CellDB.t)
+        .all()
+    )
+
+    # get the signals as a (t x signal) array
+    signal_t, signal_values = fdb.get_track_signals(session, track_id, signals)
+
+    return [tuple(x) for x in tags], signal_t, signal_values
@@ -0,0 +1,212 @@
+import logging
+import queue
+import threading
+from typing import Any, Callable, NamedTuple, Optional
+
+from qtpy.QtCore import QObject, Signal
+from sqlalchemy.orm import sessionmaker
+
+from tracks_interactions.widget.tile_renderer import can_prefetch
+
+logger = logging.getLogger(__name__)
+
+
+class Request(NamedTuple):
+    """
+    A function to run with the session of the worker.
+    """
+
+    number: int
+    key: Any
+    function: Callable
+    args: tuple
+    kwargs: dict
+    callback: Optional[Callable]
+    error_callback: Optional[Callable]
+
+
+class DatabaseWorker(QObject):
+    """
+    Runs read queries in a thread with its own database session
+    and passes the results to callbacks in the Qt main thread,
+    so that the viewer is not blocked by slow queries.
+    A newer request with the same key makes older ones obsolete,
+    their results are dropped (e.g. quickly changing selection).
+    In-memory databases are not shared between threads,
+    their requests are run immediately in the calling thread.
+    """
+
+    # request, result, error
+    finished = Signal(object, object, object)
+
+    def __init__(self, session):
+        super().__init__()
+
+        self.session = session
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+
+        # key -> number of the latest request
+        self.latest = {}
+        self.count = 0
+        self.closed = False
+
+        # delivered in the thread of the worker object (main thread)
+        self.finished.connect(self._deliver)
+
+        self.thread = None
+        if can_prefetch(session):
+            self.thread = threading.Thread(
+                target=self._run, name='database_worker', daemon=True
+            )
+            self.thread.start()
+
+    def submit(
+        self,
+        function,
+        *args,
+        callback=None,
+        error_callback=None,
+        key=None,
+        **kwargs,
+    ):
+        """
+        Run a read query and pass its result to a callback.
+        Failed requests are logged, in the thread or immediately alike.
+        input:
+            function - called as function(session, *args, **kwargs),
+                       should return plain values rather than ORM objects
+            callback - called with the result in the main thread
+            error_callback - called with the exception of a failed request
+                             in the main thread
+            key - requests with the same key replace each other
+        """
+
+        with self.lock:
+            self.count += 1
+            request = Request(
+                self.count,
+                key,
+                function,
+                args,
+                kwargs,
+                callback,
+                error_callback,
+            )
+            if key is not None:
+                self.latest[key] = request.number
+
+        if self.thread is None:
+            self._deliver(request, *self._execute(self.session, request))
+        else:
+            self.requests.put(request)
+
+    def _execute(self, session, request):
+        """
+        Run a request.
+        output:
+            result, error - exception of a failed request or None
+        """
+        try:
+            result = request.function(session, *request.args, **request.kwargs)
+        except Exception as error:
+            logger.exception('Database request failed')
+            return None, error
+
+        return result, None
+
+    def is_obsolete(self, request):
+        """
+        Check whether a newer request with the same key was submitted.
+        """
+        if request.key is None:
+            return False
+
+        with self.lock:
+            return self.latest.get(request.key) != request.number
+
+    def close(self):
+        """
+        Stop the worker, results of pending requests are dropped.
+        """
+        self.closed = True
+
+        if self.thread is not None:
+            self.requests.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        """
+        Serve requests in the worker thread.
+        """
+        session = sessionmaker(bind=self.session.get_bind())()
+
+        while True:
+            request = self.requests.get()
+
+            if request is None:
+                break
+
+            if self.closed or self.is_obsolete(request):
+                continue
+
+            result, error = self._execute(session, request)
+
+            # see changes committed later
+            session.rollback()
+
+            self.finished.emit(request, result, error)
+
+        session.close()
+
+    def _deliver(self, request, result, error):
+        """
+        Pass the result of a request to its callback.
+        """
+        if self.closed or self.is_obsolete(request):
+            return
+
+        if error is not None:
+            if request.error_callback is not None:
+                request.error_callback(error)
+            return
+
+        if request.callback is not None:
+            request.callback(result)
+
+
+def report_to_status(viewer):
+    """
+    Error callback showing failed requests in the status of the viewer.
+    """
+
+    def report(error):
+        viewer.status = f'Database request failed: {error}'
+
+    return report
+
+
+def get_worker(session):
+    """
+    Database worker shared by the widgets working with a session.
+    """
+
+    worker = session.info.get('db_worker')
+
+    if (worker is None) or worker.closed:
+        worker = DatabaseWorker(session)
+        session.info['db_worker'] = worker
+
+    return worker
+
+
+def close_worker(session):
+    """
+    Stop the database worker of a session if there is one.
+    """
+
+    worker = session.info.pop('db_worker', None)
+
+    if worker is not None:
+        worker.close()
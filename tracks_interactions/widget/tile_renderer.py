@@ -0,0 +1,552 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+from sqlalchemy.orm import sessionmaker
+
+import tracks_interactions.db.db_functions as fdb
+
+
+class TileRenderer:
+    """
+    Renders cells of a frame into a labels array tile by tile.
+    Rasterized tiles are kept in an LRU cache keyed by (t, tile)
+    and invalidated by cell edits logged in the session,
+    so that only newly exposed or edited tiles are painted.
+    Cells crossing the border of the painted tiles are painted whole,
+    so the labels array always holds complete masks of the rendered cells.
+    Tiles of neighbouring frames can be prefetched into the cache
+    by worker threads with their own database sessions.
+    With scale > 1 cells are rendered into a labels array downsampled
+    by this factor, e.g. a level of a multiscale image.
+    The labels array can cover only a part of the frame (e.g. the viewport),
+    its position is given by the origin and tiles stay aligned to the frame.
+    Extents passed to the renderer are always in full resolution.
+    """
+
+    def __init__(
+        self,
+        session,
+        tile_size=512,
+        cache_size=128,
+        prefetch_workers=2,
+        scale=1,
+    ):
+        self.session = session
+        self.tile_size = tile_size
+        self.cache_size = cache_size
+        self.scale = scale
+
+        # (t, tile) -> (raster or None if there are no cells, cells)
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+        # start following edits from now on
+        _, self.edits_position = fdb.get_cell_edits(session)
+
+        # prefetched tiles are dropped if edits happened in the meantime
+        self.generation = 0
+        self.pending = set()
+        # queued prefetch tasks -> their (t, tile) keys
+        self.futures = {}
+
+        # in-memory databases are not shared between threads
+        self.executor = None
+        if (prefetch_workers > 0) and can_prefetch(session):
+            self.executor = ThreadPoolExecutor(
+                max_workers=prefetch_workers,
+                thread_name_prefix='labels_prefetch',
+            )
+            self.worker_sessions = []
+            self.local = threading.local()
+
+        self.reset(None)
+
+    def close(self):
+        """
+        Stop prefetching and close sessions of the workers.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+            for session in self.worker_sessions:
+                session.close()
+
+    def reset(self, data, origin=(0, 0), bounds=None):
+        """
+        Forget the state of the labels array.
+        input:
+            data - 2D labels array
+            origin - position of the first pixel of the array in the frame
+            bounds - shape of the (downsampled) frame,
+                     by default the frame ends with the array
+        """
+        self.data = data
+        self.origin = tuple(int(x) for x in origin)
+        self.bounds = bounds
+        if (bounds is None) and (data is not None):
+            self.bounds = (
+                self.origin[0] + data.shape[0],
+                self.origin[1] + data.shape[1],
+            )
+        self.t = None
+
+        # tile -> cells painted with the tile
+        self.painted = {}
+        # tiles with any content (painted or reached by cells of painted tiles)
+        self.touched = set()
+        # touched tiles to repaint because of edits
+        self.dirty = set()
+
+    def clear(self):
+        """
+        Remove all rendered cells from the labels array.
+        """
+        for tile in self.touched:
+            target, _ = self.window(self.tile_extent(tile))
+            self.data[target] = 0
+
+        self.painted = {}
+        self.touched = set()
+        self.dirty = set()
+
+    def tile_extent(self, tile):
+        """
+        Extent (r0, c0, r1, c1) of a tile in the frame clipped to its bounds.
+        """
+        r0 = tile[0] * self.tile_size
+        c0 = tile[1] * self.tile_size
+
+        return (
+            r0,
+            c0,
+            min(r0 + self.tile_size, self.bounds[0]),
+            min(c0 + self.tile_size, self.bounds[1]),
+        )
+
+    def window(self, extent):
+        """
+        Part of an extent of the frame covered by the labels array.
+        output:
+            target - slices of the labels array
+            source - slices of an array spanning the extent
+        """
+        r0, c0, r1, c1 = extent
+        o_r, o_c = self.origin
+        rows, cols = self.data.shape
+
+        r_from = max(r0, o_r)
+        c_from = max(c0, o_c)
+        r_to = max(min(r1, o_r + rows), r_from)
+        c_to = max(min(c1, o_c + cols), c_from)
+
+        target = (
+            slice(r_from - o_r, r_to - o_r),
+            slice(c_from - o_c, c_to - o_c),
+        )
+        source = (
+            slice(r_from - r0, r_to - r0),
+            slice(c_from - c0, c_to - c0),
+        )
+
+        return target, source
+
+    def tiles_in_extent(self, r_start, r_stop, c_start, c_stop, whole=False):
+        """
+        Set of tiles overlapping with an extent and the labels array
+        (or with the whole frame).
+        """
+        r_min, c_min = (0, 0) if whole else self.origin
+        r_max, c_max = self.bounds
+        if not whole:
+            r_max = min(r_max, r_min + self.data.shape[0])
+            c_max = min(c_max, c_min + self.data.shape[1])
+
+        r_start = max(int(r_start), r_min)
+        c_start = max(int(c_start), c_min)
+        r_stop = min(int(np.ceil(r_stop)), r_max)
+        c_stop = min(int(np.ceil(c_stop)), c_max)
+
+        if (r_start >= r_stop) or (c_start >= c_stop):
+            return set()
+
+        return {
+            (i, j)
+            for i in range(
+                r_start // self.tile_size, (r_stop - 1) // self.tile_size + 1
+            )
+            for j in range(
+                c_start // self.tile_size, (c_stop - 1) // self.tile_size + 1
+            )
+        }
+
+    def to_level(self, r_start, r_stop, c_start, c_stop):
+        """
+        Convert a full resolution extent to the downsampled labels array.
+        """
+        return (
+            r_start / self.scale,
+            r_stop / self.scale,
+            c_start / self.scale,
+            c_stop / self.scale,
+        )
+
+    def apply_edits(self):
+        """
+        Invalidate tiles touched by cells edited since the last call.
+        """
+        edits, self.edits_position = fdb.get_cell_edits(
+            self.session, self.edits_position
+        )
+
+        if edits is None:
+            # fell behind the log - everything could have changed
+            with self.lock:
+                self.generation += 1
+                self.cache.clear()
+                self.dirty.update(self.touched)
+            return
+
+        if len(edits) == 0:
+            return
+
+        with self.lock:
+            self.generation += 1
+
+            for t, r0, c0, r1, c1 in edits:
+                tiles = self.tiles_in_extent(
+                    *self.to_level(r0, r1, c0, c1), whole=True
+                )
+
+                for tile in tiles:
+                    self.cache.pop((t, tile), None)
+
+                if t == self.t:
+                    self.dirty.update(tiles & self.touched)
+
+    def render(self, data, t, r_start, r_stop, c_start, c_stop):
+        """
+        Render cells of a frame visible in a field of view.
+        input:
+            data - 2D labels array
+            t - time point
+            r_start, r_stop, c_start, c_stop - extent of the field of view
+        output:
+            cells - rows of all cells in the labels array
+            changed - True if anything was painted
+        """
+
+        if data is not self.data:
+            self.reset(data)
+
+        self.apply_edits()
+
+        changed = False
+
+        if t != self.t:
+            changed = len(self.touched) > 0
+            self.clear()
+            self.t = t
+
+        to_paint = (
+            self.tiles_in_extent(
+                *self.to_level(r_start, r_stop, c_start, c_stop)
+            )
+            - set(self.painted)
+        ) | self.dirty
+
+        if len(to_paint) > 0:
+            self.paint(sorted(to_paint))
+            changed = True
+
+        self.dirty = set()
+
+        return self.cells(), changed
+
+    def cells(self):
+        """
+        Rows of cells rendered in the labels array.
+        """
+        cells = {}
+        for tile_cells in self.painted.values():
+            for cell in tile_cells:
+                cells[cell.track_id] = cell
+
+        return list(cells.values())
+
+    def paint(self, tiles):
+        """
+        Paint tiles of the current frame into the labels array.
+        """
+
+        entries = {}
+        missing = []
+        with self.lock:
+            for tile in tiles:
+                entry = self.cache.get((self.t, tile))
+                if entry is None:
+                    missing.append(tile)
+                else:
+                    self.cache.move_to_end((self.t, tile))
+                    entries[tile] = entry
+
+        # a single query for all tiles that are not cached
+        if len(missing) > 0:
+            extents = [self.tile_extent(tile) for tile in missing]
+            new_entries = rasterize_tiles(
+                self.session,
+                self.t,
+                missing,
+                extents,
+                self.data.dtype,
+                self.scale,
+            )
+            entries.update(new_entries)
+
+            with self.lock:
+                for tile, entry in new_entries.items():
+                    self.cache[(self.t, tile)] = entry
+                self.evict()
+
+        # overwrite the tiles
+        for tile, (raster, cells) in entries.items():
+            target, source = self.window(self.tile_extent(tile))
+            self.data[target] = 0 if raster is None else raster[source]
+
+            self.painted[tile] = cells
+            self.touched.add(tile)
+
+        # complete cells reaching beyond the painted tiles
+        painted = set(self.painted)
+        spilled = []
+        for _, cells in entries.values():
+            for cell in cells:
+                cell_tiles = self.tiles_in_extent(
+                    cell.bbox_0, cell.bbox_2, cell.bbox_1, cell.bbox_3
+                )
+                if cell_tiles <= painted:
+                    continue
+
+                spilled.append(cell)
+                self.touched.update(cell_tiles)
+
+        fdb.rasterize_cells(self.data, spilled, origin=self.origin)
+
+    def cancel_prefetch(self):
+        """
+        Drop prefetch tasks that have not started yet,
+        e.g. when the field of view has changed.
+        """
+        with self.lock:
+            for future, keys in list(self.futures.items()):
+                if future.cancel():
+                    self.pending.difference_update(keys)
+                    del self.futures[future]
+
+    def evict(self):
+        """
+        Drop the least recently used tiles above the size of the cache.
+        """
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def prefetch(self, frames, r_start, r_stop, c_start, c_stop):
+        """
+        Rasterize tiles of a field of view for other frames in the background.
+        Does nothing if prefetching is not available
+        or if the tiles would not fit in the cache.
+        input:
+            frames - time points in the order of priority
+            r_start, r_stop, c_start, c_stop - extent of the field of view
+        """
+
+        if (self.executor is None) or (self.data is None):
+            return
+
+        tiles = sorted(
+            self.tiles_in_extent(
+                *self.to_level(r_start, r_stop, c_start, c_stop)
+            )
+        )
+
+        # keep the tiles of the current frame in the cache
+        if len(tiles) * (len(frames) + 1) > self.cache_size:
+            return
+
+        with self.lock:
+            generation = self.generation
+
+            for t in frames:
+                missing = [
+                    tile
+                    for tile in tiles
+                    if ((t, tile) not in self.cache)
+                    and ((t, tile) not in self.pending)
+                ]
+                if len(missing) == 0:
+                    continue
+
+                self.pending.update((t, tile) for tile in missing)
+
+                extents = [self.tile_extent(tile) for tile in missing]
+                future = self.executor.submit(
+                    self._prefetch_frame,
+                    t,
+                    missing,
+                    extents,
+                    self.data.dtype,
+                    generation,
+                )
+                self.futures[future] = [(t, tile) for tile in missing]
+
+    def _prefetch_frame(self, t, tiles, extents, dtype, generation):
+        """
+        Worker task rasterizing tiles of a frame into the cache.
+        """
+
+        try:
+            session = getattr(self.local, 'session', None)
+            if session is None:
+                session = sessionmaker(bind=self.session.get_bind())()
+                self.local.session = session
+                with self.lock:
+                    self.worker_sessions.append(session)
+
+            entries = rasterize_tiles(
+                session, t, tiles, extents, dtype, self.scale
+            )
+
+            # see changes committed later
+            session.rollback()
+
+            with self.lock:
+                # cells were edited since the request
+                if generation != self.generation:
+                    return
+
+                for tile, entry in entries.items():
+                    if (t, tile) not in self.cache:
+                        self.cache[(t, tile)] = entry
+                self.evict()
+
+        finally:
+            with self.lock:
+                self.pending.difference_update((t, tile) for tile in tiles)
+                self.futures = {
+                    future: keys
+                    for future, keys in self.futures.items()
+                    if not future.done()
+                }
+
+
+def can_prefetch(session):
+    """
+    Check whether the database of a session can be read from other threads.
+    """
+
+    database = session.get_bind().url.database
+
+    return database not in [None, '', ':memory:']
+
+
+class ScaledCell(NamedTuple):
+    """
+    Cell downsampled to a level of a multiscale labels array.
+    """
+
+    track_id: int
+    t: int
+    row: int
+    col: int
+    bbox_0: int
+    bbox_1: int
+    bbox_2: int
+    bbox_3: int
+    mask: np.ndarray
+
+
+def scale_cell(cell, scale):
+    """
+    Downsample a cell by sampling every scale-th pixel of its mask.
+    Returns None if no pixel of the cell is sampled.
+    """
+
+    # first and last + 1 pixel of the level covered by the cell
+    r0 = -(-cell.bbox_0 // scale)
+    c0 = -(-cell.bbox_1 // scale)
+    r1 = -(-cell.bbox_2 // scale)
+    c1 = -(-cell.bbox_3 // scale)
+
+    if (r0 >= r1) or (c0 >= c1):
+        return None
+
+    mask = cell.mask[
+        r0 * scale - cell.bbox_0 :: scale, c0 * scale - cell.bbox_1 :: scale
+    ]
+
+    return ScaledCell(
+        cell.track_id,
+        cell.t,
+        cell.row // scale,
+        cell.col // scale,
+        r0,
+        c0,
+        r1,
+        c1,
+        mask,
+    )
+
+
+def rasterize_tiles(session, t, tiles, extents, dtype, scale=1):
+    """
+    Query cells of tiles of a frame at once and rasterize every tile.
+    Extents of tiles are given in the (downsampled) labels array.
+    output:
+        dictionary tile -> (raster or None if there are no cells, cells)
+    """
+
+    rows = fdb.get_cell_rows_in_view(
+        session,
+        t,
+        min(x[0] for x in extents) * scale,
+        max(x[2] for x in extents) * scale,
+        min(x[1] for x in extents) * scale,
+        max(x[3] for x in extents) * scale,
+    )
+
+    if scale > 1:
+        rows = [scale_cell(cell, scale) for cell in rows]
+        rows = [cell for cell in rows if cell is not None]
+
+    entries = {}
+    for tile, extent in zip(tiles, extents):
+        r0, c0, r1, c1 = extent
+        cells = [
+            cell
+            for cell in rows
+            if (cell.bbox_0 < r1)
+            and (cell.bbox_2 > r0)
+            and (cell.bbox_1 < c1)
+            and (cell.bbox_3 > c0)
+        ]
+        entries[tile] = (rasterize(cells, extent, dtype), cells)
+
+    return entries
+
+
+def rasterize(cells, extent, dtype):
+    """
+    Rasterize cells clipped to the extent of a tile.
+    Returns None if there are no cells.
+    """
+
+    if len(cells) == 0:
+        return None
+
+    r0, c0, r1, c1 = extent
+    raster = np.zeros((r1 - r0, c1 - c0), dtype=dtype)
+
+    return fdb.rasterize_cells(raster, cells, origin=(r0, c0))
@@ -7,6 +7,7 @@ from qtpy.QtWidgets import (
 
 import napari
 from tracks_interactions.graph.family_graph import FamilyGraphWidget
+from tracks_interactions.widget.db_worker import close_worker
 from tracks_interactions.widget.signal_graph_widget import CellGraphWidget
 from tracks_interactions.widget.widget_modifications import ModificationWidget
 from tracks_interactions.widget.widget_navigation import TrackNavigationWidget
@@ -68,17 +69,19 @@ class TrackGardener(QWidget):
 
             # disconnect labels connections
             self.viewer.camera.events.zoom.disconnect(
-                self.navigation_widget.build_labels
+                self.navigation_widget.schedule_labels
             )
             self.viewer.camera.events.center.disconnect(
-                self.navigation_widget.build_labels
+                self.navigation_widget.schedule_labels
             )
             self.viewer.layers['Labels'].events.visible.disconnect(
-                self.navigation_widget.build_labels
+                self.navigation_widget.schedule_labels
             )
 
         # remove widgets from tab2
         if self.navigation_widget is not None:
+            self.navigation_widget.close_renderers()
+            close_worker(self.navigation_widget.session)
             self.navigation_widget.setParent(None)
             self.navigation_widget.deleteLater()
 
@@ -16,6 +16,10 @@ from qtpy.QtWidgets import (
 from skimage.measure import regionprops
 
 import tracks_interactions.db.db_functions as fdb
+from tracks_interactions.widget.db_worker import (
+    get_worker,
+    report_to_status,
+)
 
 
 class ModificationWidget(QWidget):
@@ -39,6 +43,10 @@ class ModificationWidget(QWidget):
         self.viewer = napari_viewer
         self.labels = self.viewer.layers['Labels']
         self.session = sql_session
+        # runs lookups of the selected track in the background
+        self.db_worker = get_worker(sql_session)
+        # track of the note in the note dialog
+        self.note_label = None
         self.ch_list = ch_list
         self.ch_names = ch_names
         self.signal_function = signal_function
@@ -78,6 +86,13 @@ class ModificationWidget(QWidget):
         # connect change of cell to change of note
         self.labels.events.selected_label.connect(self.update_note_and_icon)
 
+        # regions of labels painted since the last save in the frame coordinates
+        # (None - not known, the whole labels array is analysed)
+        self.dirty_boxes = None
+        # undo / redo history at the last save
+        self.saved_history = []
+        self.labels.events.paint.connect(self.mark_painted)
+
         # add cell modification
         self.mod_cell_btn = self.add_mod_cell_btn()
         self.layout().addWidget(self.mod_cell_btn)
@@ -216,10 +231,22 @@ class ModificationWidget(QWidget):
         ############################################################################################
         # perform database operations
 
-        # cut trackDB
-        mitosis, new_track = fdb.cut_trackDB(
-            self.session, active_label, current_frame
-        )
+        # single commit for the whole operation
+        with fdb.transaction(self.session):
+            # cut trackDB
+            mitosis, new_track = fdb.cut_trackDB(
+                self.session, active_label, current_frame
+            )
+
+            # if cutting in the middle of a track
+            if not mitosis and new_track:
+                fdb.cellsDB_after_trackDB(
+                    self.session,
+                    active_label,
+                    current_frame,
+                    new_track,
+                    direction='after',
+                )
 
         # if cutting from mitosis
         if mitosis:
@@ -229,14 +256,6 @@ class ModificationWidget(QWidget):
 
         # if cutting in the middle of a track
         elif new_track:
-            fdb.cellsDB_after_trackDB(
-                self.session,
-                active_label,
-                current_frame,
-                new_track,
-                direction='after',
-            )
-
             # trigger family tree update
             self.viewer.layers['Labels'].selected_label = new_track
 
@@ -283,18 +302,21 @@ class ModificationWidget(QWidget):
         ############################################################################################
         # perform database operations
 
-        # delete trackDB
-        status = fdb.delete_trackDB(self.session, active_label)
+        # single commit for the whole operation
+        with fdb.transaction(self.session):
+            # delete trackDB
+            status = fdb.delete_trackDB(self.session, active_label)
 
-        if status != 'Track not found':
-            fdb.cellsDB_after_trackDB(
-                self.session,
-                active_label,
-                current_frame=None,
-                new_track=None,
-                direction='all',
-            )
+            if status != 'Track not found':
+                fdb.cellsDB_after_trackDB(
+                    self.session,
+                    active_label,
+                    current_frame=None,
+                    new_track=None,
+                    direction='all',
+                )
 
+        if status != 'Track not found':
             # trigger family tree update
             self.labels.selected_label = 0
 
@@ -341,28 +363,30 @@ class ModificationWidget(QWidget):
         ################################################################################################
         # perform database operations
 
-        # cut trackDB
-        t1_after, _ = fdb.integrate_trackDB(
-            self.session, 'merge', t1, t2, curr_fr
-        )
-
-        if t1_after == -1:
-            self.viewer.status = (
-                "Error - cannot merge to a track that hasn't started yet."
+        # single commit for the whole operation
+        with fdb.transaction(self.session):
+            # cut trackDB
+            t1_after, _ = fdb.integrate_trackDB(
+                self.session, 'merge', t1, t2, curr_fr
             )
-            return
 
-        if t1_after is not None:
-            # modify cellsDB of t1
+            if t1_after == -1:
+                self.viewer.status = (
+                    "Error - cannot merge to a track that hasn't started yet."
+                )
+                return
+
+            if t1_after is not None:
+                # modify cellsDB of t1
+                fdb.cellsDB_after_trackDB(
+                    self.session, t1, curr_fr, t1_after, direction='after'
+                )
+
+            # modify cellsDB of t2
             fdb.cellsDB_after_trackDB(
-                self.session, t1, curr_fr, t1_after, direction='after'
+                self.session, t2, curr_fr, t1, direction='after'
             )
 
-        # modify cellsDB of t2
-        fdb.cellsDB_after_trackDB(
-            self.session, t2, curr_fr, t1, direction='after'
-        )
-
         ################################################################################################
         # change viewer status
         self.T2_box.setValue(t1)
@@ -419,34 +443,34 @@ class ModificationWidget(QWidget):
         ################################################################################################
         # perform database operations
 
-        # cut trackDB
-        t1_after, t2_before = fdb.integrate_trackDB(
-            self.session, 'connect', t1, t2, curr_fr
-        )
-
-        if t1_after == -1:
-            self.viewer.status = (
-                "Error - cannot connect to a track that hasn't started yet."
+        # single commit for the whole operation
+        with fdb.transaction(self.session):
+            # cut trackDB
+            t1_after, t2_before = fdb.integrate_trackDB(
+                self.session, 'connect', t1, t2, curr_fr
             )
-            return
 
-        if t1_after is not None:
-            # modify cellsDB of t1_after
-            fdb.cellsDB_after_trackDB(
-                self.session, t1, curr_fr, t1_after, direction='after'
-            )
+            if t1_after == -1:
+                self.viewer.status = "Error - cannot connect to a track that hasn't started yet."
+                return
 
-            # change viewer status
-            self.viewer.status = f'Track {t2} has been connected to {t1}. Track {t1_after} has been created.'
+            if t1_after is not None:
+                # modify cellsDB of t1_after
+                fdb.cellsDB_after_trackDB(
+                    self.session, t1, curr_fr, t1_after, direction='after'
+                )
 
-        if t2_before is not None:
-            # modify cellsDB of t2
-            fdb.cellsDB_after_trackDB(
-                self.session, t2, curr_fr, t2_before, direction='before'
-            )
+                # change viewer status
+                self.viewer.status = f'Track {t2} has been connected to {t1}. Track {t1_after} has been created.'
+
+            if t2_before is not None:
+                # modify cellsDB of t2
+                fdb.cellsDB_after_trackDB(
+                    self.session, t2, curr_fr, t2_before, direction='before'
+                )
 
-            # change viewer status
-            self.viewer.status = f'Track {t2} has been connected to {t1}. Track {t2_before} has been created.'
+                # change viewer status
+                self.viewer.status = f'Track {t2} has been connected to {t1}. Track {t2_before} has been created.'
 
         # account for different both and none new tracks in viewer status
         if t1_after is not None and t2_before is not None:
@@ -490,7 +514,9 @@ class ModificationWidget(QWidget):
         Track
         """
 
-        new_track = fdb.newTrack_number(self.session)
+        # reserved, so that the next new track gets a different number
+        # even before this one is saved
+        new_track = fdb.reserve_track_number(self.session)
         self.labels.selected_label = new_track
 
         self.viewer.status = f'You can start track {new_track}.'
@@ -530,8 +556,10 @@ class ModificationWidget(QWidget):
         # collect current note
         self.current_note = self.text_edit.toPlainText()
 
-        # save the note to the database
-        active_label = int(self.labels.selected_label)
+        # save the note to the track it was opened for
+        active_label = self.note_label
+        if active_label is None:
+            active_label = int(self.labels.selected_label)
         sts = fdb.save_track_note(
             self.session, active_label, self.current_note
         )
@@ -548,6 +576,10 @@ class ModificationWidget(QWidget):
         Function to handle addition of a note to the track.
         """
 
+        # the note looked up in the background can be of the previous track
+        self.note_label = int(self.labels.selected_label)
+        self.current_note = fdb.get_track_note(self.session, self.note_label)
+
         self.dialog = QDialog()
         self.text_edit = QTextEdit()
         self.text_edit.setText(self.current_note)
@@ -560,12 +592,34 @@ class ModificationWidget(QWidget):
         save_button.clicked.connect(self.save_note)
         self.dialog.exec_()
 
+        self.note_label = None
+
     def update_note_and_icon(self):
         """
         Function to update current note and button icon according to the selected label.
         """
         active_label = int(self.labels.selected_label)
-        self.current_note = fdb.get_track_note(self.session, active_label)
+
+        # look up the note in the background
+        self.db_worker.submit(
+            fdb.get_track_note,
+            active_label,
+            callback=lambda note: self.show_note_icon(note, active_label),
+            error_callback=report_to_status(self.viewer),
+            key=(id(self), 'note'),
+        )
+
+    def show_note_icon(self, note, active_label=None):
+        """
+        Function to remember the note of the selected track and update the icon.
+        Notes of tracks that are no longer selected are ignored.
+        """
+        if (active_label is not None) and (
+            active_label != int(self.labels.selected_label)
+        ):
+            return
+
+        self.current_note = note
 
         # change the icon accordigly
         if bool(self.current_note):
@@ -631,80 +685,125 @@ class ModificationWidget(QWidget):
 
         current_frame = self.viewer.dims.current_step[0]
 
+        # labels are displayed only at a lower resolution level
+        if self.labels.metadata.get('level', 0) > 0:
+            self.viewer.status = 'Zoom in to save cells.'
+            return
+
         refresh_status = False
 
         # get query
         query = self.labels.metadata['query']
         query_ids = [cell.track_id for cell in query]
 
-        # get properties of objects in the fov
-        regionprops_results = regionprops(self.labels.data)
+        # the labels array covers only a part of the frame
+        r0 = int(self.labels.translate[-2])
+        c0 = int(self.labels.translate[-1])
+        r1 = r0 + self.labels.data.shape[0]
+        c1 = c0 + self.labels.data.shape[1]
+
+        # cells cut by the border of the array
+        clipped_ids = [
+            cell.track_id
+            for cell in query
+            if (cell.bbox_0 < r0)
+            or (cell.bbox_1 < c0)
+            or (cell.bbox_2 > r1)
+            or (cell.bbox_3 > c1)
+        ]
+
+        # analyse only labels painted since the last save
+        boxes = self.dirty_regions()
+        if boxes is None:
+            window, offset = self.labels.data, (r0, c0)
+        else:
+            window, offset, dirty_ids = self.dirty_window(boxes, query)
+            query_ids = [x for x in query_ids if x in dirty_ids]
+
+        # get properties of objects in the fov (in the frame coordinates)
+        regionprops_results = [
+            FrameRegion(x, offset)
+            for x in regionprops(window, offset=offset)
+            if x.label not in clipped_ids
+        ]
+
+        # cut cells - the edited part is joined with the rest of the mask
+        for cell in query:
+            if (cell.track_id in clipped_ids) and (cell.track_id in query_ids):
+                region = self.clipped_region(cell)
+                if region is not None:
+                    regionprops_results.append(region)
+
+        # single commit for all modified cells
+        with fdb.transaction(self.session):
+            new_cells = []
+            for cell_label in regionprops_results:
+
+                cell_label_id = cell_label.label
+
+                if cell_label_id in query_ids:
+
+                    # remove from the query list
+                    query_ids.remove(cell_label_id)
+
+                    # get the cell
+                    cell_query = next(
+                        x for x in query if x.track_id == cell_label_id
+                    )
 
-        for cell_label in regionprops_results:
+                    # if modified
+                    row_diff = abs(cell_label.centroid[1] - cell_query.col) > 2
+                    col_diff = abs(cell_label.centroid[0] - cell_query.row) > 2
+                    mask_diff = not np.array_equal(
+                        cell_label.image, cell_query.mask
+                    )
+                    if row_diff or col_diff or mask_diff:
 
-            cell_label_id = cell_label.label
+                        # update the database
+                        self.viewer.status = (
+                            f'{cell_label_id} has been modified'
+                        )
 
-            if cell_label_id in query_ids:
+                        # remove old from the database
+                        fdb.remove_CellDB(
+                            self.session, cell_label_id, current_frame
+                        )
 
-                # remove from the query list
-                query_ids.remove(cell_label_id)
+                        # added with the other cells below
+                        new_cells.append(cell_label)
 
-                # get the cell
-                cell_query = next(
-                    x for x in query if x.track_id == cell_label_id
-                )
+                        refresh_status = True
 
-                # if modified
-                row_diff = abs(cell_label.centroid[1] - cell_query.col) > 2
-                col_diff = abs(cell_label.centroid[0] - cell_query.row) > 2
-                mask_diff = not np.array_equal(
-                    cell_label.image, cell_query.mask
-                )
-                if row_diff or col_diff or mask_diff:
-
-                    # update the database
-                    self.viewer.status = f'{cell_label_id} has been modified'
+                else:
 
-                    # remove old from the database
-                    fdb.remove_CellDB(
-                        self.session, cell_label_id, current_frame
-                    )
-
-                    # add new to the database
-                    fdb.add_new_CellDB(
-                        self.session,
-                        current_frame,
-                        cell_label,
-                        ch_list=self.ch_list,
-                        signal_function=self.signal_function,
-                    )
+                    # a new cell
+                    self.viewer.status = f'{cell_label_id} has been added'
+                    new_cells.append(cell_label)
 
                     refresh_status = True
 
-            else:
-
-                # a new cell
-                self.viewer.status = f'{cell_label_id} has been added'
-                # add new to the database
-                fdb.add_new_CellDB(
+            # signals of all new cells calculated together
+            if len(new_cells) > 0:
+                fdb.add_new_CellDB_batch(
                     self.session,
                     current_frame,
-                    cell_label,
+                    new_cells,
                     ch_list=self.ch_list,
                     signal_function=self.signal_function,
                 )
 
-                refresh_status = True
+            # for cells in query that are no longer in the field
+            for cell_id in query_ids:
 
-        # for cells in query that are no longer in the field
-        for cell_id in query_ids:
+                # cell is missing
+                self.viewer.status = f'{cell_id} has been removed'
+                # remove old from the database
+                fdb.remove_CellDB(self.session, cell_id, current_frame)
 
-            # cell is missing
-            self.viewer.status = f'{cell_id} has been removed'
-            # remove old from the database
-            fdb.remove_CellDB(self.session, cell_id, current_frame)
+                refresh_status = True
 
-            refresh_status = True
+        # labels agree with the database now
+        self.mark_saved()
 
         # if any changes were made
         if refresh_status:
@@ -713,3 +812,225 @@ class ModificationWidget(QWidget):
             sel_label = self.labels.selected_label
             self.labels.selected_label = -1
             self.labels.selected_label = sel_label
+
+    def mark_painted(self, event):
+        """
+        Remember regions of labels changed by painting.
+        """
+        if self.dirty_boxes is None:
+            return
+
+        self.dirty_boxes.extend(
+            history_boxes([event.value], self.labels.translate)
+        )
+
+    def mark_saved(self):
+        """
+        Start tracking painted regions from the current state of labels.
+        """
+        self.dirty_boxes = []
+        self.saved_history = list(self.labels._undo_history) + list(
+            self.labels._redo_history
+        )
+
+    def dirty_regions(self):
+        """
+        Regions of labels changed since the last save.
+        Undo and redo move items between the history lists of the layer,
+        items that were not there at the last save mark changed regions too.
+        output:
+            list of (r0, c0, r1, c1) in the frame or None if not known
+        """
+        if self.dirty_boxes is None:
+            return None
+
+        saved = {id(x) for x in self.saved_history}
+        moved = [
+            item
+            for item in list(self.labels._undo_history)
+            + list(self.labels._redo_history)
+            if id(item) not in saved
+        ]
+
+        return self.dirty_boxes + history_boxes(moved, self.labels.translate)
+
+    def dirty_window(self, boxes, query):
+        """
+        Part of labels to analyse for changes in the dirty regions.
+        Labels found in the regions and cells of the query overlapping
+        with them are included whole, other labels are removed.
+        input:
+            boxes - dirty regions (r0, c0, r1, c1) in the frame
+            query - cells rendered in the labels
+        output:
+            window - part of the labels array
+            offset - position of the window in the frame
+            dirty_ids - labels to analyse
+        """
+        data = self.labels.data
+        rows, cols = data.shape
+        r0 = int(self.labels.translate[-2])
+        c0 = int(self.labels.translate[-1])
+
+        # boxes in the labels array
+        extents = []
+        for b0, b1, b2, b3 in boxes:
+            b0, b1 = max(b0 - r0, 0), max(b1 - c0, 0)
+            b2, b3 = min(b2 - r0, rows), min(b3 - c0, cols)
+            if (b0 < b2) and (b1 < b3):
+                extents.append((b0, b1, b2, b3))
+
+        dirty_ids = set()
+        for b0, b1, b2, b3 in extents:
+            dirty_ids.update(np.unique(data[b0:b2, b1:b3]).tolist())
+        dirty_ids.discard(0)
+
+        # cells painted over, also the erased ones
+        for cell in query:
+            for b0, b1, b2, b3 in extents:
+                if (
+                    (cell.bbox_0 - r0 < b2)
+                    and (cell.bbox_2 - r0 > b0)
+                    and (cell.bbox_1 - c0 < b3)
+                    and (cell.bbox_3 - c0 > b1)
+                ):
+                    dirty_ids.add(cell.track_id)
+                    break
+
+        if len(extents) == 0:
+            return np.zeros([0, 0], dtype=data.dtype), (r0, c0), dirty_ids
+
+        # whole cells of the query that were painted over
+        extents += [
+            (
+                cell.bbox_0 - r0,
+                cell.bbox_1 - c0,
+                cell.bbox_2 - r0,
+                cell.bbox_3 - c0,
+            )
+            for cell in query
+            if cell.track_id in dirty_ids
+        ]
+        w0 = max(min(x[0] for x in extents), 0)
+        w1 = max(min(x[1] for x in extents), 0)
+        w2 = min(max(x[2] for x in extents), rows)
+        w3 = min(max(x[3] for x in extents), cols)
+
+        window = data[w0:w2, w1:w3]
+        window = np.where(np.isin(window, list(dirty_ids)), window, 0)
+
+        return window, (r0 + w0, c0 + w1), dirty_ids
+
+    def clipped_region(self, cell):
+        """
+        Cell cut by the border of the labels array after editing.
+        Pixels of the cell in the array are taken from the labels,
+        pixels outside of it from the mask stored in the database.
+        input:
+            cell - cell of the query
+        output:
+            FrameRegion in the frame coordinates,
+            None if no pixel of the cell is left
+        """
+        data = self.labels.data
+        r0 = int(self.labels.translate[-2])
+        c0 = int(self.labels.translate[-1])
+        r1, c1 = r0 + data.shape[0], c0 + data.shape[1]
+
+        # pixels of the label in the array
+        rows, cols = np.nonzero(data == cell.track_id)
+
+        # extent of the stored cell and of the painted pixels
+        e0, e1, e2, e3 = cell.bbox_0, cell.bbox_1, cell.bbox_2, cell.bbox_3
+        if len(rows) > 0:
+            e0 = min(e0, int(rows.min()) + r0)
+            e1 = min(e1, int(cols.min()) + c0)
+            e2 = max(e2, int(rows.max()) + r0 + 1)
+            e3 = max(e3, int(cols.max()) + c0 + 1)
+
+        mask = np.zeros([e2 - e0, e3 - e1], dtype=bool)
+        mask[
+            cell.bbox_0 - e0 : cell.bbox_2 - e0,
+            cell.bbox_1 - e1 : cell.bbox_3 - e1,
+        ] = cell.mask
+
+        # the part in the array is replaced by the labels
+        a0, a1 = max(e0, r0), max(e1, c0)
+        a2, a3 = min(e2, r1), min(e3, c1)
+        if (a0 < a2) and (a1 < a3):
+            mask[a0 - e0 : a2 - e0, a1 - e1 : a3 - e1] = (
+                data[a0 - r0 : a2 - r0, a1 - c0 : a3 - c0] == cell.track_id
+            )
+
+        if not mask.any():
+            return None
+
+        labels = mask.astype(data.dtype) * cell.track_id
+        region = regionprops(labels, offset=(e0, e1))[0]
+
+        return FrameRegion(region, (e0, e1))
+
+
+def history_boxes(history, translate):
+    """
+    Bounding boxes of changes in items of the labels undo history.
+    input:
+        history - list of history items (lists of (indices, before, after))
+        translate - translation of the labels layer
+    output:
+        list of (r0, c0, r1, c1) in the frame
+    """
+
+    r0 = int(translate[-2])
+    c0 = int(translate[-1])
+
+    boxes = []
+    for item in history:
+        for indices, _, _ in item:
+            rows, cols = indices[-2], indices[-1]
+            if len(rows) == 0:
+                continue
+
+            boxes.append(
+                (
+                    int(np.min(rows)) + r0,
+                    int(np.min(cols)) + c0,
+                    int(np.max(rows)) + r0 + 1,
+                    int(np.max(cols)) + c0 + 1,
+                )
+            )
+
+    return boxes
+
+
+class FrameRegion:
+    """
+    Region properties of a labels array placed in the frame with an offset.
+    regionprops shifts centroids and coordinates by the offset,
+    bounding boxes and slices are shifted here.
+    """
+
+    def __init__(self, region, offset):
+        self.region = region
+        self.offset = offset
+
+    def __getattr__(self, name):
+        return getattr(self.region, name)
+
+    def __getitem__(self, name):
+        # as regionprops - properties also by name, shifted as attributes
+        return getattr(self, name)
+
+    @property
+    def bbox(self):
+        r0, c0, r1, c1 = self.region.bbox
+        o_r, o_c = self.offset
+
+        return (r0 + o_r, c0 + o_c, r1 + o_r, c1 + o_c)
+
+    @property
+    def slice(self):
+        return tuple(
+            slice(x.start + o, x.stop + o)
+            for x, o in zip(self.region.slice, self.offset)
+        )
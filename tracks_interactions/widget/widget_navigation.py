@@ -1,3 +1,5 @@
+import numpy as np
+from qtpy.QtCore import QTimer
 from qtpy.QtWidgets import (
     QCheckBox,
     QGridLayout,
@@ -7,9 +9,13 @@ from qtpy.QtWidgets import (
     QVBoxLayout,
     QWidget,
 )
-from sqlalchemy import and_
 
-from tracks_interactions.db.db_model import CellDB, TrackDB
+import tracks_interactions.db.db_functions as fdb
+from tracks_interactions.widget.db_worker import (
+    get_worker,
+    report_to_status,
+)
+from tracks_interactions.widget.tile_renderer import TileRenderer
 
 
 class TrackNavigationWidget(QWidget):
@@ -21,6 +27,36 @@ class TrackNavigationWidget(QWidget):
         self.labels = self.viewer.layers['Labels']
         self.session = sql_session
         self.query_lim = 500
+        # overview of cells when there are too many to display labels
+        self.overview_name = 'Cells overview'
+        self.overview_bins = 200
+
+        # shape of the frame - the labels layer holds only the viewport
+        self.frame_shape = tuple(
+            self.labels.metadata.get('frame_shape', self.labels.data.shape)
+        )
+
+        # runs queries of the track navigation in the background
+        self.db_worker = get_worker(self.session)
+
+        # renders the labels layer tile by tile
+        self.renderer = TileRenderer(self.session)
+        # renderers of lower resolution levels of multiscale experiments
+        self.level_renderers = {}
+        # frames before and after the current one prepared in the background
+        self.prefetch_frames = 3
+
+        # positions of the followed track - (t, row, col) sorted by t
+        self.trajectory = None
+        self.trajectory_track = None
+        self.trajectory_edits = 0
+
+        # bursts of camera events are merged into a single refresh
+        self.refresh_delay = 50
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.timeout.connect(self.build_labels)
+        self.building = False
 
         # add shortcuts
         self.init_shortcuts()
@@ -45,9 +81,9 @@ class TrackNavigationWidget(QWidget):
         self.build_labels()
 
         # connect building labels to the viewer
-        self.viewer.camera.events.zoom.connect(self.build_labels)
-        self.viewer.camera.events.center.connect(self.build_labels)
-        self.labels.events.visible.connect(self.build_labels)
+        self.viewer.camera.events.zoom.connect(self.schedule_labels)
+        self.viewer.camera.events.center.connect(self.schedule_labels)
+        self.labels.events.visible.connect(self.schedule_labels)
 
     #########################################################
     # shortcuts
@@ -71,80 +107,405 @@ class TrackNavigationWidget(QWidget):
             switch = False
             if viewer.layers['Labels'].mode == 'erase':
                 viewer.layers['Labels'].mode = 'pan_zoom'
-            
+
             # look up cursor position
             position = tuple([int(x) for x in self.viewer.cursor.position])
 
+            # position in the labels array covering the viewport
+            r = position[1] - int(self.labels.translate[-2])
+            c = position[2] - int(self.labels.translate[-1])
+
             # check which cell was clicked
-            myTrackNum = self.labels.data[position[1], position[2]]
+            myTrackNum = 0
+            rows, cols = self.labels.data.shape
+            if (0 <= r < rows) and (0 <= c < cols):
+                myTrackNum = self.labels.data[r, c]
 
             # set track as active
             self.labels.selected_label = int(myTrackNum)
 
-
     #########################################################
     # labels_layer_update
     #########################################################
 
+    def schedule_labels(self, event=None):
+        """
+        Build labels once the viewer stops changing.
+        Every call restarts the timer, so a burst of events
+        (e.g. a mouse-wheel zoom) results in a single refresh.
+        """
+
+        # tiles prefetched for the previous field of view are not needed
+        self.cancel_prefetch()
+
+        self.refresh_timer.start(self.refresh_delay)
+
     def build_labels(self):
         """
         Function to build the labels layer based on db content
         """
 
-        if ('Labels' in self.viewer.layers) and (
-            self.viewer.layers['Labels'].visible
-        ):
-            current_frame = self.viewer.dims.current_step[0]
+        # a refresh is happening now
+        self.refresh_timer.stop()
 
-            # clear labels
-            self.viewer.layers['Labels'].data[:] = 0
+        # replacing labels arrays emits events of the viewer
+        # (e.g. a change of dims) that would build labels again
+        if self.building:
+            return
 
-            # get the corner pixels of the viewer - for magnification
-            corner_pixels = self.labels.corner_pixels
+        self.building = True
+        try:
+            self.render_labels()
+        finally:
+            self.building = False
 
-            r_rad = (corner_pixels[1, 0] - corner_pixels[0, 0]) / 2
-            c_rad = (corner_pixels[1, 1] - corner_pixels[0, 1]) / 2
+    def render_labels(self):
+        """
+        Render cells of the field of view into the labels layer,
+        a layer of a lower resolution level or the overview.
+        """
 
-            # get the center position of the viewer
-            r = self.viewer.camera.center[1]
-            c = self.viewer.camera.center[2]
+        if ('Labels' in self.viewer.layers) and (
+            self.viewer.layers['Labels'].visible
+        ):
+            current_frame = self.viewer.dims.current_step[0]
 
             # calculate labels extent
-            r_start = r - r_rad
-            r_stop = r + r_rad
-            c_start = c - c_rad
-            c_stop = c + c_rad
-
-            # query the database
-            query = (
-                self.session.query(CellDB)
-                .filter(CellDB.t == current_frame)
-                .filter(CellDB.bbox_0 < int(r_stop))
-                .filter(CellDB.bbox_1 < int(c_stop))
-                .filter(CellDB.bbox_2 > int(r_start))
-                .filter(CellDB.bbox_3 > int(c_start))
-                .limit(self.query_lim)
-                .all()
+            r_start, r_stop, c_start, c_stop = self.view_extent()
+
+            # count cells in the field (uses R*Tree index if present)
+            cells_num = fdb.count_cells_in_view(
+                self.session,
+                current_frame,
+                r_start,
+                r_stop,
+                c_start,
+                c_stop,
+                limit=self.query_lim,
             )
 
-            if len(query) < self.query_lim:
+            # level of the multiscale images matching the zoom
+            level = self.current_level()
+            self.labels.metadata['level'] = level
+
+            if (cells_num < self.query_lim) and (level == 0):
+                # labels array covering the field of view
+                self.fit_buffer(
+                    self.labels,
+                    self.renderer,
+                    1,
+                    r_start,
+                    r_stop,
+                    c_start,
+                    c_stop,
+                )
                 frame = self.viewer.layers['Labels'].data
 
-                for cell in query:
-                    frame[
-                        cell.bbox_0 : cell.bbox_2, cell.bbox_1 : cell.bbox_3
-                    ] += (cell.mask.astype(int) * cell.track_id)
+                # paint only tiles that are new in the field or edited
+                query, changed = self.renderer.render(
+                    frame, current_frame, r_start, r_stop, c_start, c_stop
+                )
 
-                self.viewer.layers['Labels'].data = frame
-                self.viewer.status = f'Found {len(query)} cells in the field.'
+                if changed:
+                    self.viewer.layers['Labels'].data = frame
+                self.viewer.status = f'Found {cells_num} cells in the field.'
 
                 # store the query with the layer
                 self.labels.metadata['query'] = query
 
+                self.hide_overview()
+                self.hide_levels()
+
+                # prepare neighbouring frames for scrubbing through time
+                self.renderer.prefetch(
+                    self.frames_to_prefetch(current_frame),
+                    r_start,
+                    r_stop,
+                    c_start,
+                    c_stop,
+                )
+
+            elif cells_num < self.query_lim:
+                self.clear_labels()
+                self.hide_overview()
+
+                # paint downsampled cells instead of the full resolution
+                self.show_level(
+                    level, current_frame, r_start, r_stop, c_start, c_stop
+                )
+
+                self.viewer.status = f'Found {cells_num} cells in the field - zoom in to modify labels.'
+
             else:
-                self.viewer.layers['Labels'].refresh()
+                self.clear_labels()
+                self.hide_levels()
+
+                # show positions of cells instead
+                self.show_overview(
+                    current_frame, r_start, r_stop, c_start, c_stop
+                )
+
                 self.viewer.status = f'More than {self.query_lim} in the field - zoom in to display labels.'
 
+        else:
+            self.hide_levels()
+
+    def view_extent(self):
+        """
+        Extent of the field of view clipped to the frame.
+        output:
+            r_start, r_stop, c_start, c_stop
+        """
+
+        # size of the canvas in the frame pixels
+        r_rad = self.viewer._canvas_size[0] / self.viewer.camera.zoom / 2
+        c_rad = self.viewer._canvas_size[1] / self.viewer.camera.zoom / 2
+
+        # get the center position of the viewer
+        r = self.viewer.camera.center[1]
+        c = self.viewer.camera.center[2]
+
+        return (
+            max(r - r_rad, 0),
+            min(r + r_rad, self.frame_shape[0]),
+            max(c - c_rad, 0),
+            min(c + c_rad, self.frame_shape[1]),
+        )
+
+    def fit_buffer(
+        self, layer, renderer, factor, r_start, r_stop, c_start, c_stop
+    ):
+        """
+        Make the labels array of a layer cover the field of view.
+        The array spans tiles of the field of view with a margin of a tile
+        and is placed in the frame with the translation of the layer.
+        It is replaced when the field of view leaves it
+        or when it is much larger than needed after zooming in.
+        input:
+            layer - labels layer
+            renderer - renderer of the layer
+            factor - downsampling of the layer
+            r_start, r_stop, c_start, c_stop - extent of the field of view
+        output:
+            True if a new array was allocated
+        """
+
+        tile = renderer.tile_size
+        rows = -(-self.frame_shape[0] // factor)
+        cols = -(-self.frame_shape[1] // factor)
+
+        # field of view in pixels of the layer
+        r0 = max(int(r_start // factor), 0)
+        c0 = max(int(c_start // factor), 0)
+        r1 = min(int(-(-r_stop // factor)), rows)
+        c1 = min(int(-(-c_stop // factor)), cols)
+
+        # array aligned to tiles with a margin
+        b_r0 = max((r0 // tile - 1) * tile, 0)
+        b_c0 = max((c0 // tile - 1) * tile, 0)
+        b_r1 = min(((r1 - 1) // tile + 2) * tile, rows)
+        b_c1 = min(((c1 - 1) // tile + 2) * tile, cols)
+
+        data = renderer.data
+        if (data is not None) and (data is layer.data):
+            o_r, o_c = renderer.origin
+            covers = (
+                (o_r <= r0)
+                and (o_c <= c0)
+                and (r1 <= o_r + data.shape[0])
+                and (c1 <= o_c + data.shape[1])
+            )
+            oversized = data.size > 4 * (b_r1 - b_r0) * (b_c1 - b_c0)
+
+            if covers and not oversized:
+                return False
+
+        buffer = np.zeros([b_r1 - b_r0, b_c1 - b_c0], dtype=np.uint32)
+
+        layer.data = buffer
+        layer.translate = (b_r0 * factor, b_c0 * factor)
+        renderer.reset(buffer, origin=(b_r0, b_c0), bounds=(rows, cols))
+
+        return True
+
+    def clear_labels(self):
+        """
+        Remove rendered cells from the labels layer.
+        """
+
+        frame = self.viewer.layers['Labels'].data
+
+        if frame is not self.renderer.data:
+            self.renderer.reset(frame)
+        self.renderer.clear()
+
+        self.labels.metadata['query'] = []
+
+        self.viewer.layers['Labels'].refresh()
+
+    def current_level(self):
+        """
+        Level of the multiscale images matching the current zoom.
+        Levels are given as downsampling factors in the labels metadata.
+        """
+
+        levels = self.labels.metadata.get('levels', [1])
+
+        # image pixels per screen pixel
+        pixel_size = 1 / self.viewer.camera.zoom
+
+        level = 0
+        for ind, factor in enumerate(levels):
+            if factor <= pixel_size:
+                level = ind
+
+        return level
+
+    def show_level(
+        self, level, current_frame, r_start, r_stop, c_start, c_stop
+    ):
+        """
+        Render cells into a labels layer of a lower resolution level.
+        """
+
+        factor = self.labels.metadata['levels'][level]
+        name = f'Labels level {level}'
+
+        if name not in self.viewer.layers:
+            # the array is fitted to the field of view below
+            level_layer = self.viewer.add_labels(
+                np.zeros([1, 1], dtype=np.uint32),
+                name=name,
+                scale=(factor, factor),
+                opacity=self.labels.opacity,
+            )
+            level_layer.editable = False
+
+            # keep working with the labels
+            self.viewer.layers.selection.active = self.labels
+
+        if level not in self.level_renderers:
+            self.level_renderers[level] = TileRenderer(
+                self.session, scale=factor
+            )
+
+        level_layer = self.viewer.layers[name]
+        renderer = self.level_renderers[level]
+
+        self.fit_buffer(
+            level_layer,
+            renderer,
+            factor,
+            r_start,
+            r_stop,
+            c_start,
+            c_stop,
+        )
+
+        _, changed = renderer.render(
+            level_layer.data, current_frame, r_start, r_stop, c_start, c_stop
+        )
+        if changed:
+            level_layer.data = level_layer.data
+
+        self.hide_levels(keep=name)
+        level_layer.visible = True
+
+        renderer.prefetch(
+            self.frames_to_prefetch(current_frame),
+            r_start,
+            r_stop,
+            c_start,
+            c_stop,
+        )
+
+    def hide_levels(self, keep=None):
+        """
+        Hide labels layers of lower resolution levels.
+        """
+        for layer in self.viewer.layers:
+            if layer.name.startswith('Labels level ') and (layer.name != keep):
+                layer.visible = False
+
+    def cancel_prefetch(self):
+        """
+        Drop queued prefetching of all renderers.
+        """
+        self.renderer.cancel_prefetch()
+        for renderer in self.level_renderers.values():
+            renderer.cancel_prefetch()
+
+    def close_renderers(self):
+        """
+        Stop background work of all renderers.
+        """
+        self.refresh_timer.stop()
+        self.renderer.close()
+        for renderer in self.level_renderers.values():
+            renderer.close()
+
+    def show_overview(self, current_frame, r_start, r_stop, c_start, c_stop):
+        """
+        Show cells of the field of view as points,
+        aggregated on a grid without loading masks.
+        """
+
+        bin_size = max(r_stop - r_start, c_stop - c_start) / (
+            self.overview_bins
+        )
+
+        density = fdb.get_cell_density_in_view(
+            self.session,
+            current_frame,
+            r_start,
+            r_stop,
+            c_start,
+            c_stop,
+            bin_size,
+        )
+
+        point_size = max(bin_size, 5)
+
+        if self.overview_name in self.viewer.layers:
+            points = self.viewer.layers[self.overview_name]
+            points.data = density[:, :2]
+            points.size = point_size
+            points.visible = True
+
+        else:
+            self.viewer.add_points(
+                density[:, :2],
+                name=self.overview_name,
+                size=point_size,
+                face_color='yellow',
+                border_width=0,
+                opacity=0.6,
+            )
+
+            # keep working with the labels
+            self.viewer.layers.selection.active = self.labels
+
+    def hide_overview(self):
+        """
+        Hide the overview points when labels are displayed.
+        """
+        if self.overview_name in self.viewer.layers:
+            self.viewer.layers[self.overview_name].visible = False
+
+    def frames_to_prefetch(self, current_frame):
+        """
+        Neighbouring frames in the order they are likely to be visited.
+        """
+        frames_num = self.viewer.dims.nsteps[0]
+
+        frames = []
+        for shift in range(1, self.prefetch_frames + 1):
+            for t in [current_frame + shift, current_frame - shift]:
+                if 0 <= t < frames_num:
+                    frames.append(t)
+
+        return frames
+
     #########################################################
     # track navigation
     #########################################################
@@ -188,18 +549,11 @@ class TrackNavigationWidget(QWidget):
         current_frame = self.viewer.dims.current_step[0]
 
         # find the object
-        cell = (
-            self.session.query(CellDB)
-            .filter(
-                and_(CellDB.track_id == track_id, CellDB.t == current_frame)
-            )
-            .first()
-        )
+        position = self.track_position(track_id, current_frame)
 
-        if cell is not None:
+        if position is not None:
             # get the position
-            r = cell.row
-            c = cell.col
+            r, c = position
 
             # check if there is movement
             _, x, y = self.viewer.camera.center
@@ -215,6 +569,33 @@ class TrackNavigationWidget(QWidget):
             self.viewer.status = 'No object in this frame.'
             self.build_labels()
 
+    def track_position(self, track_id, current_frame):
+        """
+        Position of a track in a frame.
+        The trajectory of the track is loaded once and kept
+        until another track is asked for or cells are edited.
+        output:
+            (row, col) or None if the track has no cell in the frame
+        """
+
+        _, edits = fdb.get_cell_edits(self.session)
+
+        if (track_id != self.trajectory_track) or (
+            edits != self.trajectory_edits
+        ):
+            self.trajectory = fdb.get_track_trajectory(self.session, track_id)
+            self.trajectory_track = track_id
+            self.trajectory_edits = edits
+
+        ind = np.searchsorted(self.trajectory[:, 0], current_frame)
+
+        if (ind == len(self.trajectory)) or (
+            self.trajectory[ind, 0] != current_frame
+        ):
+            return None
+
+        return int(self.trajectory[ind, 1]), int(self.trajectory[ind, 2])
+
     def center_object_function(self):
         """
         Center the object.
@@ -227,26 +608,59 @@ class TrackNavigationWidget(QWidget):
 
         if curr_tr != 0:
 
-            curr_fr = self.viewer.dims.current_step[0]
-
             # find the pathway
-            tr = (
-                self.session.query(TrackDB).filter_by(track_id=curr_tr).first()
+            self.db_worker.submit(
+                fdb.get_track_span,
+                curr_tr,
+                callback=self.center_within_span,
+                error_callback=report_to_status(self.viewer),
+                key=(id(self), 'span'),
             )
 
-            # move time point if beyond boundary
-            if tr.t_begin > curr_fr:
-                self.viewer.dims.set_point(0, tr.t_begin)
-            elif tr.t_end < curr_fr:
-                self.viewer.dims.set_point(0, tr.t_end)
-
-            # center the cell
-            self.center_object_core_function()
-
         else:
             self.viewer.status = 'No object selected.'
             self.build_labels()
 
+    def center_within_span(self, span):
+        """
+        Center the object, moving the time point within the track first.
+        input:
+            span - (t_begin, t_end) of the track or None
+        """
+
+        if span is None:
+            self.viewer.status = 'No such track in the database.'
+            return
+
+        t_begin, t_end = span
+        curr_fr = self.viewer.dims.current_step[0]
+
+        # move time point if beyond boundary
+        if t_begin > curr_fr:
+            self.viewer.dims.set_point(0, t_begin)
+        elif t_end < curr_fr:
+            self.viewer.dims.set_point(0, t_end)
+
+        # center the cell
+        self.center_object_core_function()
+
+    def go_to_track_point(self, span, ind):
+        """
+        Move to the first (ind = 0) or the last (ind = 1) time point
+        of a track and center the cell.
+        input:
+            span - (t_begin, t_end) of the track or None
+        """
+
+        if span is None:
+            self.viewer.status = 'No such track in the database.'
+            return
+
+        self.viewer.dims.set_point(0, span[ind])
+
+        # center the cell
+        self.center_object_core_function()
+
     def add_start_track_btn(self):
         """
         Add a button to cut tracks.
@@ -262,16 +676,16 @@ class TrackNavigationWidget(QWidget):
         Go to the beginning of the track.
         """
         # find the beginning of a track
-        tr = self.labels.selected_label
-        t_begin = (
-            self.session.query(TrackDB).filter_by(track_id=tr).first().t_begin
-        )
+        tr = int(self.labels.selected_label)
 
         # move to the beginning of a track
-        self.viewer.dims.set_point(0, t_begin)
-
-        # center the cell
-        self.center_object_core_function()
+        self.db_worker.submit(
+            fdb.get_track_span,
+            tr,
+            callback=lambda span: self.go_to_track_point(span, 0),
+            error_callback=report_to_status(self.viewer),
+            key=(id(self), 'span'),
+        )
 
     def add_end_track_btn(self):
         """
@@ -287,17 +701,17 @@ class TrackNavigationWidget(QWidget):
         """
         Go to the last point in the track
         """
-        # find the beginning of a track
-        tr = self.labels.selected_label
-        t_end = (
-            self.session.query(TrackDB).filter_by(track_id=tr).first().t_end
-        )
+        # find the end of a track
+        tr = int(self.labels.selected_label)
 
         # move to the end of a track
-        self.viewer.dims.set_point(0, t_end)
-
-        # center the cell
-        self.center_object_core_function()
+        self.db_worker.submit(
+            fdb.get_track_span,
+            tr,
+            callback=lambda span: self.go_to_track_point(span, 1),
+            error_callback=report_to_status(self.viewer),
+            key=(id(self), 'span'),
+        )
 
     #########################################################
     # cell following
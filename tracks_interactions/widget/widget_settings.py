@@ -20,7 +20,11 @@ from sqlalchemy.orm import sessionmaker
 import napari
 import tracks_interactions.db.db_functions as fdb
 from tracks_interactions.widget.signal_graph_widget import CellGraphWidget
-from tracks_interactions.db.config_functions import testConfigFile, create_calculate_signals_function
+from tracks_interactions.db.config_functions import (
+    testConfigFile,
+    create_calculate_signals_function,
+)
+
 
 class SettingsWidget(QWidget):
     def __init__(
@@ -112,10 +116,10 @@ class SettingsWidget(QWidget):
             if status:
                 # display a message
                 self.viewer.status = 'Config file is correct.'
-                
+
                 # load config content
                 self.loadConfigFile(fileName)
-                
+
                 self.reorganizeWidgets()
             else:
                 # display a window with the error message
@@ -235,11 +239,21 @@ class SettingsWidget(QWidget):
             )
 
         # add labels to the viewer
-        empty_labels = np.zeros([data[0].shape[1], data[0].shape[2]]).astype(
-            int
-        )
+        # (only the viewport is held in memory, see TrackNavigationWidget)
+        empty_labels = np.zeros([1, 1], dtype=np.uint32)
+        frame_shape = (data[0].shape[1], data[0].shape[2])
+
+        # downsampling factors of the levels of multiscale images
+        levels = [round(data[0].shape[-1] / x.shape[-1]) for x in data]
+
         labels_layer = self.viewer.add_labels(
-            empty_labels, name='Labels', metadata={'persistent_label': -1}
+            empty_labels,
+            name='Labels',
+            metadata={
+                'persistent_label': -1,
+                'levels': levels,
+                'frame_shape': frame_shape,
+            },
         )
 
         # set labels settings